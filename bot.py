@@ -1,6 +1,8 @@
 from logging import FileHandler, Formatter, getLogger, DEBUG
 from nextcord import Guild, Interaction
 from nextcord.ext.commands import Bot, Context
+from classes import close_pools, set_pool_reader_count
+from httpclient import HTTPClient
 
 class TF2CCBot(Bot):
 	def __init__(
@@ -9,6 +11,7 @@ class TF2CCBot(Bot):
 		debug_level: int = DEBUG,
 		valid_guild_ids: tuple[int] = None,
 		cogs: tuple[str] = None,
+		db_reader_count: int = 2,
 		*args, **kwargs
 	):
 		super().__init__(*args, **kwargs)
@@ -16,6 +19,9 @@ class TF2CCBot(Bot):
 		self.valid_guild_ids = valid_guild_ids or tuple()
 		self.persistent_views_count = 0
 
+		# every database file gets one writer and this many reader connections
+		set_pool_reader_count(db_reader_count)
+
 		# set up logging to be used in all cogs
 		self.log = getLogger("debug")
 		logging_format = "[{asctime}][{filename}][{lineno:3}][{funcName}][{levelname}] {message}"
@@ -25,6 +31,9 @@ class TF2CCBot(Bot):
 		self.log.addHandler(log_handler)
 		self.log.setLevel(debug_level)
 
+		# shared connection pool, rate limits and retries for outbound http requests
+		self.http_client = HTTPClient(log = self.log)
+
 		# add cogs to the bot
 		if not cogs:
 			return
@@ -39,6 +48,15 @@ class TF2CCBot(Bot):
 		self.log.debug(f"Loaded cogs\n{self.loaded_cogs}")
 
 
+	async def close(self):
+		# stop the bot first so nothing else is written, then close the database and http connections
+		await super().close()
+		await close_pools()
+		self.log.debug("closed database connections")
+		await self.http_client.close()
+		self.log.debug(f"closed http connections: {self.http_client.stats}")
+
+
 	async def on_ready(self):
 		# this is called whenever the bot is ready to do things
 		# it may be called multiple times while the bot is alive
@@ -1,8 +1,13 @@
-from aiosqlite import Row, connect
+from aiosqlite import Connection, Row, connect
+from asyncio import Lock, Queue, Task, create_task, sleep, wait
+from math import ceil
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from logging import getLogger
 from nextcord import ButtonStyle, Color, Embed, Interaction, Member, User
 from nextcord.ext.commands import Context
-from nextcord.ext.menus import ButtonMenuPages, ListPageSource, MenuPagesBase, MenuPaginationButton
-from typing import Optional, Union
+from nextcord.ext.menus import ButtonMenuPages, ListPageSource, MenuPagesBase, MenuPaginationButton, PageSource
+from typing import AsyncIterator, Callable, Optional, Union
 
 
 
@@ -18,38 +23,219 @@ def get_tuple_vals(itr1: tuple, itr2: tuple) -> tuple[tuple]:
 	return tuple([(itm1, itm2) for itm1, itm2 in zip(itr1, itr2)])
 
 
+LOG = getLogger("debug") # the bot's log
+
+DEFAULT_READER_COUNT = 2
+
+
+class ADBPool:
+	"""Long-lived connections to one database file. Reads are spread over `reader_count` connections, writes go through a single writer."""
+	def __init__(self, db_name: str, reader_count: int = DEFAULT_READER_COUNT):
+		self.db_name = db_name
+		self.reader_count = max(1, reader_count)
+		self._writer: Optional[Connection] = None
+		self._readers: list[Connection] = list()
+		self._idle_readers: Queue[Optional[Connection]] = Queue()
+		self._waiting_readers = 0
+		self._write_lock = Lock()
+		self._open_lock = Lock()
+
+
+	@property
+	def is_open(self) -> bool:
+		return self._writer is not None
+
+
+	async def _connect(self) -> Connection:
+		conn = await connect(self.db_name)
+		conn.row_factory = Row
+		# WAL lets the readers keep reading while the writer commits
+		await conn.execute("PRAGMA journal_mode = WAL")
+		await conn.execute("PRAGMA synchronous = NORMAL")
+		await conn.execute("PRAGMA busy_timeout = 5000")
+		return conn
+
+
+	async def open(self):
+		"""Opens the writer and reader connections. Does nothing if the pool is already open."""
+		async with self._open_lock:
+			if self.is_open:
+				return
+			self._writer = await self._connect()
+			for _ in range(self.reader_count):
+				conn = await self._connect()
+				self._readers.append(conn)
+				self._idle_readers.put_nowait(conn)
+
+
+	async def close(self):
+		"""Closes every connection in the pool. The pool reopens on the next query."""
+		async with self._open_lock:
+			if not self.is_open:
+				return
+			async with self._write_lock:
+				await self._writer.close()
+				self._writer = None
+			for conn in self._readers:
+				await conn.close()
+			self._readers.clear()
+			# empty the queue instead of replacing it, readers already waiting on it get a `None` to wake them up so they reopen the pool
+			while not self._idle_readers.empty():
+				self._idle_readers.get_nowait()
+			for _ in range(self._waiting_readers):
+				self._idle_readers.put_nowait(None)
+
+
+	@asynccontextmanager
+	async def reader(self) -> AsyncIterator[Connection]:
+		"""Borrows a reader connection for the duration of the `async with` block."""
+		while True:
+			if not self.is_open:
+				await self.open()
+			self._waiting_readers += 1
+			try:
+				conn = await self._idle_readers.get()
+			finally:
+				self._waiting_readers -= 1
+			# `None` means the pool was closed while waiting, go round again to reopen it
+			if conn is not None:
+				break
+		try:
+			yield conn
+		finally:
+			# the pool may have been closed while this connection was borrowed
+			if conn in self._readers:
+				self._idle_readers.put_nowait(conn)
+
+
+	@asynccontextmanager
+	async def writer(self) -> AsyncIterator[Connection]:
+		"""Holds the writer connection for the duration of the `async with` block.
+Everything executed inside the block is committed as one transaction, or rolled back if an error is raised."""
+		while True:
+			if not self.is_open:
+				await self.open()
+			async with self._write_lock:
+				conn = self._writer
+				if conn is None:
+					continue # the pool was closed while waiting for the lock
+				try:
+					yield conn
+				except BaseException:
+					await conn.rollback()
+					raise
+				else:
+					await conn.commit()
+				return
+
+
+# one pool per database file, shared by every ADB and cog that uses that file
+_POOLS: dict[str, ADBPool] = dict()
+_reader_count = DEFAULT_READER_COUNT
+
+
+def set_pool_reader_count(reader_count: int):
+	"""Sets the amount of reader connections used by pools that have not been created yet."""
+	global _reader_count
+	_reader_count = reader_count
+
+
+def get_pool(db_name: str) -> ADBPool:
+	"""Returns the connection pool for `db_name`, creating it if necessary."""
+	pool = _POOLS.get(db_name)
+	if pool is None:
+		pool = _POOLS[db_name] = ADBPool(db_name, _reader_count)
+	return pool
+
+
+# every ADB with write-behind enabled, so queued edits can be flushed on shutdown
+_WRITE_BEHIND_DBS: list["ADB"] = list()
+
+
+async def close_pools():
+	"""Flushes any queued edits and closes all database connections. Called when the bot shuts down."""
+	for db in _WRITE_BEHIND_DBS:
+		await db.flush(cancel_timer = True)
+	for pool in _POOLS.values():
+		await pool.close()
+
+
+@dataclass(frozen = True)
+class ADBIndex:
+	"""An index that `ADB.make_table` creates on the table. `where` makes it a partial index that only holds rows matching it."""
+	name: str
+	columns: tuple[str]
+	where: str = ""
+	unique: bool = False
+
+	def create_str(self, table_name: str) -> str:
+		exec_str = f"CREATE {'UNIQUE ' if self.unique else ''}INDEX IF NOT EXISTS {self.name} ON {table_name} ({', '.join(self.columns)})"
+		return f"{exec_str} WHERE {self.where}" if self.where else exec_str
+
+
 class ADB:
-	def __init__(self, db_name: str, table_name: str, table_values: tuple[str], table_value_types: tuple[str]):
+	def __init__(
+		self,
+		db_name: str, table_name: str, table_values: tuple[str], table_value_types: tuple[str],
+		*, table_constraints: tuple[str] = (), indexes: tuple[ADBIndex] = (),
+		write_behind: bool = False, write_behind_delay: float = 5.0, write_behind_max: int = 100
+	):
 		self.db_name = db_name
 		self.table_name = table_name
 		self.table_column_names = table_values
 		self.table_column_types = table_value_types
+		self.table_constraints = table_constraints # e.g. a PRIMARY KEY over several columns
+		self.indexes = indexes
+
+		# write-behind - edits queued with `defer_edit_entry` are merged per entry
+		# and written in one transaction after `write_behind_delay` seconds or once `write_behind_max` entries are queued
+		self.write_behind = write_behind
+		self.write_behind_delay = write_behind_delay
+		self.write_behind_max = write_behind_max
+		self._pending: dict[tuple[str, Union[str, int]], dict[str, Union[str, int]]] = dict()
+		self._flush_task: Optional[Task] = None
+		self._flush_sleeping = False # the flush task is still waiting, so cancelling it can't interrupt a write
+		if write_behind:
+			_WRITE_BEHIND_DBS.append(self)
+
+
+	@property
+	def pool(self) -> ADBPool:
+		return get_pool(self.db_name)
+
+
+	def _mass_edit_str(self, key_names: tuple[str]) -> str:
+		return f"""
+UPDATE {self.table_name} 
+SET {",".join([f"{key_name} = ?" for key_name in key_names[:-1]])} 
+WHERE {key_names[-1]} = ?
+"""
 
 
 	async def make_table(self):
-		"""Creates the database file and table associated with this object."""
+		"""Creates the database file, table and indexes associated with this object."""
 		table_vals = get_tuple_vals(self.table_column_names, self.table_column_types)
+		table_defs = [f"{col_name} {col_type}" for col_name, col_type in table_vals] + list(self.table_constraints)
 		exec_str = f"""
 CREATE TABLE IF NOT EXISTS {self.table_name} 
-	({", ".join([f"{col_name} {col_type}" for col_name, col_type in table_vals])})
+	({", ".join(table_defs)})
 """
-		async with connect(self.db_name) as conn:
+		async with self.pool.writer() as conn:
 			await conn.execute(exec_str)
-			await conn.commit()
+			for index in self.indexes:
+				await conn.execute(index.create_str(self.table_name))
 
 
 	async def drop_table(self):
 		"""Deletes the database table associated with this object."""
-		async with connect(self.db_name) as conn:
+		async with self.pool.writer() as conn:
 			await conn.execute(f"DROP TABLE {self.table_name}")
-			await conn.commit()
 
 
 	async def reset_table(self):
 		"""Removes all entries in the database table."""
-		async with connect(self.db_name) as conn:
+		async with self.pool.writer() as conn:
 			await conn.execute(f"DELETE FROM {self.table_name}")
-			await conn.commit()
 
 
 	async def new_entry(self, starting_values: tuple[Union[str, int]], replace: bool = False):
@@ -58,9 +244,22 @@ CREATE TABLE IF NOT EXISTS {self.table_name}
 INSERT OR {"REPLACE" if replace else "IGNORE"} INTO {self.table_name} 
 VALUES ({",".join(["?"] * len(starting_values))})
 """
-		async with connect(self.db_name) as conn:
+		await self.flush()
+		async with self.pool.writer() as conn:
 			await conn.execute(exec_str, starting_values)
-			await conn.commit()
+
+
+	async def new_entries(self, starting_values: tuple[tuple[Union[str, int]]], replace: bool = False):
+		"""Adds many new entries to the database table in a single transaction. Optionally overwrites existing entries."""
+		if not starting_values:
+			return
+		exec_str = f"""
+INSERT OR {"REPLACE" if replace else "IGNORE"} INTO {self.table_name}
+VALUES ({",".join(["?"] * len(starting_values[0]))})
+"""
+		await self.flush()
+		async with self.pool.writer() as conn:
+			await conn.executemany(exec_str, starting_values)
 
 
 	async def get_entry(self, primary_key_name: str, primary_key_val: Union[str, int]) -> Optional[dict]:
@@ -69,17 +268,42 @@ VALUES ({",".join(["?"] * len(starting_values))})
 SELECT * FROM {self.table_name} 
 WHERE {primary_key_name} = ?
 """
-		async with connect(self.db_name) as conn:
-			conn.row_factory = Row
+		async with self.pool.reader() as conn:
 			rows = await conn.execute_fetchall(exec_str, (primary_key_val,))
-		return dict(rows[0]) if rows else None
+		if not rows:
+			return None
+		# include edits that have not been written yet
+		info = dict(rows[0])
+		info.update(self._pending.get((primary_key_name, primary_key_val), dict()))
+		return info
+
+
+	async def get_or_new_entries(self, primary_key_name: str, starting_values: tuple[tuple[Union[str, int]]]) -> list[dict]:
+		"""Adds any entries that don't exist yet and returns every requested entry in a single transaction.
+The primary key must be the first value of each tuple in `starting_values`."""
+		if not starting_values:
+			return list()
+		insert_str = f"""
+INSERT OR IGNORE INTO {self.table_name} 
+VALUES ({",".join(["?"] * len(starting_values[0]))})
+"""
+		primary_key_vals = tuple([values[0] for values in starting_values])
+		select_str = f"""
+SELECT * FROM {self.table_name} 
+WHERE {primary_key_name} IN ({",".join(["?"] * len(primary_key_vals))})
+"""
+		await self.flush()
+		async with self.pool.writer() as conn:
+			await conn.executemany(insert_str, starting_values)
+			rows = await conn.execute_fetchall(select_str, primary_key_vals)
+		return [dict(row) for row in rows]
 
 
 	async def get_all_entries(self, conditional: str = "", params: tuple[Union[str, int]] = None) -> list[dict]:
 		"""Returns all entries in the database table in a list."""
 		exec_str = f"SELECT * FROM {self.table_name} " + conditional
-		async with connect(self.db_name) as conn:
-			conn.row_factory = Row
+		await self.flush() # the conditional may filter on columns with queued edits
+		async with self.pool.reader() as conn:
 			if params:
 				rows = await conn.execute_fetchall(exec_str, params)
 			else:
@@ -87,6 +311,35 @@ WHERE {primary_key_name} = ?
 		return [dict(row) for row in rows]
 
 
+	async def fetch(self, exec_str: str, params: tuple[Union[str, int]] = None) -> list[dict]:
+		"""Runs a custom read-only query and returns the rows."""
+		await self.flush()
+		async with self.pool.reader() as conn:
+			rows = await conn.execute_fetchall(exec_str, params or tuple())
+		return [dict(row) for row in rows]
+
+
+	async def explain_query_plan(self, exec_str: str, params: tuple[Union[str, int]] = None) -> list[str]:
+		"""Returns the steps SQLite takes to run a query, e.g. `SEARCH pug_info USING INDEX pug_steam_id_idx (steam_id=?)`."""
+		rows = await self.fetch(f"EXPLAIN QUERY PLAN {exec_str}", params)
+		return [row["detail"] for row in rows]
+
+
+	async def execute(self, exec_str: str, params: tuple[Union[str, int]] = None) -> list[dict]:
+		"""Runs a custom write statement in its own transaction and returns any rows it produced (e.g. with `RETURNING`)."""
+		await self.flush()
+		async with self.pool.writer() as conn:
+			rows = await conn.execute_fetchall(exec_str, params or tuple())
+		return [dict(row) for row in rows]
+
+
+	async def execute_many(self, exec_str: str, params: tuple[tuple[Union[str, int]]]):
+		"""Runs a custom write statement once for every tuple in `params`, all in one transaction."""
+		await self.flush()
+		async with self.pool.writer() as conn:
+			await conn.executemany(exec_str, params)
+
+
 	async def edit_entry(self, primary_key_name: str, primary_key_val: Union[str, int], **kwargs):
 		"""Edits an existing entry in the database table. If the entry does not exist, then an error is thrown."""
 		exec_str = f"""
@@ -94,29 +347,48 @@ UPDATE {self.table_name}
 SET {",".join([f"{col_name} = ?" for col_name, _ in kwargs.items()])} 
 WHERE {primary_key_name} = ?
 """
-		async with connect(self.db_name) as conn:
+		await self.flush()
+		async with self.pool.writer() as conn:
 			await conn.execute(exec_str, tuple(kwargs.values()) + (primary_key_val,))
-			await conn.commit()
 
 
 	async def mass_edit_entry(self, key_names: tuple[str], key_vals: tuple[tuple[Union[str, int]]]):
 		'''Primary key name goes last in the `key_names` arg.'''
+		exec_str = self._mass_edit_str(key_names)
+		await self.flush()
+		async with self.pool.writer() as conn:
+			await conn.executemany(exec_str, key_vals)
+
+
+	async def mass_increment_entry(self, key_names: tuple[str], key_vals: tuple[tuple[Union[str, int]]], *, conn: Connection = None):
+		"""Adds the values to the existing column values instead of overwriting them, all in one transaction.
+Primary key name goes last in the `key_names` arg. Pass `conn` from `transaction()` to make it part of a bigger transaction."""
 		exec_str = f"""
 UPDATE {self.table_name} 
-SET {",".join([f"{key_name} = ?" for key_name in key_names[:-1]])} 
+SET {",".join([f"{key_name} = {key_name} + ?" for key_name in key_names[:-1]])} 
 WHERE {key_names[-1]} = ?
 """
-		async with connect(self.db_name) as conn:
+		if conn is not None:
+			await conn.executemany(exec_str, key_vals)
+			return
+		async with self.transaction() as conn:
 			await conn.executemany(exec_str, key_vals)
-			await conn.commit()
+
+
+	@asynccontextmanager
+	async def transaction(self) -> AsyncIterator[Connection]:
+		"""Writes queued edits, then holds the writer connection so statements on any table in this database file commit together."""
+		await self.flush()
+		async with self.pool.writer() as conn:
+			yield conn
 
 
 	async def delete_entry(self, primary_key_name: str, primary_key_val: Union[str, int]):
 		"""Deletes an entry from the database table."""
 		exec_str = f"DELETE FROM {self.table_name} WHERE {primary_key_name} = ?"
-		async with connect(self.db_name) as conn:
+		await self.flush()
+		async with self.pool.writer() as conn:
 			await conn.execute(exec_str, (primary_key_val,))
-			await conn.commit()
 
 
 	async def mass_delete_entry(self, key_names: tuple[str], key_vals: tuple[tuple[Union[str, int]]]):
@@ -124,9 +396,81 @@ WHERE {key_names[-1]} = ?
 DELETE FROM {self.table_name} 
 WHERE {" AND ".join([f"{key_name} = ?" for key_name in key_names])}
 """
-		async with connect(self.db_name) as conn:
+		await self.flush()
+		async with self.pool.writer() as conn:
 			await conn.executemany(exec_str, key_vals)
-			await conn.commit()
+
+
+	async def defer_edit_entry(self, primary_key_name: str, primary_key_val: Union[str, int], **kwargs):
+		"""Queues an edit to an existing entry instead of writing it immediately.
+Repeated edits to the same entry are merged, and everything queued is written in one transaction by `flush`.
+If write-behind is disabled for this table, then the edit is written immediately."""
+		if not self.write_behind:
+			await self.edit_entry(primary_key_name, primary_key_val, **kwargs)
+			return
+
+		self._pending.setdefault((primary_key_name, primary_key_val), dict()).update(kwargs)
+		if len(self._pending) >= self.write_behind_max:
+			await self.flush()
+		elif self._flush_task is None or self._flush_task.done():
+			self._flush_task = create_task(self._delayed_flush())
+
+
+	async def _delayed_flush(self):
+		self._flush_sleeping = True
+		try:
+			await sleep(self.write_behind_delay)
+		finally:
+			self._flush_sleeping = False
+		try:
+			await self.flush()
+		except Exception as error:
+			# the edits were put back, so try again later instead of leaving them queued with no timer
+			LOG.error(f"write-behind flush of {self.table_name} failed, retrying in {self.write_behind_delay}s: {error!r}")
+			self._flush_task = create_task(self._delayed_flush())
+
+
+	async def flush(self, cancel_timer: bool = False):
+		"""Writes all queued edits in one transaction.
+With `cancel_timer` a waiting flush task is cancelled, and one that is already writing is waited for so its edits aren't lost."""
+		while cancel_timer and self._flush_task is not None and not self._flush_task.done():
+			if self._flush_sleeping:
+				self._flush_task.cancel()
+				break
+			await wait((self._flush_task,)) # may have scheduled a retry, which the next loop cancels
+		if not self._pending:
+			return
+
+		pending = self._pending
+		self._pending = dict()
+
+		# entries that had the same columns edited are written with one executemany
+		groups: dict[tuple[str], list[tuple[Union[str, int]]]] = dict()
+		for (primary_key_name, primary_key_val), edits in pending.items():
+			key_names = tuple(edits.keys()) + (primary_key_name,)
+			groups.setdefault(key_names, list()).append(tuple(edits.values()) + (primary_key_val,))
+
+		try:
+			async with self.pool.writer() as conn:
+				for key_names, key_vals in groups.items():
+					await conn.executemany(self._mass_edit_str(key_names), key_vals)
+		except BaseException:
+			# put the edits back without overwriting anything queued in the meantime
+			for key, edits in pending.items():
+				edits.update(self._pending.get(key, dict()))
+				self._pending[key] = edits
+			raise
+
+
+def _page_embed(menu: MenuPagesBase, source: PageSource, entries: list[Union[str, tuple[str, str]]]) -> Embed:
+	embed = Embed(title = source.embed_title or "", color = source.embed_color)
+	if entries and isinstance(entries[0], str):
+		embed.description = "\n".join(entries)
+	else:
+		for field_name, field_value in entries:
+			embed.add_field(name = field_name, value = field_value, inline = source.embed_inline if source.embed_inline is not None else True)
+	embed.set_footer(text = f"Page {menu.current_page + 1} / {source.get_max_pages()}")
+	return embed
 
 
 class MyPageSource(ListPageSource):
@@ -138,19 +482,130 @@ class MyPageSource(ListPageSource):
 		self.embed_color = embed_color if embed_color else Color.dark_grey()
 
 	async def format_page(self, menu: MenuPagesBase, entries: list[Union[str, tuple[str, str]]]) -> Embed:
-		embed = Embed(title = self.embed_title or "", color = self.embed_color)
-		if isinstance(entries[0], str):
-			embed.description = "\n".join(entries)
-		else:
-			for field_name, field_value in entries:
-				embed.add_field(name = field_name, value = field_value, inline = self.embed_inline if self.embed_inline is not None else True)
-		embed.set_footer(text = f"Page {menu.current_page + 1} / {self.get_max_pages()}")
+		return _page_embed(menu, self, entries)
+
+
+
+class KeysetPageSource(PageSource):
+	"""Reads one page of rows at a time from an ADB table instead of loading the whole table up front.
+
+Pages are found with keyset pagination on `order_by`, whose last column must be unique (usually the primary key).
+`conditional` is a plain WHERE expression (no `WHERE`/`ORDER BY`) and `format_entries` turns the rows of one page
+into the str or (name, value) entries that `MyPageSource` takes. The next page is fetched in the background while the current one is shown."""
+	def __init__(
+		self, db: "ADB", per_page: int, order_by: tuple[str], format_entries: Callable[[list[dict]], list[Union[str, tuple[str, str]]]],
+		*, conditional: str = "", params: tuple[Union[str, int]] = (), descending: bool = True,
+		embed_title: str = None, embed_inline: bool = None, embed_color: Color = None
+	):
+		assert per_page <= 25, "KeysetPageSource error - per_page must be <= 25"
+		self.db = db
+		self.per_page = per_page
+		self.order_by = order_by
+		self.format_entries = format_entries
+		self.conditional = conditional
+		self.params = params
+		self.descending = descending
+		self.embed_title = embed_title
+		self.embed_inline = embed_inline
+		self.embed_color = embed_color if embed_color else Color.dark_grey()
+		self.row_count = 0
+		self._pages: dict[int, list[dict]] = dict()
+		self._fetching: dict[int, Task] = dict()
+
+
+	async def prepare(self):
+		where = f"WHERE {self.conditional}" if self.conditional else ""
+		rows = await self.db.fetch(f"SELECT COUNT(*) AS row_count FROM {self.db.table_name} {where}", self.params)
+		self.row_count = rows[0]["row_count"]
+
+
+	async def count(self) -> int:
+		"""Counts the matching rows the first time it is called and returns the count.
+Menus prepare their source through the same check, so a menu started afterwards doesn't count again."""
+		await self._prepare_once()
+		return self.row_count
+
+
+	def is_paginating(self) -> bool:
+		return self.row_count > self.per_page
+
+
+	def get_max_pages(self) -> int:
+		return max(1, ceil(self.row_count / self.per_page))
+
+
+	def select_str(self, cursor: Optional[tuple], *, forward: bool, limit: int, offset: int = 0) -> tuple[str, tuple]:
+		"""Returns the query and params that read `limit` rows after `cursor` (the `order_by` values of the last row seen).
+`forward` walks the pages in display order, backward walks them from the end."""
+		descending = self.descending == forward
+		conditions = [f"({self.conditional})"] if self.conditional else []
+		params = list(self.params)
+		if cursor is not None:
+			conditions.append(f"({', '.join(self.order_by)}) {'<' if descending else '>'} ({', '.join('?' for _ in self.order_by)})")
+			params += list(cursor)
+		direction = "DESC" if descending else "ASC"
+		exec_str = f"""
+SELECT * FROM {self.db.table_name}
+{"WHERE " + " AND ".join(conditions) if conditions else ""}
+ORDER BY {", ".join(f"{col} {direction}" for col in self.order_by)}
+LIMIT {limit} OFFSET {offset}
+"""
+		return exec_str, tuple(params)
+
+
+	def _cursor(self, row: dict) -> tuple:
+		return tuple(row[col] for col in self.order_by)
+
+
+	async def _fetch_page(self, page_number: int) -> list[dict]:
+		cursor, forward, limit, offset = None, True, self.per_page, 0
+		if page_number == 0:
+			pass
+		elif self._pages.get(page_number - 1):
+			cursor = self._cursor(self._pages[page_number - 1][-1])
+		elif self._pages.get(page_number + 1):
+			cursor, forward = self._cursor(self._pages[page_number + 1][0]), False
+		elif page_number == self.get_max_pages() - 1:
+			forward, limit = False, self.row_count - page_number * self.per_page
+		else: # no neighbouring page to continue from
+			offset = page_number * self.per_page
+
+		exec_str, params = self.select_str(cursor, forward = forward, limit = limit, offset = offset)
+		rows = await self.db.fetch(exec_str, params)
+		if not forward:
+			rows.reverse()
+		self._pages[page_number] = rows
+		return rows
+
+
+	def _start_fetch(self, page_number: int) -> Task:
+		task = self._fetching.get(page_number)
+		if task is None:
+			task = create_task(self._fetch_page(page_number))
+			task.add_done_callback(lambda _: self._fetching.pop(page_number, None))
+			self._fetching[page_number] = task
+		return task
+
+
+	async def get_page(self, page_number: int) -> list[dict]:
+		rows = self._pages.get(page_number)
+		if rows is None:
+			rows = await self._start_fetch(page_number)
+		if page_number + 1 < self.get_max_pages() and page_number + 1 not in self._pages:
+			self._start_fetch(page_number + 1) # prefetch while this page is being looked at
+		return rows
+
+
+	async def format_page(self, menu: MenuPagesBase, rows: list[dict]) -> Embed:
+		embed = _page_embed(menu, self, self.format_entries(rows))
+		if not embed.description and not embed.fields:
+			embed.description = "Nothing to show on this page."
 		return embed
 
 
 
 class MyButtonMenuPages(ButtonMenuPages, inherit_buttons = False):
-	def __init__(self, *, source: ListPageSource, timeout: int, delete_after: int, delete_message_after: bool, clear_buttons_after: bool):
+	def __init__(self, *, source: PageSource, timeout: int, delete_after: int, delete_message_after: bool, clear_buttons_after: bool):
 		super().__init__(source, timeout = timeout, delete_message_after = delete_message_after, clear_buttons_after = clear_buttons_after)
 		self.add_item(MenuPaginationButton(emoji = self.FIRST_PAGE, style = ButtonStyle.blurple))
 		self.add_item(MenuPaginationButton(emoji = self.PREVIOUS_PAGE, style = ButtonStyle.blurple))
@@ -203,4 +658,23 @@ Possible `kwargs` include:\n
 		interaction = info_obj if isinstance(info_obj, Interaction) else None,
 		ephemeral = kwargs.get("ephemeral", False),
 		wait = kwargs.get("wait", False)
-	)
\ No newline at end of file
+	)
+
+
+async def send_lazy_menu_pages(source: KeysetPageSource, info_obj: Union[Context, Interaction], **kwargs):
+	"""Same as `send_menu_pages`, but pages are read from the database by `source` as they are shown.\n
+Possible `kwargs` include `timeout`, `ephemeral`, `wait`, `delete_after`, `delete_message_after` and `clear_buttons_after`."""
+	await source.count() # the menu needs the page count before it is made
+	menu = MyButtonMenuPages(
+		source = source,
+		timeout = kwargs.get("timeout", 60),
+		delete_after = kwargs.get("delete_after", 0),
+		delete_message_after = kwargs.get("delete_message_after", False),
+		clear_buttons_after = kwargs.get("clear_buttons_after", True)
+	)
+	await menu.start(
+		ctx = info_obj if isinstance(info_obj, Context) else None,
+		interaction = info_obj if isinstance(info_obj, Interaction) else None,
+		ephemeral = kwargs.get("ephemeral", False),
+		wait = kwargs.get("wait", False)
+	)
@@ -7,7 +7,7 @@ from nextcord.ext.commands.errors import MissingAnyRole, CommandError, NoPrivate
 from nextcord.ext.application_checks.errors import ApplicationMissingAnyRole
 from typing import Union
 from .commenthelper import comment_add, comment_edit, comment_list, comment_remove, comment_role_add, comment_role_remove, valid_roles_list
-from .CommentDB import get_all_role_ids
+from .CommentDB import get_role_id_set, load_role_whitelists, make_comment_tables, migrate_legacy_tables
 
 
 def check_user_roles(is_prefix_cmd: bool):
@@ -18,14 +18,13 @@ def check_user_roles(is_prefix_cmd: bool):
 		if member.guild_permissions.manage_guild:
 			return True
 		guild_id = info_obj.guild.id
-		role_ids = await get_all_role_ids(guild_id = guild_id)
+		role_ids = await get_role_id_set(guild_id = guild_id)
 		if not role_ids:
 			err = "This guild has not permitted any roles to use this commands."
 			raise CommandError(err) if isinstance(info_obj, Context) else ApplicationError(err)
-		for role_id in role_ids:
-			if member.get_role(role_id):
-				return True
-		raise MissingAnyRole(role_ids) if isinstance(info_obj, Context) else ApplicationMissingAnyRole(role_ids)
+		if not role_ids.isdisjoint(role.id for role in member.roles):
+			return True
+		raise MissingAnyRole(list(role_ids)) if isinstance(info_obj, Context) else ApplicationMissingAnyRole(list(role_ids))
 	return prf_check(predicate) if is_prefix_cmd else app_check(predicate)
 
 
@@ -34,6 +33,13 @@ class CommentCog(Cog, name = "User Comments"):
 		self.bot = bot
 
 
+	@Cog.listener(name = "on_ready")
+	async def on_ready(self):
+		await make_comment_tables()
+		await migrate_legacy_tables()
+		await load_role_whitelists()
+
+
 	@slash_command(name = "comment", dm_permission = False)
 	@app_guild_only()
 	@check_user_roles(is_prefix_cmd = False)
@@ -1,64 +1,155 @@
-from sqlite3 import OperationalError
+from asyncio import Lock, sleep
 from typing import Dict, List, Union
 from nextcord import Guild, Role, User
 from nextcord.utils import utcnow
-from .static import COMMENT_TABLE_VALUES, VALID_ROLES_TABLE_VALUES, CommentInfo, UserComments, get_db
+from .static import COMMENT_DB, COMMENT_SUBJECT_ID, COMMENT_TABLE_VALUES, LEGACY_COMMENT_TABLE_NAME, LEGACY_VALID_ROLES_TABLE_NAME, VALID_ROLES_DB, VALID_ROLES_TABLE_VALUES, CommentInfo, UserComments
+
+
+# user ids / guild ids that still have an old per-user / per-guild table waiting to be copied over
+_legacy_comment_ids: set[int] = set()
+_legacy_role_ids: set[int] = set()
+_migration_lock = Lock()
+# guild id -> whitelisted role ids, filled by load_role_whitelists and kept up to date by add_role/remove_role
+_guild_role_ids: dict[int, set[int]] = dict()
+
+
+async def make_comment_tables():
+	"""Creates the comment and valid role tables and finds any old tables that still need to be migrated."""
+	await COMMENT_DB.make_table()
+	await VALID_ROLES_DB.make_table()
+
+	legacy_comments_prefix = LEGACY_COMMENT_TABLE_NAME.format(obj_id = "")
+	legacy_roles_prefix = LEGACY_VALID_ROLES_TABLE_NAME.format(obj_id = "")
+	rows = await COMMENT_DB.fetch("SELECT name FROM sqlite_master WHERE type = 'table'")
+	for row in rows:
+		table_name: str = row["name"]
+		if table_name.startswith(legacy_comments_prefix) and table_name[len(legacy_comments_prefix):].isdigit():
+			_legacy_comment_ids.add(int(table_name[len(legacy_comments_prefix):]))
+		elif table_name.startswith(legacy_roles_prefix) and table_name[len(legacy_roles_prefix):].isdigit():
+			_legacy_role_ids.add(int(table_name[len(legacy_roles_prefix):]))
+
+
+async def _migrate_legacy_table(obj_id: int, *, is_comment: bool):
+	# copies one old table into the shared table and drops it in the same transaction
+	legacy_ids = _legacy_comment_ids if is_comment else _legacy_role_ids
+	if obj_id not in legacy_ids:
+		return
+
+	async with _migration_lock:
+		if obj_id not in legacy_ids:
+			return # migrated while waiting for the lock
+
+		if is_comment:
+			table_name = LEGACY_COMMENT_TABLE_NAME.format(obj_id = obj_id)
+			exec_str = f"""
+INSERT OR IGNORE INTO {COMMENT_DB.table_name}
+SELECT ?, {", ".join(COMMENT_TABLE_VALUES)} FROM {table_name}
+"""
+		else:
+			table_name = LEGACY_VALID_ROLES_TABLE_NAME.format(obj_id = obj_id)
+			exec_str = f"""
+INSERT OR IGNORE INTO {VALID_ROLES_DB.table_name}
+SELECT ?, role_id FROM {table_name}
+"""
+		async with COMMENT_DB.pool.writer() as conn:
+			await conn.execute(exec_str, (obj_id,))
+			await conn.execute(f"DROP TABLE {table_name}")
+		legacy_ids.discard(obj_id)
+	#JBOTLOG.debug(f"migrated {table_name}")
+
+
+async def migrate_legacy_tables() -> int:
+	"""Copies every old `comments{user_id}` and `valid_roles{guild_id}` table into the shared tables.
+
+Each old table is moved in its own short transaction, so commands keep working while this runs.
+Commands that need a user or guild that has not been moved yet will move it first. Returns the amount of tables moved."""
+	migrated = 0
+	for user_id in list(_legacy_comment_ids):
+		await _migrate_legacy_table(user_id, is_comment = True)
+		migrated += 1
+		await sleep(0) # let other tasks use the database in between tables
+	for guild_id in list(_legacy_role_ids):
+		await _migrate_legacy_table(guild_id, is_comment = False)
+		migrated += 1
+		await sleep(0)
+	return migrated
+
+
+async def delete_all_comments(*, user_id: int = None, user: User = None):
+	"""Deletes every comment about the specified User."""
+	assert user_id or user, "delete_all_comments error - user_id or user must be specified."
+	await _migrate_legacy_table(user_id or user.id, is_comment = True)
+	await COMMENT_DB.execute(f"DELETE FROM {COMMENT_DB.table_name} WHERE {COMMENT_SUBJECT_ID} = ?", (user_id or user.id,))
+	#JBOTLOG.debug(f"deleted all comments for {user_id or user.id}")
+
+
+async def new_comment(*, user_id: int = None, user: User = None, **payload: Dict[str, Union[int, str]]) -> int:
+	"""Adds a new comment. `payload` must contain the `guild_id`, `staff_id`, and `comment`.
+
+	Returns the `comment_id` of the new comment."""
+	assert user_id or user, "new_comment error - user_id or user must be specified."
+	assert COMMENT_TABLE_VALUES[1] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[1]} must be provided."
+	assert COMMENT_TABLE_VALUES[2] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[2]} must be provided."
+	assert COMMENT_TABLE_VALUES[4] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[4]} must be provided."
 
+	await _migrate_legacy_table(user_id or user.id, is_comment = True)
+	# the next id is read off the primary key index inside the insert, so this doesn't depend on how many comments the user has
+	exec_str = f"""
+INSERT INTO {COMMENT_DB.table_name} ({COMMENT_SUBJECT_ID}, {", ".join(COMMENT_TABLE_VALUES)})
+SELECT ?, COALESCE(MAX({COMMENT_TABLE_VALUES[0]}), 0) + 1, ?, ?, ?, ?
+FROM {COMMENT_DB.table_name} WHERE {COMMENT_SUBJECT_ID} = ?
+RETURNING {COMMENT_TABLE_VALUES[0]}
+"""
+	rows = await COMMENT_DB.execute(exec_str, (
+		user_id or user.id,
+		payload.get(COMMENT_TABLE_VALUES[1]),
+		payload.get(COMMENT_TABLE_VALUES[2]),
+		int(utcnow().timestamp()),
+		payload.get(COMMENT_TABLE_VALUES[4]),
+		user_id or user.id
+	))
+	#JBOTLOG.debug(f"added new comment to {user_id or user.id}")
+	return rows[0][COMMENT_TABLE_VALUES[0]]
 
-async def new_comment_table(*, user_id: int = None, user: User = None):
-	"""Creates a new table for the specified User if a table doesn't exist."""
-	assert user_id or user, "new_comment_table error - user_id or user must be specified."
-	db = get_db(user_id, user, is_comment = True)
-	await db.make_table()
-	#JBOTLOG.debug(f"new comment table for {user_id or user.id}")
 
+def _comment_guard_str() -> str:
+	# matches the comment only if the user has comments in this guild and the staff member may change it
+	return f"""{COMMENT_SUBJECT_ID} = ? AND {COMMENT_TABLE_VALUES[0]} = ?
+AND EXISTS (SELECT 1 FROM {COMMENT_DB.table_name} WHERE {COMMENT_TABLE_VALUES[1]} = ? AND {COMMENT_SUBJECT_ID} = ?)
+AND (? OR ({COMMENT_TABLE_VALUES[1]} = ? AND {COMMENT_TABLE_VALUES[2]} = ?))"""
 
-async def del_comment_table(*, user_id: int = None, user: User = None):
-	"""Deletes the table for the specified User."""
-	assert user_id or user, "del_comment_table error - user_id or user must be specified."
-	db = get_db(user_id, user, is_comment = True)
-	await db.drop_table()
-	#JBOTLOG.debug(f"dropped comment table for {user_id or user.id}")
 
+def _comment_guard_params(subject_id: int, override: bool, payload: Dict[str, Union[int, str]]) -> tuple:
+	return (
+		subject_id,
+		payload.get(COMMENT_TABLE_VALUES[0]),
+		payload.get(COMMENT_TABLE_VALUES[1]),
+		subject_id,
+		override,
+		payload.get(COMMENT_TABLE_VALUES[1]),
+		payload.get(COMMENT_TABLE_VALUES[2])
+	)
 
-async def new_comment(*, user_id: int = None, user: User = None, **payload: Dict[str, Union[int, str]]):
-	"""Adds a new comment. `payload` must contain the `guild_id`, `staff_id`, and `comment`."""
-	assert user_id or user, "new_comment error - user_id or user must be specified."
-	assert COMMENT_TABLE_VALUES[1] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[1]} must be provided."
-	assert COMMENT_TABLE_VALUES[2] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[2]} must be provided."
-	assert COMMENT_TABLE_VALUES[4] in payload, f"new_comment error - {COMMENT_TABLE_VALUES[4]} must be provided."
 
-	user_comments = await get_all_comments(user_id = user_id, user = user)
-	last_comment = user_comments.last_comment
-	next_comment_id = last_comment.comment_id + 1 if last_comment else 1
-	db = get_db(user_id, user, is_comment = True)
-	try:
-		await db.new_entry((
-			next_comment_id,
-			payload.get(COMMENT_TABLE_VALUES[1]),
-			payload.get(COMMENT_TABLE_VALUES[2]),
-			int(utcnow().timestamp()),
-			payload.get(COMMENT_TABLE_VALUES[4])
-		))
-	except OperationalError:
-		await new_comment_table(user_id = user_id, user = user)
-		await db.new_entry((
-			next_comment_id,
-			payload.get(COMMENT_TABLE_VALUES[1]),
-			payload.get(COMMENT_TABLE_VALUES[2]),
-			int(utcnow().timestamp()),
-			payload.get(COMMENT_TABLE_VALUES[4])
-		))
-	#JBOTLOG.debug(f"added new comment to {user_id or user.id}")
+async def _comment_fail_code(subject_id: int, comment_id: int, guild_id: int) -> int:
+	# only runs when the guarded statement matched nothing, to tell the caller why
+	exec_str = f"""
+SELECT
+EXISTS (SELECT 1 FROM {COMMENT_DB.table_name} WHERE {COMMENT_TABLE_VALUES[1]} = ? AND {COMMENT_SUBJECT_ID} = ?) AS has_comments,
+EXISTS (SELECT 1 FROM {COMMENT_DB.table_name} WHERE {COMMENT_SUBJECT_ID} = ? AND {COMMENT_TABLE_VALUES[0]} = ?) AS has_comment
+"""
+	rows = await COMMENT_DB.fetch(exec_str, (guild_id, subject_id, subject_id, comment_id))
+	if not rows[0]["has_comments"]:
+		return 3
+	if not rows[0]["has_comment"]:
+		return 1
+	return 2
 
 
 async def get_all_comments(*, user_id: int = None, user: User = None) -> UserComments:
 	assert user_id or user, "get_all_comments error - user_id or user must be specified."
-	db = get_db(user_id, user, is_comment = True)
-	try:
-		all_comment_dicts = await db.get_all_entries()
-	except OperationalError:
-		all_comment_dicts = list()
+	await _migrate_legacy_table(user_id or user.id, is_comment = True)
+	all_comment_dicts = await COMMENT_DB.get_all_entries(f"WHERE {COMMENT_SUBJECT_ID} = ?", (user_id or user.id,))
 	#JBOTLOG.debug(f"getting all comments for {user_id or user.id}")
 	return UserComments([CommentInfo(info) for info in all_comment_dicts])
 
@@ -73,28 +164,17 @@ async def edit_comment(*, user_id: int = None, user: User = None, override: bool
 	assert COMMENT_TABLE_VALUES[2] in payload, f"edit_comment error - {COMMENT_TABLE_VALUES[2]} must be provided."
 	assert COMMENT_TABLE_VALUES[4] in payload, f"edit_comment error - {COMMENT_TABLE_VALUES[4]} must be provided."
 
-	user_comments = await get_all_comments(user_id = user_id, user = user)
-	if not user_comments.comment_count(payload.get(COMMENT_TABLE_VALUES[1])):
-		return 3
-	comment_info = user_comments.get_comment(payload.get(COMMENT_TABLE_VALUES[0]))
-
-	if not comment_info:
-		#JBOTLOG.debug("edit_comment - invalid comment_id")
-		return 1
-
-	elif not override and (comment_info.staff_id != payload.get(COMMENT_TABLE_VALUES[2]) or comment_info.guild_id != payload.get(COMMENT_TABLE_VALUES[1])):
+	await _migrate_legacy_table(user_id or user.id, is_comment = True)
+	exec_str = f"""
+UPDATE {COMMENT_DB.table_name}
+SET {COMMENT_TABLE_VALUES[4]} = ?
+WHERE {_comment_guard_str()}
+RETURNING {COMMENT_TABLE_VALUES[0]}
+"""
+	rows = await COMMENT_DB.execute(exec_str, (payload.get(COMMENT_TABLE_VALUES[4]),) + _comment_guard_params(user_id or user.id, override, payload))
+	if not rows:
 		#JBOTLOG.debug("edit_comment - could not edit comment")
-		return 2
-
-	db = get_db(user_id, user, is_comment = True)
-	new_payload = {
-		COMMENT_TABLE_VALUES[4]: payload.get(COMMENT_TABLE_VALUES[4])
-	}
-	await db.edit_entry(
-		COMMENT_TABLE_VALUES[0],
-		payload.get(COMMENT_TABLE_VALUES[0]),
-		**new_payload
-	)
+		return await _comment_fail_code(user_id or user.id, payload.get(COMMENT_TABLE_VALUES[0]), payload.get(COMMENT_TABLE_VALUES[1]))
 	#JBOTLOG.debug(f"edited comment for {user_id or user.id}")
 	return 0
 
@@ -108,67 +188,66 @@ async def delete_comment(*, user_id: int = None, user: User = None, override: bo
 	assert COMMENT_TABLE_VALUES[1] in payload, f"delete_comment error - {COMMENT_TABLE_VALUES[1]} must be provided."
 	assert COMMENT_TABLE_VALUES[2] in payload, f"delete_comment error - {COMMENT_TABLE_VALUES[2]} must be provided."
 
-	user_comments = await get_all_comments(user_id = user_id, user = user)
-	if not user_comments.comment_count(payload.get(COMMENT_TABLE_VALUES[1])):
-		return 3
-	comment_info = user_comments.get_comment(payload.get(COMMENT_TABLE_VALUES[0]))
-
-	if not comment_info:
-		#JBOTLOG.debug("delete_comment - invalid comment_id")
-		return 1
-
-	elif not override and (comment_info.staff_id != payload.get(COMMENT_TABLE_VALUES[2]) or comment_info.guild_id != payload.get(COMMENT_TABLE_VALUES[1])):
+	await _migrate_legacy_table(user_id or user.id, is_comment = True)
+	exec_str = f"""
+DELETE FROM {COMMENT_DB.table_name}
+WHERE {_comment_guard_str()}
+RETURNING {COMMENT_TABLE_VALUES[0]}
+"""
+	rows = await COMMENT_DB.execute(exec_str, _comment_guard_params(user_id or user.id, override, payload))
+	if not rows:
 		#JBOTLOG.debug("delete_comment - could not delete comment")
-		return 2
-
-	db = get_db(user_id, user, is_comment = True)
-	await db.delete_entry(COMMENT_TABLE_VALUES[0], payload.get(COMMENT_TABLE_VALUES[0]))
+		return await _comment_fail_code(user_id or user.id, payload.get(COMMENT_TABLE_VALUES[0]), payload.get(COMMENT_TABLE_VALUES[1]))
 	#JBOTLOG.debug(f"deleted comment for {user_id or user.id}")
 	return 0
 
 
-async def new_roles_table(*, guild_id: int = None, guild: Guild = None):
-	assert guild_id or guild, "new_roles_table error - guild_id or guild must be specified."
-	db = get_db(guild_id, guild, is_comment = False)
-	await db.make_table()
-	#JBOTLOG.debug(f"new roles table for {guild_id or guild.id}")
+async def load_role_whitelists():
+	"""Loads the role whitelist of every guild into memory."""
+	all_role_dicts = await VALID_ROLES_DB.get_all_entries()
+	guild_role_ids: dict[int, set[int]] = dict()
+	for role_dict in all_role_dicts:
+		guild_role_ids.setdefault(role_dict[VALID_ROLES_TABLE_VALUES[0]], set()).add(role_dict[VALID_ROLES_TABLE_VALUES[1]])
+	_guild_role_ids.clear()
+	_guild_role_ids.update(guild_role_ids)
+	#JBOTLOG.debug(f"loaded role whitelists for {len(guild_role_ids)} guilds")
+
+
+async def get_role_id_set(*, guild_id: int = None, guild: Guild = None) -> set[int]:
+	"""Returns the cached role whitelist of a guild, reading it from the database only the first time. Do not modify the returned set."""
+	assert guild_id or guild, "get_role_id_set error - guild_id or guild must be specified."
+	role_ids = _guild_role_ids.get(guild_id or guild.id)
+	if role_ids is not None:
+		return role_ids
+
+	await _migrate_legacy_table(guild_id or guild.id, is_comment = False)
+	all_role_dicts = await VALID_ROLES_DB.get_all_entries(f"WHERE {VALID_ROLES_TABLE_VALUES[0]} = ?", (guild_id or guild.id,))
+	# another task may have cached this guild while we were reading
+	role_ids = _guild_role_ids.setdefault(guild_id or guild.id, {role_dict[VALID_ROLES_TABLE_VALUES[1]] for role_dict in all_role_dicts})
+	#JBOTLOG.debug(f"getting all roles for {guild_id or guild.id}")
+	return role_ids
 
 
 async def get_all_role_ids(*, guild_id: int = None, guild: Guild = None) -> List[int]:
 	assert guild_id or guild, "get_all_role_ids error - guild_id or guild must be specified."
-	db = get_db(guild_id, guild, is_comment = False)
-	try:
-		all_role_dicts = await db.get_all_entries()
-	except OperationalError:
-		all_role_dicts = list()
-	role_ids = list()
-	for role_dict in all_role_dicts:
-		role_id = role_dict.get(VALID_ROLES_TABLE_VALUES[0], None)
-		if not role_id:
-			continue
-		role_ids.append(role_id)
-	#JBOTLOG.debug(f"getting all roles for {guild_id or guild.id}")
-	return role_ids
+	return list(await get_role_id_set(guild_id = guild_id, guild = guild))
 
 
 async def add_role(*, guild_id: int = None, guild: Guild = None, role_id: int = None, role: Role = None):
 	assert guild_id or guild, "add_role error - guild_id or guild must be specified."
 	assert role_id or role, "add_role error - role_id or role must be specified."
-	db = get_db(guild_id, guild, is_comment = False)
-	try:
-		await db.new_entry((role_id or role.id,))
-	except OperationalError:
-		await new_roles_table(guild_id = guild_id, guild = guild)
-		await db.new_entry((role_id or role.id,))
+	await _migrate_legacy_table(guild_id or guild.id, is_comment = False)
+	await VALID_ROLES_DB.new_entry((guild_id or guild.id, role_id or role.id), replace = True)
+	if (guild_id or guild.id) in _guild_role_ids:
+		_guild_role_ids[guild_id or guild.id].add(role_id or role.id)
 	#JBOTLOG.debug(f"adding role {role_id or role.id} to guild {guild_id or guild.id} whitelist")
 
 
 async def remove_role(*, guild_id: int = None, guild: Guild = None, role_id: int = None, role: Role = None):
 	assert guild_id or guild, "remove_role error - guild_id or guild must be specified."
 	assert role_id or role, "remove_role error - role_id or role must be specified."
-	db = get_db(guild_id, guild, is_comment = False)
-	try:
-		await db.delete_entry(VALID_ROLES_TABLE_VALUES[0], role_id or role.id)
-	except OperationalError:
-		pass
+	await _migrate_legacy_table(guild_id or guild.id, is_comment = False)
+	await VALID_ROLES_DB.mass_delete_entry(VALID_ROLES_TABLE_VALUES, ((guild_id or guild.id, role_id or role.id),))
+	if (guild_id or guild.id) in _guild_role_ids:
+		_guild_role_ids[guild_id or guild.id].discard(role_id or role.id)
 	#JBOTLOG.debug(f"removing role {role_id or role.id} from guild {guild_id or guild.id} whitelist")
@@ -1,7 +1,6 @@
 # cog to interact with Serveme and their API
 # reserves North American servers
 
-import aiohttp
 from datetime import datetime, timedelta
 from enum import StrEnum, auto
 from nextcord import ButtonStyle, Embed, Interaction, SelectOption, SlashOption, slash_command
@@ -14,10 +13,10 @@ from os import getenv
 from random import choices, randint
 
 from bot import TF2CCBot
-from staticvars import TF2CC, COMP_MAPS
+from staticvars import TF2CC, COMP_MAPS, SERVEME_API_BASE_URL
 
 
-SERVEME_BASE_URL = "https://na.serveme.tf/api/reservations/"
+SERVEME_BASE_URL = SERVEME_API_BASE_URL + "/api/reservations/"
 SERVEME_API_HEADERS = {
 	"Content-Type": "application/json",
 	"Authorization": f"Token token={getenv('SERVEME_API_KEY')}"
@@ -254,19 +253,17 @@ async def reserve_server(intr: Interaction, start: datetime, end: datetime, regi
 	).set_author(name = f"{user}", icon_url = user.display_avatar.url)
 	msg = await intr.send(embed = embed) # update this message throughout the command
 
-	async with aiohttp.ClientSession() as session:
-		async with session.post(
-			SERVEME_BASE_URL + "find_servers",
-			json = {
-				"reservation": {
-					"starts_at": str(start),
-					"ends_at": str(end)
-				}
-			},
-			headers = SERVEME_API_HEADERS
-		) as response: # step 2: fill in all relevent reservation details
-			response.raise_for_status()
-			res_info = await response.json() # filled in reservation details with other information to use
+	res_info = await intr.client.http_client.post_json( # step 2: fill in all relevent reservation details
+		SERVEME_BASE_URL + "find_servers",
+		json = {
+			"reservation": {
+				"starts_at": str(start),
+				"ends_at": str(end)
+			}
+		},
+		headers = SERVEME_API_HEADERS,
+		idempotent = True # only looks up servers
+	) # filled in reservation details with other information to use
 
 	# set up the view with 4 selects for servers, configs, whitelists, and maps
 	view = await setup_view(user.id, res_info, region)
@@ -311,31 +308,28 @@ async def reserve_server(intr: Interaction, start: datetime, end: datetime, regi
 	whitelist_select = get(selects, custom_id = "whitelist")
 	map_select = get(selects, custom_id = "map")
 
-	async with aiohttp.ClientSession() as session:
-		async with session.post(
-			SERVEME_BASE_URL,
-			json = {
-				"reservation": {
-					"starts_at": str(start),
-					"ends_at": str(end),
-					"server_id": int(server_select.item_id), # from view server select
-					"password": get_random_password(), # random password
-					"rcon": get_random_password(), # random rcon
-					"first_map": map_select.item_id, # from view map select
-					"tv_password": "tv",
-					"tv_relaypassword": "tv",
-					"server_config_id": int(config_select.item_id), # from view config select
-					"whitelist_id": int(whitelist_select.item_id), # from view whitelist select
-					"custom_whitelist_id": None,
-					"auto_end": view.autoend,
-					"enable_plugins": True,
-					"enable_demos_tf": True
-				}
-			},
-			headers = SERVEME_API_HEADERS
-		) as response: # step 3: create the reservation
-			response.raise_for_status()
-			res_info = await response.json() # final reservation details
+	res_info = await intr.client.http_client.post_json( # step 3: create the reservation
+		SERVEME_BASE_URL,
+		json = {
+			"reservation": {
+				"starts_at": str(start),
+				"ends_at": str(end),
+				"server_id": int(server_select.item_id), # from view server select
+				"password": get_random_password(), # random password
+				"rcon": get_random_password(), # random rcon
+				"first_map": map_select.item_id, # from view map select
+				"tv_password": "tv",
+				"tv_relaypassword": "tv",
+				"server_config_id": int(config_select.item_id), # from view config select
+				"whitelist_id": int(whitelist_select.item_id), # from view whitelist select
+				"custom_whitelist_id": None,
+				"auto_end": view.autoend,
+				"enable_plugins": True,
+				"enable_demos_tf": True
+			}
+		},
+		headers = SERVEME_API_HEADERS
+	) # final reservation details
 
 	# post message with reservation details
 	reservation_info = ReservationInfo(res_info["reservation"])
@@ -470,15 +464,9 @@ class ServemeCog(Cog, name = "Serveme"):
 	async def serveme_end(self, intr: Interaction, reservation_id: int):
 		await intr.response.defer()
 
-		async with aiohttp.ClientSession() as session:
-			async with session.delete(SERVEME_BASE_URL + str(reservation_id), headers = SERVEME_API_HEADERS) as response:
-				response.raise_for_status()
-				if response.status == 200:
-					resp = await response.json()
-				elif response.status == 204:
-					resp = None
-				else:
-					raise ValueError(f"Unknown response status: {response.status}")
+		status, resp = await self.bot.http_client.delete_json(SERVEME_BASE_URL + str(reservation_id), headers = SERVEME_API_HEADERS)
+		if status not in (200, 204):
+			raise ValueError(f"Unknown response status: {status}")
 
 		# valid response = 200 | no response = 204
 		# server has been ended | server already ended
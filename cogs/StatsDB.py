@@ -0,0 +1,69 @@
+from typing import Iterable, Optional
+from .static import BACKFILL_DB, BACKFILL_TABLE_VALUES, PLAYER_MATCH_DB, PLAYER_MATCH_TABLE_VALUES, PLAYER_STATS_DB, PLAYER_STATS_TABLE_VALUES, STATS_EWMA_ALPHA, BackfillEntry, PlayerStatsEntry
+
+
+async def make_stats_tables():
+	await PLAYER_MATCH_DB.make_table()
+	await BACKFILL_DB.make_table()
+	await PLAYER_STATS_DB.make_table()
+
+
+# ~~~ Player Match DB ~~~
+
+async def add_player_match_stats(rows: Iterable[tuple]):
+	"""Upserts rows made by `logstats.parse_player_stats`, so storing the same log twice is harmless."""
+	await PLAYER_MATCH_DB.new_entries(tuple(rows), replace = True)
+
+
+async def get_stored_log_ids(log_ids: Iterable[int]) -> set[int]:
+	"""Returns which of `log_ids` already have stats stored."""
+	log_ids = tuple(log_ids)
+	if not log_ids:
+		return set()
+	rows = await PLAYER_MATCH_DB.fetch(
+		f"SELECT DISTINCT {PLAYER_MATCH_TABLE_VALUES[0]} FROM {PLAYER_MATCH_DB.table_name} WHERE {PLAYER_MATCH_TABLE_VALUES[0]} IN ({','.join(['?'] * len(log_ids))})",
+		log_ids
+	)
+	return {row[PLAYER_MATCH_TABLE_VALUES[0]] for row in rows}
+
+# ~~~ Player Stats DB ~~~
+
+_SUM_COLUMNS = PLAYER_STATS_TABLE_VALUES[3:11] # seconds through drops
+_AVG_COLUMNS = PLAYER_STATS_TABLE_VALUES[11:16] # avg_dpm through avg_drops
+PLAYER_STATS_UPSERT = f"""
+INSERT INTO {PLAYER_STATS_DB.table_name} 
+VALUES (?, ?, 1, {",".join(["?"] * (len(_SUM_COLUMNS) + len(_AVG_COLUMNS)))}, ?) 
+ON CONFLICT ({PLAYER_STATS_TABLE_VALUES[0]}, {PLAYER_STATS_TABLE_VALUES[1]}) DO UPDATE SET 
+{PLAYER_STATS_TABLE_VALUES[2]} = {PLAYER_STATS_TABLE_VALUES[2]} + 1, 
+{", ".join([f"{col_name} = {col_name} + excluded.{col_name}" for col_name in _SUM_COLUMNS])}, 
+{", ".join([f"{col_name} = {col_name} + {STATS_EWMA_ALPHA} * (excluded.{col_name} - {col_name})" for col_name in _AVG_COLUMNS])}, 
+{PLAYER_STATS_TABLE_VALUES[16]} = excluded.{PLAYER_STATS_TABLE_VALUES[16]}
+"""
+
+
+async def add_player_stats_matches(values: Iterable[tuple]):
+	"""Adds one match to the stats rows of every player in a single transaction.
+Each tuple is `(discord_id, newbie, seconds, kills, assists, deaths, damage, damage_taken, ubers, drops, dpm, dtm, kad, ubers, drops, updated_at)`,
+with the match's own dpm etc in the avg_ places. Sums are added and averages are moved towards the new value in SQL, so it's O(1) per player.
+Nothing is stored if it raises, callers log the match so its stats can be rebuilt from `player_matches`."""
+	values = tuple(values)
+	if values:
+		await PLAYER_STATS_DB.execute_many(PLAYER_STATS_UPSERT, values)
+
+
+async def get_player_stats(discord_id: int, newbie: bool) -> Optional[PlayerStatsEntry]:
+	infos = await PLAYER_STATS_DB.fetch(
+		f"SELECT * FROM {PLAYER_STATS_DB.table_name} WHERE {PLAYER_STATS_TABLE_VALUES[0]} = ? AND {PLAYER_STATS_TABLE_VALUES[1]} = ?",
+		(discord_id, int(newbie))
+	)
+	return PlayerStatsEntry(infos[0]) if infos else None
+
+# ~~~ Backfill DB ~~~
+
+async def get_backfill_progress(steam_id: int) -> Optional[BackfillEntry]:
+	info = await BACKFILL_DB.get_entry(BACKFILL_TABLE_VALUES[0], steam_id)
+	return BackfillEntry(info) if info else None
+
+
+async def save_backfill_progress(steam_id: int, log_offset: int, done: bool, updated_at: int):
+	await BACKFILL_DB.new_entry((steam_id, log_offset, int(done), updated_at), replace = True)
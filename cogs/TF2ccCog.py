@@ -7,7 +7,7 @@ from nextcord.ext.commands.errors import CommandError
 from nextcord.errors import ApplicationError
 from typing import Union
 from staticvars import TF2CC
-from .TF2cchelper import allpuginfo, allstrikeinfo, genteams, movepuggers, pugban, puginfo, pugunban, runnerinfo, setlevel, setsteam, strike, strikeinfo, toggleclassban, unstrike, warn
+from .TF2cchelper import allpuginfo, allstrikeinfo, backfill, genteams, movepuggers, playerstats, pugban, puginfo, pugunban, runnerinfo, setlevel, setsteam, strike, strikeinfo, toggleclassban, unstrike, warn
 
 
 VALID_ROLE_IDS = [TF2CC.owner_rid, TF2CC.admin_rid, TF2CC.moderator_rid, TF2CC.pug_runner_rid]
@@ -84,6 +84,14 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		await puginfo(intr, member, bool(pug_type))
 
 
+	@pug_view.subcommand(name = "stats", description = "View a member's match stats from their logs", inherit_hooks = True)
+	async def pug_view_stats(self, intr: Interaction, member: Member, pug_type: int = SlashOption(
+		choices = {"Regular Pugs": 0, "Newbie Pugs": 1},
+		default = False
+	)):
+		await playerstats(intr, member, bool(pug_type))
+
+
 	@pug_view.subcommand(name = "runner_info", description = "View a Pug Runner's basic info")
 	@has_any_role(*(VALID_ROLE_IDS[:-1]))
 	async def pug_view_runnerinfo(self, intr: Interaction, member: Member):
@@ -204,6 +212,10 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		description = "The amount of players on each team (Default 6)",
 		choices = [2, 3, 4, 5, 6, 7, 8, 9],
 		default = 6
+	), mode: str = SlashOption(
+		description = "How players are split into teams (Default Random)",
+		choices = ["Random", "Balanced"],
+		default = "Random"
 	)):
 		red_team1: VoiceChannel = intr.guild.get_channel(TF2CC.new_pug_red1_cid)
 		blu_team1: VoiceChannel = intr.guild.get_channel(TF2CC.new_pug_blu1_cid)
@@ -211,7 +223,7 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		blu_team2: VoiceChannel = intr.guild.get_channel(TF2CC.new_pug_blu2_cid)
 		waiting: VoiceChannel = intr.guild.get_channel(TF2CC.new_pug_waiting_cid)
 		next_game: VoiceChannel = intr.guild.get_channel(TF2CC.new_pug_next_game_cid)
-		await genteams(intr, (red_team1, blu_team1), (red_team2, blu_team2), waiting, next_game, team_size, True)
+		await genteams(intr, (red_team1, blu_team1), (red_team2, blu_team2), waiting, next_game, team_size, True, mode)
 
 
 	@pug_gt.subcommand(name = "regular", description = "Generate teams for Regular Pugs", inherit_hooks = True)
@@ -220,6 +232,10 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		description = "The amount of players on each team (Default 6)",
 		choices = [2, 3, 4, 5, 6, 7, 8, 9],
 		default = 6
+	), mode: str = SlashOption(
+		description = "How players are split into teams (Default Random)",
+		choices = ["Random", "Balanced"],
+		default = "Random"
 	)):
 		red_team1: VoiceChannel = intr.guild.get_channel(TF2CC.reg_pug_red1_cid)
 		blu_team1: VoiceChannel = intr.guild.get_channel(TF2CC.reg_pug_blu1_cid)
@@ -227,7 +243,7 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		blu_team2: VoiceChannel = intr.guild.get_channel(TF2CC.reg_pug_blu2_cid)
 		waiting: VoiceChannel = intr.guild.get_channel(TF2CC.reg_pug_waiting_cid)
 		next_game: VoiceChannel = intr.guild.get_channel(TF2CC.reg_pug_next_game_cid)
-		await genteams(intr, (red_team1, blu_team1), (red_team2, blu_team2), waiting, next_game, team_size, False)
+		await genteams(intr, (red_team1, blu_team1), (red_team2, blu_team2), waiting, next_game, team_size, False, mode)
 
 
 	@pug_slash.subcommand(name = "dm", description = "DM a message to all members in a Voice Channel.", inherit_hooks = True)
@@ -269,6 +285,12 @@ class TF2ccCog(Cog, name = "TF2CC"):
 		await intr.send(content, ephemeral = True)
 
 
+	@pug_slash.subcommand(name = "backfill", description = "Store match stats from the logs.tf history of every linked Steam account", inherit_hooks = True)
+	@has_any_role(*(VALID_ROLE_IDS[:2]))
+	async def pug_backfill(self, intr: Interaction):
+		await backfill(intr)
+
+
 	# Move over stuff from the Serveme Cog
 
 
@@ -1,27 +1,172 @@
+from collections import OrderedDict
 from nextcord import User
-from typing import Optional
-from .static import PUG_DB, RUNNER_DB, STRIKE_DB, PugEntry, RunnerEntry, StrikeEntry
+from time import monotonic
+from typing import Callable, Iterable, Optional
+from classes import KeysetPageSource
+from .static import MATCH_APPLIED, MATCH_PENDING, PENDING_MATCH_DB, PENDING_MATCH_TABLE_VALUES, PUG_DB, PUG_TABLE_VALUES, RUNNER_DB, STRIKE_DB, STRIKE_TABLE_VALUES, PendingMatchEntry, PugEntry, RunnerEntry, StrikeEntry
+
+
+class EntryCache:
+	"""Bounded LRU cache of table rows keyed by discord id. Rows older than `ttl` seconds are read again.
+
+Every write in this file goes through the cache, so rows stay the same as the database."""
+	def __init__(self, max_size: int = 512, ttl: float = 300.0):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+		self._version = 0 # bumped on every write, so a read that raced a write doesn't cache an old row
+
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+
+	@property
+	def stats(self) -> dict[str, int]:
+		return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+	@property
+	def version(self) -> int:
+		return self._version
+
+
+	def get(self, discord_id: int) -> Optional[dict]:
+		item = self._entries.get(discord_id)
+		if item is None:
+			self.misses += 1
+			return None
+		if monotonic() - item[0] > self.ttl:
+			del self._entries[discord_id]
+			self.evictions += 1
+			self.misses += 1
+			return None
+		self._entries.move_to_end(discord_id)
+		self.hits += 1
+		return dict(item[1])
+
+
+	def put(self, discord_id: int, info: dict, version: int = None):
+		"""Caches a row read from the database. Pass the `version` from before the read so rows that were written in the meantime are skipped."""
+		if version is not None and version != self._version:
+			return
+		self._entries[discord_id] = (monotonic(), dict(info))
+		self._entries.move_to_end(discord_id)
+		while len(self._entries) > self.max_size:
+			self._entries.popitem(last = False)
+			self.evictions += 1
+
+
+	def update(self, discord_id: int, **kwargs):
+		"""Applies an edit that was written to the database to the cached row, if there is one."""
+		self._version += 1
+		item = self._entries.get(discord_id)
+		if item is not None:
+			item[1].update(kwargs)
+
+
+	def invalidate(self, discord_ids: Iterable[int] = None):
+		"""Drops the cached rows of `discord_ids`, or every row if not given."""
+		self._version += 1
+		if discord_ids is None:
+			self._entries.clear()
+			return
+		for discord_id in discord_ids:
+			self._entries.pop(discord_id, None)
+
+
+STRIKE_CACHE = EntryCache()
+PUG_CACHE = EntryCache()
+
+# these match the WHERE of the partial indexes in static.py, keep them the same so SQLite can use the indexes
+ACTIVE_STRIKES_CONDITIONAL = f"WHERE {STRIKE_TABLE_VALUES[1]} > 0 OR {STRIKE_TABLE_VALUES[7]} > 0 OR {STRIKE_TABLE_VALUES[8]} > 0"
+STRIKE_SWEEP_CONDITIONAL = f"WHERE {STRIKE_TABLE_VALUES[1]} > ? AND {STRIKE_TABLE_VALUES[1]} < ? AND {STRIKE_TABLE_VALUES[-1]} < ?"
+STRIKE_SWEEP_PARAMS = (0, 3, 1)
+
+
+def leaderboard_filter(newbie: bool) -> str:
+	return f"{PUG_TABLE_VALUES[1 if not newbie else 8]} > 0 OR {PUG_TABLE_VALUES[2 if not newbie else 9]} > 0"
+
+
+def leaderboard_page_source(newbie: bool, per_page: int, format_entries: Callable[[list[PugEntry]], list[tuple[str, str]]], **kwargs) -> KeysetPageSource:
+	"""Pages through the players that have played, highest elo first. `kwargs` are passed to `KeysetPageSource`."""
+	return KeysetPageSource(
+		PUG_DB,
+		per_page,
+		(PUG_TABLE_VALUES[4 if not newbie else 11], PUG_TABLE_VALUES[0]), # elo, discord id
+		lambda infos: format_entries([PugEntry(info) for info in infos]),
+		conditional = leaderboard_filter(newbie),
+		**kwargs
+	)
+
+
+def _mass_update_cache(cache: EntryCache, key_names: tuple[str], key_vals: tuple[tuple]):
+	for vals in key_vals:
+		cache.update(vals[-1], **dict(zip(key_names[:-1], vals[:-1])))
+
+
+async def _get_cached_entries(cache: EntryCache, primary_key_name: str, discord_ids: Iterable[int], get_or_new) -> dict[int, dict]:
+	# serves what it can from the cache and only sends the rest to the database in one batch
+	infos: dict[int, dict] = dict()
+	missing: list[int] = list()
+	for discord_id in dict.fromkeys(discord_ids):
+		info = cache.get(discord_id)
+		if info is None:
+			missing.append(discord_id)
+		else:
+			infos[discord_id] = info
+	if missing:
+		version = cache.version
+		for info in await get_or_new(missing):
+			infos[info[primary_key_name]] = info
+			cache.put(info[primary_key_name], info, version)
+	return infos
 
 # ~~~ Strike DB ~~~
 
+def _new_strike_values(discord_id: int) -> tuple[int]:
+	return (discord_id, 0, 0, 0, 0, 0, 0, 0, 0)
+
+
 async def new_strike_entry(*, user_id: int = None, user: User = None):
 	assert user_id or user, "new_strike_entry error: user_id or user must be specified"
-	await STRIKE_DB.new_entry((user_id or user.id, 0, 0, 0, 0, 0, 0, 0, 0))
+	await STRIKE_DB.new_entry(_new_strike_values(user_id or user.id))
+	STRIKE_CACHE.invalidate((user_id or user.id,))
 	#JBOTLOG.debug(f"new strike entry for {user_id or user.id}")
 
 
 async def get_strike_entry(discord_id: int) -> Optional[StrikeEntry]:
-	info = await STRIKE_DB.get_entry(STRIKE_DB.table_column_names[0], discord_id)
+	info = STRIKE_CACHE.get(discord_id)
+	if info is None:
+		version = STRIKE_CACHE.version
+		info = await STRIKE_DB.get_entry(STRIKE_DB.table_column_names[0], discord_id)
+		if info:
+			STRIKE_CACHE.put(discord_id, info, version)
 	return StrikeEntry(info) if info else None
 
 
+async def get_or_new_strike_entries(discord_ids: Iterable[int]) -> dict[int, StrikeEntry]:
+	"""Creates any missing strike entries and returns all of them, keyed by discord id."""
+	async def get_or_new(missing_ids: list[int]) -> list[dict]:
+		values = tuple([_new_strike_values(discord_id) for discord_id in missing_ids])
+		return await STRIKE_DB.get_or_new_entries(STRIKE_DB.table_column_names[0], values)
+
+	infos = await _get_cached_entries(STRIKE_CACHE, STRIKE_DB.table_column_names[0], discord_ids, get_or_new)
+	return {discord_id: StrikeEntry(info) for discord_id, info in infos.items()}
+
+
 async def edit_strike_entry(discord_id: int, **kwargs):
 	await STRIKE_DB.edit_entry(STRIKE_DB.table_column_names[0], discord_id, **kwargs)
+	STRIKE_CACHE.update(discord_id, **kwargs)
 	#JBOTLOG.debug(f"edit strike entry for {discord_id}: {kwargs}")
 
 
 async def delete_strike_entry(discord_id: int):
 	await STRIKE_DB.delete_entry(STRIKE_DB.table_column_names[0], discord_id)
+	STRIKE_CACHE.invalidate((discord_id,))
 	#JBOTLOG.debug(f"delete strike entry for {discord_id}")
 
 
@@ -33,33 +178,74 @@ async def get_all_strike_entries(conditional: str = "", params: tuple = None) ->
 async def mass_edit_strike_entries(key_names: tuple[str], key_vals: tuple[tuple[int]]):
 	"""Primary key name goes last in the `key_names` arg."""
 	await STRIKE_DB.mass_edit_entry(key_names, key_vals)
+	_mass_update_cache(STRIKE_CACHE, key_names, key_vals)
 	#JBOTLOG.debug(f"mass edit strike entries for {len(key_vals)} entries")
 
 
 async def mass_delete_strike_entries(key_names: tuple[str], key_vals: tuple[tuple[int]]):
 	await STRIKE_DB.mass_delete_entry(key_names, key_vals)
+	STRIKE_CACHE.invalidate([vals[0] for vals in key_vals] if key_names == (STRIKE_DB.table_column_names[0],) else None)
 	#JBOTLOG.debug(f"mass delete strike entries for {len(key_vals)} entries")
 
 # ~~~ Pug DB ~~~
 
+def _new_pug_values(discord_id: int) -> tuple[Optional[int | str]]:
+	return (discord_id, 0, 0, 0, 1000, 0, None, "", 0, 0, 0, 1000)
+
+
 async def new_pug_entry(*, user_id: int = None, user: User = None):
 	assert user_id or user, "new_pug_entry error: user_id or user must be specified"
-	await PUG_DB.new_entry((user_id or user.id, 0, 0, 0, 1000, 0, None, "", 0, 0, 0, 1000))
+	await PUG_DB.new_entry(_new_pug_values(user_id or user.id))
+	PUG_CACHE.invalidate((user_id or user.id,))
 	#JBOTLOG.debug(f"new pug entry for {user_id or user.id}")
 
 
 async def get_pug_entry(discord_id: int) -> Optional[PugEntry]:
-	info = await PUG_DB.get_entry(PUG_DB.table_column_names[0], discord_id)
+	info = PUG_CACHE.get(discord_id)
+	if info is None:
+		version = PUG_CACHE.version
+		info = await PUG_DB.get_entry(PUG_DB.table_column_names[0], discord_id)
+		if info:
+			PUG_CACHE.put(discord_id, info, version)
 	return PugEntry(info) if info else None
 
 
+async def get_pug_entry_by_steam_id(steam_id: int) -> Optional[PugEntry]:
+	infos = await PUG_DB.get_all_entries(f"WHERE {PUG_TABLE_VALUES[6]} = ?", (steam_id,))
+	return PugEntry(infos[0]) if infos else None
+
+
+async def get_linked_steam_ids() -> list[int]:
+	"""Every steam id linked to a pug entry, read straight from the steam id index."""
+	rows = await PUG_DB.fetch(f"SELECT {PUG_TABLE_VALUES[6]} FROM {PUG_DB.table_name} WHERE {PUG_TABLE_VALUES[6]} IS NOT NULL")
+	return [row[PUG_TABLE_VALUES[6]] for row in rows]
+
+
+async def get_or_new_pug_entries(discord_ids: Iterable[int]) -> dict[int, PugEntry]:
+	"""Creates any missing pug entries and returns all of them, keyed by discord id."""
+	async def get_or_new(missing_ids: list[int]) -> list[dict]:
+		values = tuple([_new_pug_values(discord_id) for discord_id in missing_ids])
+		return await PUG_DB.get_or_new_entries(PUG_DB.table_column_names[0], values)
+
+	infos = await _get_cached_entries(PUG_CACHE, PUG_DB.table_column_names[0], discord_ids, get_or_new)
+	return {discord_id: PugEntry(info) for discord_id, info in infos.items()}
+
+
 async def edit_pug_entry(discord_id: int, **kwargs):
 	await PUG_DB.edit_entry(PUG_DB.table_column_names[0], discord_id, **kwargs)
+	PUG_CACHE.update(discord_id, **kwargs)
 	#JBOTLOG.debug(f"edit pug entry for {discord_id}: {kwargs}")
 
 
+async def defer_edit_pug_entry(discord_id: int, **kwargs):
+	"""Queues the edit and writes it later together with other queued pug edits."""
+	await PUG_DB.defer_edit_entry(PUG_DB.table_column_names[0], discord_id, **kwargs)
+	PUG_CACHE.update(discord_id, **kwargs)
+
+
 async def delete_pug_entry(discord_id: int):
 	await PUG_DB.delete_entry(PUG_DB.table_column_names[0], discord_id)
+	PUG_CACHE.invalidate((discord_id,))
 	#JBOTLOG.debug(f"delete pug entry for {discord_id}")
 
 
@@ -71,11 +257,43 @@ async def get_all_pug_entries(conditional: str = "", params: tuple = None) -> li
 async def mass_edit_pug_entries(key_names: tuple[str], key_vals: tuple[tuple[int]]):
 	"""Primary key name goes last in the `key_names` arg."""
 	await PUG_DB.mass_edit_entry(key_names, key_vals)
+	_mass_update_cache(PUG_CACHE, key_names, key_vals)
 	#JBOTLOG.debug(f"mass edit pug entries for {len(key_vals)} entries")
 
 
+def _pug_match_result_values(red_ids: Iterable[int], blu_ids: Iterable[int], red_elo_change: int, blu_elo_change: int, *, red_won: bool, blu_won: bool, newbie: bool) -> tuple[tuple[str], tuple[tuple[int]]]:
+	key_names = (
+		PUG_TABLE_VALUES[1 if not newbie else 8], # win count
+		PUG_TABLE_VALUES[2 if not newbie else 9], # lose count
+		PUG_TABLE_VALUES[3 if not newbie else 10], # tie count
+		PUG_TABLE_VALUES[4 if not newbie else 11], # elo
+		PUG_TABLE_VALUES[0] # discord id
+	)
+	tied = not red_won and not blu_won
+	key_vals = [(int(red_won), int(blu_won), int(tied), red_elo_change, discord_id) for discord_id in red_ids]
+	key_vals += [(int(blu_won), int(red_won), int(tied), blu_elo_change, discord_id) for discord_id in blu_ids]
+	return key_names, tuple(key_vals)
+
+
+async def apply_pug_match_result(red_ids: Iterable[int], blu_ids: Iterable[int], red_elo_change: int, blu_elo_change: int, *, red_won: bool, blu_won: bool, newbie: bool):
+	"""Adds the result of one match to the win/lose/tie counts and elo of every player in a single transaction.
+The values are incremented in SQL, so two matches finishing at the same time can't overwrite each other."""
+	key_names, key_vals = _pug_match_result_values(red_ids, blu_ids, red_elo_change, blu_elo_change, red_won = red_won, blu_won = blu_won, newbie = newbie)
+	await PUG_DB.mass_increment_entry(key_names, key_vals)
+	PUG_CACHE.invalidate([vals[-1] for vals in key_vals])
+	#JBOTLOG.debug(f"applied match result for {len(key_vals)} entries")
+
+
+async def defer_mass_edit_pug_entries(key_names: tuple[str], key_vals: tuple[tuple[int]]):
+	"""Primary key name goes last in the `key_names` arg. The edits are written later together with other queued pug edits."""
+	for vals in key_vals:
+		await PUG_DB.defer_edit_entry(key_names[-1], vals[-1], **dict(zip(key_names[:-1], vals[:-1])))
+	_mass_update_cache(PUG_CACHE, key_names, key_vals)
+
+
 async def mass_delete_pug_entries(key_names: tuple[str], key_vals: tuple[tuple[int]]):
 	await PUG_DB.mass_delete_entry(key_names, key_vals)
+	PUG_CACHE.invalidate([vals[0] for vals in key_vals] if key_names == (PUG_DB.table_column_names[0],) else None)
 	#JBOTLOG.debug(f"mass delete pug entries for {len(key_vals)} entries")
 
 # ~~~ Pug Runner DB ~~~
@@ -104,6 +322,11 @@ async def edit_runner_entry(discord_id: int, **payload):
 	#JBOTLOG.debug(f"edit runner entry for {discord_id}: {payload}")
 
 
+async def defer_edit_runner_entry(discord_id: int, **payload):
+	"""Queues the edit and writes it later together with other queued runner edits."""
+	await RUNNER_DB.defer_edit_entry(RUNNER_DB.table_column_names[0], discord_id, **payload)
+
+
 async def delete_runner_entry(discord_id: int):
 	await RUNNER_DB.delete_entry(RUNNER_DB.table_column_names[0], discord_id)
 	#JBOTLOG.debug(f"delete runner entry for {discord_id}")
@@ -113,3 +336,79 @@ async def get_all_runner_entries(conditional: str = "", params: tuple = None) ->
 	infos = await RUNNER_DB.get_all_entries(conditional, params)
 	return [RunnerEntry(info) for info in infos]
 
+# ~~~ Pending Match DB ~~~
+
+PENDING_MATCH_DUE_CONDITIONAL = f"WHERE {PENDING_MATCH_TABLE_VALUES[8]} = '{MATCH_PENDING}' AND {PENDING_MATCH_TABLE_VALUES[7]} <= ? ORDER BY {PENDING_MATCH_TABLE_VALUES[7]}"
+
+
+async def new_pending_match(red_ids: Iterable[int], blu_ids: Iterable[int], log_channel_id: Optional[int], *, newbie: bool, created_at: int, next_attempt: int):
+	await PENDING_MATCH_DB.new_entry((
+		None, # match_id, picked by sqlite
+		created_at,
+		int(newbie),
+		",".join([str(discord_id) for discord_id in red_ids]),
+		",".join([str(discord_id) for discord_id in blu_ids]),
+		log_channel_id,
+		0, # attempts
+		next_attempt,
+		MATCH_PENDING,
+		None, # log_id
+		None # finished_at
+	))
+
+
+async def get_due_pending_matches(now: int) -> list[PendingMatchEntry]:
+	infos = await PENDING_MATCH_DB.get_all_entries(PENDING_MATCH_DUE_CONDITIONAL, (now,))
+	return [PendingMatchEntry(info) for info in infos]
+
+
+async def retry_pending_match(match_id: int, attempts: int, next_attempt: int):
+	await PENDING_MATCH_DB.edit_entry(
+		PENDING_MATCH_TABLE_VALUES[0], match_id,
+		**{PENDING_MATCH_TABLE_VALUES[6]: attempts, PENDING_MATCH_TABLE_VALUES[7]: next_attempt}
+	)
+
+
+FINISH_PENDING_MATCH_STR = f"""
+UPDATE {PENDING_MATCH_DB.table_name} 
+SET {PENDING_MATCH_TABLE_VALUES[8]} = ?, {PENDING_MATCH_TABLE_VALUES[9]} = ?, {PENDING_MATCH_TABLE_VALUES[10]} = ? 
+WHERE {PENDING_MATCH_TABLE_VALUES[0]} = ? AND {PENDING_MATCH_TABLE_VALUES[8]} = '{MATCH_PENDING}' 
+RETURNING {PENDING_MATCH_TABLE_VALUES[0]}
+"""
+
+
+async def finish_pending_match(match_id: int, status: str, finished_at: int, log_id: int = None) -> bool:
+	"""Records the outcome of a pending match. Returns `False` if it was already finished, so a result is only ever applied once."""
+	rows = await PENDING_MATCH_DB.execute(FINISH_PENDING_MATCH_STR, (status, log_id, finished_at, match_id))
+	return len(rows) > 0
+
+
+async def apply_pending_match_result(match: PendingMatchEntry, log_id: int, finished_at: int, red_elo_change: int, blu_elo_change: int, *, red_won: bool, blu_won: bool) -> bool:
+	"""Marks a pending match applied and adds its result to every player's counts and elo in one transaction,
+so the match is never marked applied without the elo changing. Returns `False` and changes nothing if it was already finished."""
+	key_names, key_vals = _pug_match_result_values(match.red_ids, match.blu_ids, red_elo_change, blu_elo_change, red_won = red_won, blu_won = blu_won, newbie = match.newbie)
+	await PENDING_MATCH_DB.flush()
+	async with PUG_DB.transaction() as conn: # both tables are in tf2cc.db
+		rows = await conn.execute_fetchall(FINISH_PENDING_MATCH_STR, (MATCH_APPLIED, log_id, finished_at, match.match_id))
+		if not rows:
+			return False
+		await PUG_DB.mass_increment_entry(key_names, key_vals, conn = conn)
+	PUG_CACHE.invalidate([vals[-1] for vals in key_vals])
+	return True
+
+# ~~~ Query Plans ~~~
+
+async def explain_indexed_queries() -> dict[str, list[str]]:
+	"""Returns the `EXPLAIN QUERY PLAN` of the queries that the indexes in static.py are meant for."""
+	queries = {
+		"leaderboard page": (PUG_DB,) + leaderboard_page_source(False, 9, list).select_str((1000, 0), forward = True, limit = 9),
+		"newbie leaderboard page": (PUG_DB,) + leaderboard_page_source(True, 9, list).select_str((1000, 0), forward = True, limit = 9),
+		"leaderboard count": (PUG_DB, f"SELECT COUNT(*) FROM {PUG_DB.table_name} WHERE {leaderboard_filter(False)}", None),
+		"steam id lookup": (PUG_DB, f"SELECT * FROM {PUG_DB.table_name} WHERE {PUG_TABLE_VALUES[6]} = ?", (0,)),
+		"linked steam ids": (PUG_DB, f"SELECT {PUG_TABLE_VALUES[6]} FROM {PUG_DB.table_name} WHERE {PUG_TABLE_VALUES[6]} IS NOT NULL", None),
+		"active strikes": (STRIKE_DB, f"SELECT * FROM {STRIKE_DB.table_name} {ACTIVE_STRIKES_CONDITIONAL}", None),
+		"strike sweep": (STRIKE_DB, f"SELECT * FROM {STRIKE_DB.table_name} {STRIKE_SWEEP_CONDITIONAL}", STRIKE_SWEEP_PARAMS),
+		"late runners": (RUNNER_DB, f"SELECT * FROM {RUNNER_DB.table_name} WHERE {RUNNER_DB.table_column_names[5]} <= ?", (0,)),
+		"due pending matches": (PENDING_MATCH_DB, f"SELECT * FROM {PENDING_MATCH_DB.table_name} {PENDING_MATCH_DUE_CONDITIONAL}", (0,))
+	}
+	return {name: await db.explain_query_plan(exec_str, params) for name, (db, exec_str, params) in queries.items()}
@@ -1,12 +1,15 @@
 import traceback
 from datetime import datetime, timedelta, timezone
-from nextcord import AuditLogAction, Embed, Member, Role, TextChannel, HTTPException, NotFound
+from nextcord import AuditLogAction, Embed, Member, Role, TextChannel, VoiceState, HTTPException, NotFound
 from nextcord.ext.commands import Bot, Cog
 from nextcord.ext.tasks import loop
 from nextcord.utils import utcnow, format_dt
 from staticvars import TF2CC
-from .static import PUG_DB, RUNNER_DB, STRIKE_DB, STRIKE_TABLE_VALUES, PugEmbeds
-from .TF2ccDB import edit_pug_entry, edit_runner_entry, edit_strike_entry, get_all_runner_entries, get_all_strike_entries, get_pug_entry, get_runner_entry, get_strike_entry, new_runner_entry, new_strike_entry
+from .static import MATCH_FAILED, MATCH_PENDING, PENDING_MATCH_DB, PUG_DB, PUG_TABLE_VALUES, RUNNER_DB, STRIKE_DB, STRIKE_TABLE_VALUES, PugEmbeds
+from .TF2ccDB import STRIKE_SWEEP_CONDITIONAL, STRIKE_SWEEP_PARAMS, defer_edit_pug_entry, edit_runner_entry, explain_indexed_queries, edit_strike_entry, get_all_runner_entries, get_all_strike_entries, get_due_pending_matches, get_pug_entry, get_runner_entry, get_strike_entry, new_runner_entry, new_strike_entry
+from .StatsDB import make_stats_tables
+from .pugqueue import PREWARMER, PUG_QUEUES
+from .TF2cchelper import process_pending_match, retry_or_give_up
 
 
 MIDNIGHT = utcnow().time().replace(hour = 7, minute = 0, second = 0, microsecond = 0)
@@ -22,6 +25,8 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 			self.remove_rcon_pins.start()
 		if not self.dm_pug_runners_late_run.get_task():
 			self.dm_pug_runners_late_run.start()
+		if not self.process_pending_matches.get_task():
+			self.process_pending_matches.start()
 
 
 	@Cog.listener(name = "on_ready")
@@ -30,6 +35,10 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 		await STRIKE_DB.make_table()
 		await PUG_DB.make_table()
 		await RUNNER_DB.make_table()
+		await PENDING_MATCH_DB.make_table()
+		await make_stats_tables()
+		for name, plan in (await explain_indexed_queries()).items():
+			self.bot.log.debug(f"query plan for {name}: {' | '.join(plan)}")
 		self.guild = self.bot.get_guild(TF2CC.guild_id)
 		self.audit: TextChannel = self.guild.get_channel(self.machu_log_cid)
 		self.bot_cmds: TextChannel = self.guild.get_channel(TF2CC.bot_commands_cid)
@@ -52,6 +61,29 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 			self.guild.get_role(TF2CC.pug_strike2_rid),
 			self.guild.get_role(TF2CC.pug_strike3_rid)
 		)
+		for queue in PUG_QUEUES:
+			queue.seed(self.guild.voice_channels)
+			for entry in queue.snapshot().entries:
+				PREWARMER.add(entry.member)
+
+
+	@Cog.listener(name = "on_voice_state_update")
+	async def track_pug_queue(self, member: Member, before: VoiceState, after: VoiceState):
+		if member.guild.id != TF2CC.guild_id:
+			return
+		joined = False
+		for queue in PUG_QUEUES:
+			if queue.ready:
+				joined = queue.update(member, before, after) or joined
+		if joined:
+			# load their info in the background so genteams doesnt have to go to the db
+			PREWARMER.add(member)
+
+
+	@Cog.listener(name = "on_member_update")
+	async def refresh_queued_level_roles(self, before: Member, after: Member):
+		if before.roles != after.roles:
+			PREWARMER.refresh_level_roles(after)
 
 
 	@Cog.listener(name = "on_member_join")
@@ -296,9 +328,9 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 			class_bans.append("9")
 
 		new_bans = ",".join(class_bans)
-		payload = {TF2CC.pug_table_values[7]: new_bans}
-		 # update class restrictions
-		await edit_pug_entry(after.id, **payload)
+		payload = {PUG_TABLE_VALUES[7]: new_bans}
+		# update class restrictions
+		await defer_edit_pug_entry(after.id, **payload)
 
 		# prepare and send messages
 		staff = logs[0].user
@@ -360,10 +392,7 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 	@loop(time = MIDNIGHT)
 	async def update_strikes(self):
 		await self.bot.wait_until_ready()
-		entries = await get_all_strike_entries(
-			conditional = f"WHERE {STRIKE_TABLE_VALUES[1]} > ? AND {STRIKE_TABLE_VALUES[1]} < ? AND {STRIKE_TABLE_VALUES[-1]} < ?",
-			params = (0, 3, 1)
-		)
+		entries = await get_all_strike_entries(conditional = STRIKE_SWEEP_CONDITIONAL, params = STRIKE_SWEEP_PARAMS)
 		if not len(entries): return
 
 		cur_time = utcnow()
@@ -453,6 +482,34 @@ class TF2ccEventCog(Cog, name = "TF2CC Events"):
 					print("".join(traceback.format_exception(type(error), error, error.__traceback__)))
 
 
+	@loop(seconds = 30)
+	async def process_pending_matches(self):
+		# apply elo for moved matches once their log is on logs.tf
+		# errors are logged instead of raised, an error escaping the loop would stop it until the bot restarts
+		try:
+			matches = await get_due_pending_matches(int(utcnow().timestamp()))
+		except Exception as error:
+			self.bot.log.error("could not get pending matches\n" + "".join(traceback.format_exception(type(error), error, error.__traceback__)))
+			return
+		for match in matches:
+			try:
+				try:
+					status = await process_pending_match(self.bot, match)
+				except Exception as error:
+					self.bot.log.error(f"pending match {match.match_id}\n" + "".join(traceback.format_exception(type(error), error, error.__traceback__)))
+					status = await retry_or_give_up(match, MATCH_FAILED)
+				if status != MATCH_PENDING:
+					self.bot.log.debug(f"pending match {match.match_id} finished after {match.attempts + 1} attempts: {status}")
+			except Exception as error:
+				self.bot.log.error(f"could not reschedule pending match {match.match_id}\n" + "".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+
+	@process_pending_matches.before_loop
+	async def before_process_pending_matches(self):
+		await self.bot.wait_until_ready()
+		await PENDING_MATCH_DB.make_table()
+
+
 	@loop(time = MIDNIGHT)
 	async def dm_pug_runners_late_run(self):
 		await self.bot.wait_until_ready()
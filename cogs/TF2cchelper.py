@@ -1,27 +1,36 @@
-import aiohttp, traceback
+import asyncio, aiohttp, aiosqlite, traceback
 from datetime import datetime, timedelta, timezone
-from nextcord import ButtonStyle, ChannelType, Color, Embed, Interaction, Member, Message, PartialInteractionMessage, PartialMessageable, Role, User, TextChannel, VoiceChannel, HTTPException
+from nextcord import ButtonStyle, ChannelType, Color, Embed, HTTPException, Interaction, Member, Message, PartialInteractionMessage, PartialMessageable, Role, User, TextChannel, VoiceChannel
 from nextcord.ext.commands import Context, CommandError
 from nextcord.ui import Button, View, button
 from nextcord.utils import as_chunks, format_dt, utcnow
-from random import randint, shuffle
+from bisect import bisect_left
+from random import shuffle
 from statistics import mean, median
 from typing import Iterable, Optional, Union
 from bot import TF2CCBot
 from staticvars import TF2CC
-from classes import send_menu_pages
-from .static import LOGS_API_GET_LOG, LOGS_API_GET_LOG_IDS, PUG_TABLE_VALUES, RUNNER_DB, STRIKE_TABLE_VALUES, Player, PugEmbeds, Pugger, Team
-from .TF2ccDB import edit_pug_entry, edit_runner_entry, edit_strike_entry, get_all_pug_entries, get_all_strike_entries, get_pug_entry, get_runner_entry, get_strike_entry, mass_edit_pug_entries, new_pug_entry, new_runner_entry, new_strike_entry
+from classes import send_lazy_menu_pages, send_menu_pages
+from httpclient import HTTPClient
+from .static import LOGS_API_GET_LOG, LOGS_API_GET_LOG_IDS, MATCH_APPLIED, MATCH_NO_LOG, MATCH_NO_PLAYERS, MATCH_PENDING, PUG_TABLE_VALUES, RUNNER_DB, STRIKE_TABLE_VALUES, PendingMatchEntry, Player, PugEmbeds, PugEntry, Pugger, Team
+from .TF2ccDB import ACTIVE_STRIKES_CONDITIONAL, apply_pending_match_result, apply_pug_match_result, defer_edit_runner_entry, defer_mass_edit_pug_entries, edit_pug_entry, edit_strike_entry, finish_pending_match, get_all_strike_entries, get_linked_steam_ids, get_or_new_pug_entries, get_pug_entry, get_runner_entry, get_strike_entry, leaderboard_page_source, new_pending_match, new_pug_entry, new_runner_entry, new_strike_entry, retry_pending_match
 from .CommentDB import new_comment
+from .StatsDB import add_player_stats_matches, get_player_stats
+from .backfill import BACKFILL
+from .logcache import LOG_CACHE
+from .pugqueue import channel_members, queue_snapshot
+from .voicemoves import MoveScheduler
+from .teambalance import MEDIC, TeamBalancer, can_fill, default_class_slots, fix_class_slots, match_class_slots
 
 
 # warn strike unstrike pugban pugunban
-# view -> strikeinfo eloinfo
+# view -> strikeinfo eloinfo stats
 # viewall -> strikeinfo, eloinfo
 # set -> level steam
 # toggle -> classban
 # move -> newbie regular
 # genteams -> newbie regular
+# backfill
 
 
 def get_user(info: Union[Context, Interaction]) -> Optional[Union[User, Member]]:
@@ -394,6 +403,41 @@ async def puginfo(info: Union[Context, Interaction], member: Member, newbie: boo
 	await info.send(embed = embed)
 
 
+async def playerstats(info: Union[Context, Interaction], member: Member, newbie: bool):
+	stats = await get_player_stats(member.id, newbie)
+	assert stats is not None, f"{str(member)} has no {'Newbie' if newbie else 'Regular'} Pugs stats yet."
+	embed = Embed(
+		title = f"{'Newbie' if newbie else 'Regular'} Pugs Stats",
+		description = f"""
+{member.mention}
+**Matches** - `{stats.matches}` (`{stats.seconds // 60}` minutes)
+**K/A/D** - `{stats.kills}/{stats.assists}/{stats.deaths}`
+**Ubers / Drops** - `{stats.ubers}` / `{stats.drops}`
+**Last Match** - {format_dt(stats.updated_datetime)}
+""",
+		timestamp = utcnow(),
+		color = Color.from_rgb(255, 255, 255)
+	).set_thumbnail(
+		url = member.display_avatar.url
+	).add_field(
+		name = "DPM",
+		value = f"{stats.dpm:.0f} (recent {stats.avg_dpm:.0f})"
+	).add_field(
+		name = "DTM",
+		value = f"{stats.dtm:.0f} (recent {stats.avg_dtm:.0f})"
+	).add_field(
+		name = "KA/D",
+		value = f"{stats.kad:.2f} (recent {stats.avg_kad:.2f})"
+	).add_field(
+		name = "Ubers per Match",
+		value = f"{stats.ubers / stats.matches:.1f} (recent {stats.avg_ubers:.1f})"
+	).add_field(
+		name = "Drops per Match",
+		value = f"{stats.drops / stats.matches:.1f} (recent {stats.avg_drops:.1f})"
+	)
+	await info.send(embed = embed)
+
+
 async def runnerinfo(info: Union[Context, Interaction], member: Member):
 	runner_info = await get_runner_entry(member.id)
 	assert runner_info is not None, f"{str(member)} is not a Pug Runner."
@@ -417,7 +461,7 @@ async def runnerinfo(info: Union[Context, Interaction], member: Member):
 
 
 async def allstrikeinfo(info: Union[Context, Interaction]):
-	entries = await get_all_strike_entries(conditional = "WHERE strike_count > 0 OR pugban > 0 OR permanent_ban > 0")
+	entries = await get_all_strike_entries(conditional = ACTIVE_STRIKES_CONDITIONAL)
 	if not len(entries):
 		await info.send("There are no strike entries.")
 		return
@@ -449,39 +493,38 @@ Permanent Pug Ban: {bool(strike_info.permanent_ban)}"""
 
 
 async def allpuginfo(info: Union[Context, Interaction], newbie: bool):
-	entries = await get_all_pug_entries(conditional = f"""
-WHERE 
-	{PUG_TABLE_VALUES[1 if not newbie else 8]} > 0 OR 
-	{PUG_TABLE_VALUES[2 if not newbie else 9]} > 0 
-ORDER BY {PUG_TABLE_VALUES[4 if not newbie else 11]} DESC""")
-	if len(entries) == 0:
-		await info.send("There are no pug entries.")
-		return
-
-	data: list[tuple[str, str]] = list()
-	for pug_info in entries:
-		member = info.guild.get_member(pug_info.discord_id)
-		if not member:
-			continue
-		role = get_member_level_role(member.roles)
-		data.append((
-			str(member),
-			f"""{member.mention}
+	def format_entries(entries: list[PugEntry]) -> list[tuple[str, str]]:
+		data: list[tuple[str, str]] = list()
+		for pug_info in entries:
+			member = info.guild.get_member(pug_info.discord_id)
+			if not member:
+				continue
+			role = get_member_level_role(member.roles)
+			data.append((
+				str(member),
+				f"""{member.mention}
 Level Role: {role.mention if role else "None"}
 Win Count: {pug_info.win_count if not newbie else pug_info.newbie_win_count}
 Lose Count: {pug_info.lose_count if not newbie else pug_info.newbie_lose_count}
 Tie Count: {pug_info.tie_count if not newbie else pug_info.newbie_tie_count}
 Elo: {pug_info.elo if not newbie else pug_info.newbie_elo}
 Restrictions: {" ".join([TF2CC.class_emojis.get(class_num) for class_num in pug_info.class_bans]) if pug_info.class_bans else "None"}"""
-		))
-
-	await send_menu_pages(
-		data = data,
-		info_obj = info,
-		amnt_per_page = 9,
+			))
+		return data
+
+	# pages are read and formatted as they are shown instead of all at once
+	source = leaderboard_page_source(
+		newbie,
+		9,
+		format_entries,
 		embed_title = "Top TF2CC Puggers",
 		embed_color = Color.from_rgb(255, 255, 255)
 	)
+	if await source.count() == 0:
+		await info.send("There are no pug entries.")
+		return
+
+	await send_lazy_menu_pages(source, info)
 
 
 async def setlevel(info: Union[Context, Interaction], member: Member, level_role: Role):
@@ -534,6 +577,41 @@ async def setsteam(info: Union[Context, Interaction], member: Member, steamid: i
 	await info.send(embed = embed)
 
 
+BACKFILL_STATUS_INTERVAL = 15
+
+
+def backfill_embed(stats: dict[str, int | float], running: bool) -> Embed:
+	return Embed(
+		title = "logs.tf Backfill " + ("Running" if running else "Finished"),
+		description = f"""
+**Players** - `{stats["players_done"]}` done, `{stats["players_failed"]}` stopped early, `{stats["players"]}` total
+**Logs Stored** - `{stats["logs_stored"]}` (`{stats["logs_per_minute"]}` per minute)
+**Logs Already Stored** - `{stats["logs_skipped"]}`
+**Logs Downloaded** - `{stats["downloaded"]}`
+**Logs Failed** - `{stats["logs_failed"]}` will be retried, `{stats["logs_bad"]}` missing or unreadable
+""",
+		color = Color.blue() if running else Color.green(),
+		timestamp = utcnow()
+	)
+
+
+async def backfill(info: Union[Context, Interaction]):
+	"""Backfills player match stats from the logs.tf history of every linked steam account, or shows the progress of the one running."""
+	bot = get_bot(info)
+	if BACKFILL.running:
+		await info.send(embed = backfill_embed(BACKFILL.stats, True))
+		return
+	steam_ids = await get_linked_steam_ids()
+	assert steam_ids, "No members have a linked Steam account."
+	task = BACKFILL.start(bot.http_client, steam_ids, bot.log)
+	await info.send(f"Started a backfill for {len(steam_ids)} Steam accounts.")
+	# a normal channel message, interaction messages can't be edited after 15 minutes and a backfill runs much longer
+	msg = await info.channel.send(embed = backfill_embed(BACKFILL.stats, True))
+	while not task.done():
+		await asyncio.wait((task,), timeout = BACKFILL_STATUS_INTERVAL)
+		await msg.edit(embed = backfill_embed(BACKFILL.stats, not task.done()))
+
+
 async def toggleclassban(info: Union[Context, Interaction], member: Member, classban_role: Role):
 	if member.get_role(classban_role.id):
 		await member.remove_roles(classban_role, reason = "Toggling class ban role via command", atomic = False)
@@ -559,43 +637,80 @@ async def toggleclassban(info: Union[Context, Interaction], member: Member, clas
 	)
 
 
-async def move_to_vc(members: Iterable[Member], vc: VoiceChannel, reason: str = None):
-	for member in members:
-		try:
-			await member.move_to(vc, reason = reason)
-		except HTTPException:
-			pass
-
-
-async def get_log(steam_id: int) -> Optional[int]:
-	# get most recent log from steam_id
-	async with aiohttp.ClientSession() as client:
-		async with client.get(LOGS_API_GET_LOG_IDS.format(steam_ids = steam_id), ssl = False) as resp:
-			resp.raise_for_status()
-			log_dict: dict = await resp.json()
-	# get the log list
-	log_list: list[dict] = log_dict.get("logs", list())
-	if not len(log_list):
-		return None
-	# get the log
-	log = log_list[0]
-	# if more than 5 minutes passed, then wrong log
-	cur_time = utcnow()
-	log_time = datetime.fromtimestamp(log.get("date", 0), tz = timezone.utc)
-	if (cur_time - log_time).total_seconds() > 5 * 60:
-		return None
-	# possibly correct log otherwise
-	return log.get("id", None)
-
-
-async def get_log_info(log_id: int) -> dict:
-	async with aiohttp.ClientSession() as client:
-		async with client.get(LOGS_API_GET_LOG.format(log_id = log_id), ssl = False) as resp:
-			resp.raise_for_status()
-			return await resp.json()
+LOG_MAX_AGE = 5 * 60 # seconds between a log upload and the move, older logs are from a previous game
+LOG_SEARCH_GROUP_SIZE = 3 # logs.tf only returns logs that have every player asked for, so ask in small groups
+LOG_MIN_ROSTER_OVERLAP = 0.5 # part of the voice channel roster that has to be in the log
+
+
+async def get_log(http_client: HTTPClient, steam_ids: Iterable[int], played_at: int) -> Optional[int]:
+	# get the log that has all of steam_ids in it and was uploaded around played_at
+	# a few logs are asked for since the players may have played another game by the time this runs
+	log_dict: dict = await http_client.get_json(LOGS_API_GET_LOG_IDS.format(steam_ids = ",".join([str(steam_id) for steam_id in steam_ids])))
+	log: dict
+	for log in log_dict.get("logs", list()):
+		log_time: int = log.get("date", 0)
+		if played_at - LOG_MAX_AGE <= log_time <= played_at + LOG_MAX_AGE:
+			return log.get("id", None)
+	return None
+
+
+async def get_log_info(http_client: HTTPClient, log_id: int) -> dict:
+	# logs never change, so only download the ones not on disk yet
+	log = await LOG_CACHE.get(log_id)
+	if log is None:
+		log = await http_client.get_json(LOGS_API_GET_LOG.format(log_id = log_id))
+		await LOG_CACHE.put(log_id, log)
+	return log
+
+
+def get_log_steam_ids(log: dict) -> set[int]:
+	# log players are keyed by steam3 ids, "[U:1:123]"
+	return {76561197960265728 + int(player_id[5:-1]) for player_id in log.get("players", dict())}
+
+
+async def find_match_log(http_client: HTTPClient, steam_ids: list[int], played_at: int) -> Optional[tuple[int, dict]]:
+	"""Finds the log of the game the roster played at `played_at`. Returns the log id and the log, or `None`.
+
+The roster is searched in small groups at once and the first log that has enough of the roster in it wins.
+If every search failed, the last error is raised."""
+	roster = set(steam_ids)
+	log_infos: dict[int, asyncio.Task] = dict() # groups finding the same log only download it once
+
+	async def search(group: list[int]) -> Optional[tuple[int, dict]]:
+		log_id = await get_log(http_client, group, played_at)
+		if log_id is None:
+			return None
+		if log_id not in log_infos:
+			log_infos[log_id] = asyncio.create_task(get_log_info(http_client, log_id))
+		log = await log_infos[log_id]
+		if len(roster & get_log_steam_ids(log)) < LOG_MIN_ROSTER_OVERLAP * len(roster):
+			return None
+		return log_id, log
+
+	tasks = [asyncio.create_task(search(steam_ids[i:i + LOG_SEARCH_GROUP_SIZE])) for i in range(0, len(steam_ids), LOG_SEARCH_GROUP_SIZE)]
+	last_error: Optional[Exception] = None
+	errors = 0
+	try:
+		for next_done in asyncio.as_completed(tasks):
+			try:
+				result = await next_done
+			except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+				last_error = error
+				errors += 1
+				continue
+			if result is not None:
+				return result
+	finally:
+		for task in tasks + list(log_infos.values()):
+			task.cancel()
+	if errors == len(tasks) and last_error is not None:
+		raise last_error
+	return None
 
 
 class LogInfo:
+	__slots__ = ("newbie", "blue_team", "red_team", "length", "total_rounds")
+
 	def __init__(self, log: dict[str, Union[dict, int]], newbie = False):
 		self.newbie = newbie
 		self.blue_team = Team("blue", log["teams"]["Blue"])
@@ -630,18 +745,18 @@ class LogInfo:
 	def _add_players_to_team(self, log: dict):
 		players: dict[str, dict] = log["players"]
 		for player_id, player_info in players.items():
-			player_team_name: str = player_info.get("team", None)
-			if player_team_name is None:
-				continue
-			player = Player(
+			player_team_name: str = (player_info.get("team", None) or "").lower()
+			if player_team_name == self.red_team.name:
+				team = self.red_team
+			elif player_team_name == self.blue_team.name:
+				team = self.blue_team
+			else:
+				continue # spectators, etc
+			team.add_player(Player(
 				int(player_id[5:-1]),
 				player_info,
 				self.newbie
-			)
-			if player_team_name.lower() == self.red_team.name:
-				self.red_team.add_player(player)
-			elif player_team_name.lower() == self.blue_team.name:
-				self.blue_team.add_player(player)
+			))
 
 	def add_members_to_teams(self, puggers: Iterable[Pugger]):
 		for pugger in puggers:
@@ -656,27 +771,16 @@ class LogInfo:
 		return 1 / (1 + pow(10, (team1_avg_elo - team2_avg_elo) / 300))
 
 	async def update_players_elo(self):
-		red_elo_change, blu_elo_change = self.get_team_elo_changes(self.red_team.avg_elo, self.blue_team.avg_elo)
-
-		for player in self.red_team.players:
-			if player.member is None:
-				continue
-			await edit_pug_entry(
-				user = player.member,
-				win_count = player.win_count + 1 if self.red_team_won else player.win_count,
-				lose_count = player.lose_count + 1 if self.blu_team_won else player.lose_count,
-				elo = player.elo + red_elo_change
-			)
-
-		for player in self.blue_team.players:
-			if player.member is None:
-				continue
-			await edit_pug_entry(
-				user = player.member,
-				win_count = player.win_count + 1 if self.blu_team_won else player.win_count,
-				lose_count = player.lose_count + 1 if self.red_team_won else player.lose_count,
-				elo = player.elo + blu_elo_change
-			)
+		red_elo_change, blu_elo_change = await self.get_team_elo_changes(self.red_team.avg_elo, self.blue_team.avg_elo)
+		await apply_pug_match_result(
+			[player.member.id for player in self.red_team.players if player.member is not None],
+			[player.member.id for player in self.blue_team.players if player.member is not None],
+			red_elo_change,
+			blu_elo_change,
+			red_won = self.red_team_won,
+			blu_won = self.blu_team_won,
+			newbie = self.newbie
+		)
 
 	async def get_team_elo_changes(self, avg_red_elo: float, avg_blu_elo: float) -> tuple[int, int]:
 		base_elo_change = 40
@@ -699,94 +803,116 @@ class LogInfo:
 		)
 
 
-async def move_elo_change(red_members: Iterable[Member], blu_members: Iterable[Member], log_channel: TextChannel, newbie: bool):
-	red_team: list[Pugger] = list()
-	blu_team: list[Pugger] = list()
-	# get pug info -> make Pugger objects for both teams
-	# the channels may contain different amount of members, so need two loops
-	for member in red_members:
-		pug_info = await get_pug_entry(member.id)
-		if not pug_info:
-			await new_pug_entry(user = member)
-			pug_info = await get_pug_entry(member.id)
-		red_team.append(Pugger(member, pug_info = pug_info))
-	for member in blu_members:
-		pug_info = await get_pug_entry(member.id)
-		if not pug_info:
-			await new_pug_entry(user = member)
-			pug_info = await get_pug_entry(member.id)
-		blu_team.append(Pugger(member, pug_info = pug_info))
+MATCH_FIRST_ATTEMPT_DELAY = 60 # seconds, logs.tf usually has the log by then
+MATCH_MAX_RETRY_DELAY = 15 * 60
+MATCH_LOG_WINDOW = 2 * 60 * 60 # stop looking for the log after this long
 
-	# get all steam ids from puggers
-	steam_ids = [pugger.steam_id for pugger in red_team + blu_team if pugger.steam_id]
-	if not len(steam_ids):
-		return
 
-	# get log based on one steam_id
-	log_id = None
-	for steam_id in steam_ids:
-		log_id = await get_log(steam_id)
-		if log_id: break
-	if not log_id:
-		return
+async def queue_match_result(red_members: Iterable[Member], blu_members: Iterable[Member], log_channel: Optional[TextChannel], newbie: bool):
+	"""Saves the match so the pending match worker applies its elo once the log shows up on logs.tf."""
+	now = int(utcnow().timestamp())
+	await new_pending_match(
+		[member.id for member in red_members],
+		[member.id for member in blu_members],
+		log_channel.id if log_channel else None,
+		newbie = newbie,
+		created_at = now,
+		next_attempt = now + MATCH_FIRST_ATTEMPT_DELAY
+	)
 
-	# send log to channel
-	if log_channel:
-		await log_channel.send(f"https://logs.tf/{log_id}")
 
-	# get the log info
-	log = await get_log_info(log_id)
-	log_info = LogInfo(log, newbie)
+async def retry_or_give_up(match: PendingMatchEntry, give_up_status: str) -> str:
+	"""Schedules the next try with exponential backoff, or finishes the match once its window has passed. Returns the new status."""
+	now = int(utcnow().timestamp())
+	if now - match.created_at >= MATCH_LOG_WINDOW:
+		await finish_pending_match(match.match_id, give_up_status, now)
+		return give_up_status
+	attempts = match.attempts + 1
+	delay = min(MATCH_FIRST_ATTEMPT_DELAY * 2 ** attempts, MATCH_MAX_RETRY_DELAY)
+	await retry_pending_match(match.match_id, attempts, now + delay)
+	return MATCH_PENDING
 
-	# calculate elo change value
-	# the teams may contain different amount of members, so need two loops
-	red_elo = list()
-	blu_elo = list()
-	for red_pugger in red_team:
-		red_elo.append(red_pugger.newbie_elo if newbie else red_pugger.elo)
-	for blu_pugger in blu_team:
-		blu_elo.append(blu_pugger.newbie_elo if newbie else blu_pugger.elo)
-
-	# if nothing found, return
-	if not red_elo or not blu_elo:
-		return
 
+async def process_pending_match(bot: TF2CCBot, match: PendingMatchEntry) -> str:
+	"""Looks for the match log once and applies the elo change if it is found. Returns the match status afterwards."""
+	pug_infos = await get_or_new_pug_entries(match.red_ids + match.blu_ids)
+	red_team = [pug_infos[discord_id] for discord_id in match.red_ids]
+	blu_team = [pug_infos[discord_id] for discord_id in match.blu_ids]
+
+	# get all steam ids from puggers
+	steam_ids = [pug_info.steam_id for pug_info in red_team + blu_team if pug_info.steam_id]
+	if len(red_team + blu_team) < 4 or not red_team or not blu_team or not steam_ids:
+		await finish_pending_match(match.match_id, MATCH_NO_PLAYERS, int(utcnow().timestamp()))
+		return MATCH_NO_PLAYERS
+
+	# find the log these players played
+	try:
+		found = await find_match_log(bot.http_client, steam_ids, match.created_at)
+	except (aiohttp.ClientError, asyncio.TimeoutError):
+		found = None # logs.tf is down or slow, try again later
+	if found is None:
+		return await retry_or_give_up(match, MATCH_NO_LOG)
+	log_id, log = found
+
+	log_info = LogInfo(log, match.newbie)
+
+	# calculate elo change value
+	red_elo = [pug_info.newbie_elo if match.newbie else pug_info.elo for pug_info in red_team]
+	blu_elo = [pug_info.newbie_elo if match.newbie else pug_info.elo for pug_info in blu_team]
 	red_elo_change, blu_elo_change = await log_info.get_team_elo_changes(
 		mean(red_elo),
 		mean(blu_elo)
 	)
 
-	# set up for mass edit in DB
-	key_names = (
-		PUG_TABLE_VALUES[1 if not newbie else 8], # win count
-		PUG_TABLE_VALUES[2 if not newbie else 9], # lose count
-		PUG_TABLE_VALUES[3 if not newbie else 10], # tie count
-		PUG_TABLE_VALUES[4 if not newbie else 11], # elo
-		PUG_TABLE_VALUES[0] # discord id
+	# mark the match done and change everyone's counters and elo in one transaction, so a result is applied exactly once
+	applied = await apply_pending_match_result(
+		match,
+		log_id,
+		int(utcnow().timestamp()),
+		red_elo_change,
+		blu_elo_change,
+		red_won = log_info.red_team_won,
+		blu_won = log_info.blu_team_won
 	)
+	if not applied:
+		return MATCH_APPLIED
 
-	# get the new values to enter into the DB
-	# the teams may contain different amount of members, so need two loops
-	key_vals = list()
-	for red_pugger in red_team:
-		key_vals.append((
-			(red_pugger.newbie_win_count if newbie else red_pugger.win_count) + (1 if log_info.red_team_won else 0), # win count
-			(red_pugger.newbie_lose_count if newbie else red_pugger.lose_count) + (1 if log_info.blu_team_won else 0), # lose count
-			(red_pugger.newbie_tie_count if newbie else red_pugger.tie_count) + (1 if log_info.teams_tied else 0), # tie count
-			(red_pugger.newbie_elo if newbie else red_pugger.elo) + red_elo_change, # elo
-			red_pugger.discord_id # discord_id
-		))
-	for blu_pugger in blu_team:
-		key_vals.append((
-			(blu_pugger.newbie_win_count if newbie else blu_pugger.win_count) + (1 if log_info.blu_team_won else 0), # win count
-			(blu_pugger.newbie_lose_count if newbie else blu_pugger.lose_count) + (1 if log_info.red_team_won else 0), # lose count
-			(blu_pugger.newbie_tie_count if newbie else blu_pugger.tie_count) + (1 if log_info.teams_tied else 0), # tie count
-			(blu_pugger.newbie_elo if newbie else blu_pugger.elo) + blu_elo_change, # elo
-			blu_pugger.discord_id # discord_id
-		))
+	# send log to channel, the result is already saved so a failed send is only logged
+	log_channel = bot.get_channel(match.log_channel_id) if match.log_channel_id else None
+	if log_channel:
+		try:
+			await log_channel.send(f"https://logs.tf/{log_id}")
+		except HTTPException as e:
+			bot.log.warning(f"could not send log {log_id} for match {match.match_id}: {e}")
 
-	# update elo values
-	await mass_edit_pug_entries(key_names, tuple(key_vals))
+	# stats are in another database, the match is already applied so a failed write is only logged and not retried
+	# the averages then skip this match, the log id is logged so they can be rebuilt from player_matches
+	try:
+		await add_player_stats_matches(player_stats_values(log_info, red_team + blu_team, int(utcnow().timestamp())))
+	except aiosqlite.Error as e:
+		bot.log.error(f"skipped player stats for match {match.match_id} (log {log_id}, newbie {match.newbie}): {e!r}")
+	return MATCH_APPLIED
+
+
+def player_stats_values(log_info: LogInfo, pug_infos: Iterable[PugEntry], updated_at: int) -> list[tuple]:
+	"""One row of this match's numbers for every pugger found in the log, for `add_player_stats_matches`."""
+	if log_info.length <= 0:
+		return list()
+	values: list[tuple] = list()
+	for pug_info in pug_infos:
+		player = log_info.red_team.get_player(pug_info.steam_id) or log_info.blue_team.get_player(pug_info.steam_id)
+		if player is None:
+			continue
+		dpm = player.damage_per_time(seconds = log_info.length)
+		dtm = player.damage_taken_per_time(seconds = log_info.length)
+		kad = (player.kills + player.assists) / max(player.deaths, 1)
+		values.append((
+			pug_info.discord_id, int(log_info.newbie),
+			log_info.length, player.kills, player.assists, player.deaths, player.damage, player.damage_taken, player.ubers, player.drops,
+			dpm, dtm, kad, player.ubers, player.drops,
+			updated_at
+		))
+	return values
 
 
 class UndoMovePuggersView(View):
@@ -817,9 +943,12 @@ class UndoMovePuggersView(View):
 		await interaction.edit(embed = embed, view = None)
 		self.stop()
 		# move members back to their teams
-		await move_to_vc(self.red_members, self.red_team, "Undo move command")
-		await move_to_vc(self.blu_members, self.blu_team, "Undo move command")
-		await interaction.edit(delete_after = 10)
+		scheduler = MoveScheduler()
+		scheduler.add("Red", self.red_members, self.red_team, "Undo move command")
+		scheduler.add("Blu", self.blu_members, self.blu_team, "Undo move command")
+		phases = await scheduler.run()
+		embed.description += "\n" + "\n".join([str(phase) for phase in phases])
+		await interaction.edit(embed = embed, delete_after = 10)
 
 	@button(label = "Close", emoji = "⛔", style = ButtonStyle.red)
 	async def close_button(self, button: Button, interaction: Interaction):
@@ -867,37 +996,32 @@ class MovePuggersView(View):
 		self.stop()
 
 		# save a copy of the members before moving incase undo
-		red_members = self.red_team.members[:]
-		blu_members = self.blu_team.members[:]
-
-		# move members from waiting to next game
-		if len(self.waiting.members) > 0:
-			await interaction.edit(embed = embed)
-			await move_to_vc(self.waiting.members, self.next_game, "Moving members to next game vc")
-
-		# move members from red team to waiting
-		embed.description += f"\nDone.\n\nMoving members from {self.red_team.mention} to {self.waiting.mention}."
-		await interaction.edit(embed = embed)
-		await move_to_vc(self.red_team.members, self.waiting, "Moving members to waiting vc")
+		red_members = channel_members(self.red_team)
+		blu_members = channel_members(self.blu_team)
+		waiting_members = channel_members(self.waiting)
 
-		# move members from blu team to waiting
-		embed.description += f"\nDone.\n\nMoving members from {self.blu_team.mention} to {self.waiting.mention}."
+		# move everyone at once, the member lists above were taken before anyone moved
+		embed.description += f"\nMoving members from {self.red_team.mention} and {self.blu_team.mention} to {self.waiting.mention}."
 		await interaction.edit(embed = embed)
-		await move_to_vc(self.blu_team.members, self.waiting, "Moving members to waiting vc")
+		scheduler = MoveScheduler()
+		if len(waiting_members) > 0:
+			scheduler.add("Next game", waiting_members, self.next_game, "Moving members to next game vc")
+		scheduler.add("Red", red_members, self.waiting, "Moving members to waiting vc")
+		scheduler.add("Blu", blu_members, self.waiting, "Moving members to waiting vc")
+		phases = await scheduler.run()
+		embed.description += "\n\n" + "\n".join([str(phase) for phase in phases])
 
 		# finished moving. offer an undo
-		embed.description += "\nDone."
 		undo_view = UndoMovePuggersView(red_members, blu_members, self.red_team, self.blu_team)
 		undo_view.msg = interaction.message
 		await interaction.edit(embed = embed, view = undo_view)
 
-		# wait for undo to timeout or close
 		# get log if amnt of puggers >4
 		if len(red_members + blu_members) < 4:
 			return
 
-		# update elo for participants
-		await move_elo_change(red_members, blu_members, self.log_channel, self.newbie)
+		# elo is updated by the pending match worker once the log is on logs.tf
+		await queue_match_result(red_members, blu_members, self.log_channel, self.newbie)
 
 
 	@button(emoji = "⛔", style = ButtonStyle.red)
@@ -916,46 +1040,77 @@ async def movepuggers(info: Union[Context, Interaction], team_vcs: tuple[VoiceCh
 	await info.send(embed = embed, view = MovePuggersView(next_game_vc, waiting_vc, red_team, blu_team, logs_chan, newbie))
 
 
-def genteams_exchange_medlocked(med_locked: list[Pugger], final_list: list[Pugger], pool: list[Pugger], newbie: bool):
-	# removes players from the pool and exchanges them in place on the final list
-	# raise error if there is no one in the pool
-	if not len(pool):
-		raise CommandError("Could not generate teams. There are too many med locked players.")
+def genteams_class_slots(team_size: int) -> tuple[str]:
+	return TF2CC.class_slots.get(team_size, default_class_slots(team_size))
 
-	# get a random med locked pugger
-	med_locked_pugger = med_locked.pop(randint(0, len(med_locked) - 1))
 
-	# find a replacement in the pool
-	closest: Pugger = None
-	smallest_elo_diff: int = 10000
-	for pugger in pool:
-		# skip if medlocked
-		if pugger.medlocked:
-			continue
-
-		elo_diff = abs(med_locked_pugger.elo if not newbie else med_locked_pugger.newbie_elo)
-		if elo_diff < smallest_elo_diff:
-			closest = pugger
-			smallest_elo_diff = elo_diff
-
-	# raise error if no replacement is found
-	if not closest:
-		raise CommandError("Could not generate teams. Could not find a replacement for a med locked player.")
-
-	# make the exchange inplace
-	exchange_pugger = pool.pop(pool.index(closest))
-	final_list[final_list.index(med_locked_pugger)] = exchange_pugger
-	#pool.append(med_locked_pugger)
+def genteams_pick_puggers(puggers: Iterable[Pugger], amnt_per_team: int, newbie: bool) -> list[Pugger]:
+	# picks who plays, in queue order, then swaps players for the closest elo players in the pool
+	# until both teams together can fill every class slot (which also means at most 2 med locked players)
+	final_list: list[Pugger] = puggers[:amnt_per_team * 2] # get first 12 puggers
+	pool: list[Pugger] = sorted(puggers[amnt_per_team * 2:], key = lambda pugger: pugger.elo if not newbie else pugger.newbie_elo) # the remaining if any
+	pool_elos = [pugger.elo if not newbie else pugger.newbie_elo for pugger in pool]
+	slots = genteams_class_slots(len(final_list) // 2) * 2
+	medic_slots = slots.count(MEDIC)
+
+	while True:
+		# med locked players are matched first, so one is only left without a slot when there are more of them than medic slots
+		order = sorted(range(len(final_list)), key = lambda i: not final_list[i].medlocked)
+		slot_players = [None if player is None else order[player] for player in match_class_slots([final_list[i].playable_classes for i in order], slots)]
+		unfilled = [slot for slot, player in enumerate(slot_players) if player is None]
+		if not unfilled:
+			return final_list
+
+		# the last queued player without a slot makes room, extra med locked players first since they can only ever be medic
+		matched = set(slot_players)
+		drop = max((i for i in range(len(final_list)) if i not in matched), key = lambda i: (final_list[i].medlocked, i))
+		dropped = final_list[drop]
+		needed = {slots[slot] for slot in unfilled}
+
+		# walk out from the dropped player's elo to the closest pool player that can fill one of the empty slots
+		dropped_elo = dropped.elo if not newbie else dropped.newbie_elo
+		right = bisect_left(pool_elos, dropped_elo)
+		left = right - 1
+		replacement: Optional[int] = None
+		while left >= 0 or right < len(pool):
+			if right >= len(pool) or (left >= 0 and dropped_elo - pool_elos[left] <= pool_elos[right] - dropped_elo):
+				if any(can_fill(pool[left].playable_classes, slot) for slot in needed):
+					replacement = left
+					break
+				left -= 1
+			else:
+				if any(can_fill(pool[right].playable_classes, slot) for slot in needed):
+					replacement = right
+					break
+				right += 1
+
+		if replacement is None:
+			if sum(pugger.medlocked for pugger in final_list) > medic_slots:
+				raise CommandError("Could not generate teams. There are too many med locked players.")
+			return final_list # nobody left can play the class, make teams anyway
+		final_list[drop] = pool.pop(replacement)
+		pool_elos.pop(replacement)
+
+
+def genteams_fix_class_slots(team1: list[Pugger], team2: list[Pugger], newbie: bool) -> tuple[list[Pugger], list[Pugger]]:
+	# swaps players between the teams until both can fill every class slot
+	if len(team1) != len(team2):
+		return team1, team2
+	puggers = team1 + team2
+	team1_idxs, team2_idxs = fix_class_slots(
+		list(range(len(team1))),
+		list(range(len(team1), len(puggers))),
+		[pugger.playable_classes for pugger in puggers],
+		genteams_class_slots(len(team1)),
+		[pugger.elo if not newbie else pugger.newbie_elo for pugger in puggers]
+	)
+	return [puggers[i] for i in team1_idxs], [puggers[i] for i in team2_idxs]
 
 
 def genteams_random_team_algo(puggers: Iterable[Pugger], amnt_per_team: int, newbie: bool) -> tuple[tuple[Pugger]]:
 	# generate two teams of the given size if possible
-	final_list: list[Pugger] = puggers[:amnt_per_team * 2] # get first 12 puggers
-	pool: list[Pugger] = puggers[amnt_per_team * 2:] # the remaining if any
-
-	# check for >2 med locked players
+	final_list = genteams_pick_puggers(puggers, amnt_per_team, newbie)
 	med_locked = [pugger for pugger in final_list if pugger.medlocked]
-	while len(med_locked) > 2: genteams_exchange_medlocked(med_locked, final_list, pool, newbie)
 
 	# remove the 2 med locked players from the list
 	if len(med_locked) == 2:
@@ -1002,30 +1157,78 @@ def genteams_random_team_algo(puggers: Iterable[Pugger], amnt_per_team: int, new
 				team1.append(chunk[2])
 				team2.append(chunk[3])
 
+	team1, team2 = genteams_fix_class_slots(team1, team2, newbie)
 	return (tuple(team1), tuple(team2))
 
 
-async def genteams_setup(next_game: VoiceChannel, waiting_room: VoiceChannel, amnt_per_team: int, newbie: bool) -> tuple[tuple[Pugger]]:
-	# generate teams
-	all_puggers: list[Pugger] = list()
-	pug_banned: list[Member] = list()
-	for member in next_game.members + waiting_room.members:
-		# if member is pug banned, skip
-		if member.get_role(TF2CC.pug_strike3_rid):
-			pug_banned.append(member)
-			continue
+GENTEAMS_CANDIDATE_COUNT = 10 # splits made at once, rerolls go through these before making more
+
+
+def genteams_random_candidates(puggers: list[Pugger], amnt_per_team: int, newbie: bool, count: int) -> list[tuple[tuple[Pugger]]]:
+	# a few extra tries in case some shuffles give the same teams
+	candidates: dict[frozenset, tuple[tuple[Pugger]]] = dict()
+	for _ in range(count * 2):
+		team1, team2 = genteams_random_team_algo(puggers, amnt_per_team, newbie)
+		key = frozenset((frozenset(pugger.discord_id for pugger in team1), frozenset(pugger.discord_id for pugger in team2)))
+		candidates.setdefault(key, (team1, team2))
+		if len(candidates) == count:
+			break
+	return list(candidates.values())
+
+
+def genteams_balanced_candidates(puggers: list[Pugger], amnt_per_team: int, newbie: bool, count: int) -> list[tuple[tuple[Pugger]]]:
+	# same players as the random algo, but split so both teams have about the same mean and median elo, best split first
+	final_list = genteams_pick_puggers(puggers, amnt_per_team, newbie)
+	if len(final_list) % 2:
+		final_list = final_list[:-1] # not enough people for full teams, the last one in the queue sits out
+	balancer = TeamBalancer(
+		[pugger.elo if not newbie else pugger.newbie_elo for pugger in final_list],
+		[pugger.int_level for pugger in final_list],
+		[pugger.medlocked for pugger in final_list],
+		playable_classes = [pugger.playable_classes for pugger in final_list],
+		class_slots = genteams_class_slots(len(final_list) // 2)
+	)
+	return [
+		(tuple(final_list[i] for i in team1), tuple(final_list[i] for i in team2))
+		for team1, team2 in balancer.best_splits(count)
+	]
+
+
+GENTEAMS_ALGOS = {
+	"Random": genteams_random_candidates,
+	"Balanced": genteams_balanced_candidates
+}
+
 
-		# make and get pug entry
-		await new_pug_entry(user = member)
-		pug_info = await get_pug_entry(member.id)
-		all_puggers.append(
-			Pugger(
+def genteams_queue_key(next_game: VoiceChannel, waiting_room: VoiceChannel) -> tuple[tuple[int, bool]]:
+	# changes whenever someone joins, leaves, or moves between the two voice channels
+	return queue_snapshot(next_game, waiting_room).key
+
+
+async def genteams_load_puggers(next_game: VoiceChannel, waiting_room: VoiceChannel, amnt_per_team: int, newbie: bool, known: dict[int, Pugger] = None) -> list[Pugger]:
+	"""Returns everyone that can play, priority players first. Only members not in `known` are read from the database."""
+	known = known or dict()
+	snapshot = queue_snapshot(next_game, waiting_room)
+	members = [entry.member for entry in snapshot.entries]
+	pug_banned = snapshot.pug_banned
+
+	# make and get pug entries for everyone new at once, these were usually cached when they joined the queue
+	new_ids = [member.id for member in members if member.id not in known]
+	pug_infos = await get_or_new_pug_entries(new_ids) if new_ids else dict()
+	all_puggers: list[Pugger] = list()
+	for entry in snapshot.entries:
+		member = entry.member
+		pugger = known.get(member.id)
+		priority = entry.channel_id == next_game.id
+		if pugger is None or pugger.priority != priority:
+			pugger = Pugger(
 				member,
-				priority = member in next_game.members,
-				pug_info = pug_info,
-				newbie = newbie
+				priority = priority,
+				pug_info = pug_infos[member.id] if pugger is None else pugger.pug_info,
+				newbie = newbie,
+				level_roles = entry.level_roles
 			)
-		)
+		all_puggers.append(pugger)
 
 	if len(all_puggers) < amnt_per_team:
 		error = f"Not enough people in pug voice channels: `{len(all_puggers)} / {amnt_per_team * 2}` people."
@@ -1033,19 +1236,18 @@ async def genteams_setup(next_game: VoiceChannel, waiting_room: VoiceChannel, am
 			error += "\n" + ", ".join([member.mention for member in pug_banned]) + f" {'is' if len(pug_banned) == 1 else 'are'} Pug Banned."
 		raise ValueError(error)
 
-	priority = [pugger for pugger in all_puggers if pugger.priority]
-	regular = [pugger for pugger in all_puggers if not pugger.priority]
-	return genteams_random_team_algo(priority + regular, amnt_per_team, newbie)
+	# the snapshot already has priority players first
+	return all_puggers
 
 
-def genteams_embed(team1: Iterable[Pugger], team2: Iterable[Pugger], newbie: bool) -> Embed:
+def genteams_embed(team1: Iterable[Pugger], team2: Iterable[Pugger], newbie: bool, mode: str = "Random") -> Embed:
 	red_elo: list[int] = list()
 	blu_elo: list[int] = list()
 	for red_pugger, blu_pugger in zip(team1, team2):
 		red_elo.append(red_pugger.elo if not newbie else red_pugger.newbie_elo)
 		blu_elo.append(blu_pugger.elo if not newbie else blu_pugger.newbie_elo)
 
-	return Embed(title = f"Random Team Lists").add_field(
+	return Embed(title = f"{mode} Team Lists").add_field(
 		name = f"🔴 Red Team\n{int(mean(red_elo))} avg elo | {int(median(red_elo))} median",
 		value = "\n".join([str(pugger) for pugger in team1])
 	).add_field(
@@ -1061,8 +1263,8 @@ class GenteamsView(View):
 		next_game: VoiceChannel, waiting: VoiceChannel,
 		apugs: tuple[VoiceChannel], bpugs: tuple[VoiceChannel],
 		staff: User,
-		team1: Iterable[Pugger], team2: Iterable[Pugger],
-		amnt_per_team: int, newbie: bool,
+		puggers: list[Pugger], candidates: list[tuple[tuple[Pugger]]],
+		amnt_per_team: int, newbie: bool, mode: str,
 		*, timeout = 120
 	):
 		super().__init__(timeout = timeout)
@@ -1071,10 +1273,15 @@ class GenteamsView(View):
 		self.apugs = apugs
 		self.bpugs = bpugs
 		self.staff = staff
-		self.team1 = team1
-		self.team2 = team2
+		# rerolls are served from the candidates, the puggers are only read again if the voice channels change
+		self.puggers = puggers
+		self.candidates = candidates
+		self.candidate_index = 0
+		self.team1, self.team2 = candidates[0]
+		self.queue_key = genteams_queue_key(next_game, waiting)
 		self.amnt_per_team = amnt_per_team
 		self.newbie = newbie
+		self.mode = mode
 		self.msg: Union[Message, PartialInteractionMessage] = None
 
 	async def on_timeout(self) -> None:
@@ -1109,7 +1316,7 @@ class GenteamsView(View):
 			RUNNER_DB.table_column_names[3]: (info.npugs + 1) if self.newbie else info.npugs, # npugs
 			RUNNER_DB.table_column_names[4]: int(utcnow().timestamp()) if self.newbie else info.npugs_last_ran, # npugs_last_ran
 		}
-		await edit_runner_entry(
+		await defer_edit_runner_entry(
 			intr.user.id,
 			**payload
 		)
@@ -1125,7 +1332,7 @@ class GenteamsView(View):
 		pugger: Pugger
 		for pugger in self.team1 + self.team2:
 			query.append((timestamp, pugger.discord_id))
-		await mass_edit_pug_entries(key_names, tuple(query))
+		await defer_mass_edit_pug_entries(key_names, tuple(query))
 
 		# if newbie pugs, send to audit channel
 		'''
@@ -1140,14 +1347,29 @@ command used at {format_dt(cur_time)} ({format_dt(cur_time, style = "R")})"""
 		'''
 
 		# move puggers to vc
-		await move_to_vc([pugger.member for pugger in self.team1], vcs[0], "Moving to pug team vc")
-		await move_to_vc([pugger.member for pugger in self.team2], vcs[1], "Moving to pug team vc")
+		scheduler = MoveScheduler()
+		scheduler.add("Red", [pugger.member for pugger in self.team1], vcs[0], "Moving to pug team vc")
+		scheduler.add("Blu", [pugger.member for pugger in self.team2], vcs[1], "Moving to pug team vc")
+		for phase in await scheduler.run():
+			intr.client.log.debug(f"genteams {phase}")
 
 	@button(label = "Reroll Teams", emoji = "🎲", style = ButtonStyle.blurple)
 	async def reroll_button(self, button: Button, interaction: Interaction):
 		await interaction.response.defer()
-		self.team1, self.team2 = await genteams_setup(self.next_game, self.waiting, self.amnt_per_team, self.newbie)
-		await interaction.edit(embed = genteams_embed(self.team1, self.team2, self.newbie))
+		queue_key = genteams_queue_key(self.next_game, self.waiting)
+		if queue_key != self.queue_key:
+			known = {pugger.discord_id: pugger for pugger in self.puggers}
+			self.puggers = await genteams_load_puggers(self.next_game, self.waiting, self.amnt_per_team, self.newbie, known)
+			self.queue_key = queue_key
+			self.candidate_index = len(self.candidates) # make new candidates below
+		else:
+			self.candidate_index += 1
+
+		if self.candidate_index >= len(self.candidates):
+			self.candidates = GENTEAMS_ALGOS[self.mode](self.puggers, self.amnt_per_team, self.newbie, GENTEAMS_CANDIDATE_COUNT)
+			self.candidate_index = 0
+		self.team1, self.team2 = self.candidates[self.candidate_index]
+		await interaction.edit(embed = genteams_embed(self.team1, self.team2, self.newbie, self.mode))
 
 	@button(label = "Move To A-Pugs", emoji = "🅰️", style = ButtonStyle.green)
 	async def move_to_red_button(self, button: Button, interaction: Interaction):
@@ -1170,25 +1392,28 @@ async def genteams(
 	waiting_vc: VoiceChannel,
 	next_game_vc: VoiceChannel,
 	amnt_per_team: int,
-	newbie: bool
+	newbie: bool,
+	mode: str = "Random"
 ):
 	mem = get_user(info)
 	#await new_runner_entry(mem.id)
-	team1, team2 = await genteams_setup(next_game_vc, waiting_vc, amnt_per_team, newbie)
+	puggers = await genteams_load_puggers(next_game_vc, waiting_vc, amnt_per_team, newbie)
+	candidates = GENTEAMS_ALGOS[mode](puggers, amnt_per_team, newbie, GENTEAMS_CANDIDATE_COUNT)
+	team1, team2 = candidates[0]
 	view = GenteamsView(
 		next_game_vc, waiting_vc, # queued puggers
 		apugs, bpugs, # team VCs
 		mem, # staff
-		team1, team2, # gen'd teams
-		amnt_per_team, newbie # extra
+		puggers, candidates, # loaded puggers and gen'd teams
+		amnt_per_team, newbie, mode # extra
 	)
 
 	# disable A Pugs button if there are people in A Pugs
-	if len(apugs[0].members + apugs[1].members) > 0:
+	if len(channel_members(apugs[0]) + channel_members(apugs[1])) > 0:
 		view.children[1].disabled = True
 	# disable B Pugs button if there are people in B Pugs
-	if len(bpugs[0].members + bpugs[1].members) > 0:
+	if len(channel_members(bpugs[0]) + channel_members(bpugs[1])) > 0:
 		view.children[2].disabled = True
 
-	msg = await info.send(embed = genteams_embed(team1, team2, newbie), view = view)
+	msg = await info.send(embed = genteams_embed(team1, team2, newbie, mode), view = view)
 	view.msg = msg
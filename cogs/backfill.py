@@ -0,0 +1,192 @@
+import asyncio, os
+from aiohttp import ClientResponseError
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+from multiprocessing import get_context
+from time import monotonic, time
+from typing import Iterable, Optional
+from httpclient import HTTPClient
+from staticvars import LOGS_API_SEARCH
+from .static import LOGS_API_GET_LOG
+from .StatsDB import add_player_match_stats, get_backfill_progress, get_stored_log_ids, save_backfill_progress
+from .logcache import LOG_CACHE
+from .logstats import parse_player_stats
+
+
+BACKFILL_PAGE_SIZE = 200 # logs per search request
+BACKFILL_PLAYER_WORKERS = 4 # players paged through at once
+BACKFILL_DOWNLOADS = 8 # log downloads at once, logs.tf's token bucket in httpclient.py still sets the request rate
+BACKFILL_PROCESSES = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+class Backfill:
+	"""Pages through the logs.tf history of a set of steam ids and stores per player stats for every log in `player_matches`.
+
+Logs come from the log cache when they are there, otherwise they are downloaded and cached. Parsing runs in a process pool
+so it doesn't block the bot. A player's position is checkpointed in `backfill_progress` after every page, and only once
+every log on that page is stored, so a stopped or crashed backfill carries on where it left off without skipping logs.
+Players that finished are only checked for logs newer than the ones already stored."""
+	def __init__(self, *, page_size: int = BACKFILL_PAGE_SIZE, player_workers: int = BACKFILL_PLAYER_WORKERS, downloads: int = BACKFILL_DOWNLOADS, processes: int = BACKFILL_PROCESSES):
+		self.page_size = page_size
+		self.player_workers = player_workers
+		self.downloads = downloads
+		self.processes = processes
+		self.running = False
+		self._task: Optional[asyncio.Task] = None
+		self._reset()
+
+
+	def _reset(self):
+		self.players_total = 0
+		self.players_done = 0
+		self.players_failed = 0
+		self.logs_stored = 0
+		self.logs_skipped = 0 # already stored, counted once per player that played in it
+		self.logs_bad = 0 # missing on logs.tf or unreadable, never retried
+		self.logs_failed = 0 # will be retried on the next run
+		self.downloaded = 0
+		self.started_at = monotonic()
+		self.finished_at: Optional[float] = None
+		self._log_tasks: dict[int, asyncio.Future] = dict()
+		self._counted: set[int] = set() # logs in logs_stored, players that played together list the same logs
+
+
+	@property
+	def stats(self) -> dict[str, int | float]:
+		elapsed = (self.finished_at or monotonic()) - self.started_at
+		return {
+			"players": self.players_total,
+			"players_done": self.players_done,
+			"players_failed": self.players_failed,
+			"logs_stored": self.logs_stored,
+			"logs_skipped": self.logs_skipped,
+			"logs_bad": self.logs_bad,
+			"logs_failed": self.logs_failed,
+			"downloaded": self.downloaded,
+			"logs_per_minute": round(self.logs_stored / elapsed * 60, 1) if elapsed > 0 else 0.0
+		}
+
+
+	def start(self, http_client: HTTPClient, steam_ids: Iterable[int], log: Logger = None) -> asyncio.Task:
+		"""Starts a backfill in the background, or returns the one already running."""
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self.run(http_client, steam_ids, log))
+		return self._task
+
+
+	async def run(self, http_client: HTTPClient, steam_ids: Iterable[int], log: Logger = None):
+		assert not self.running, "a backfill is already running"
+		self.running = True
+		self._reset()
+		steam_ids = list(dict.fromkeys(steam_ids))
+		self.players_total = len(steam_ids)
+		queue: asyncio.Queue[int] = asyncio.Queue()
+		for steam_id in steam_ids:
+			queue.put_nowait(steam_id)
+
+		# spawn instead of fork, forking copies the bot's threads and open connections
+		pool = ProcessPoolExecutor(self.processes, mp_context = get_context("spawn"))
+		download_semaphore = asyncio.Semaphore(self.downloads)
+
+		async def worker():
+			while True:
+				try:
+					steam_id = queue.get_nowait()
+				except asyncio.QueueEmpty:
+					return
+				try:
+					await self._backfill_player(http_client, pool, download_semaphore, steam_id, log)
+					self.players_done += 1
+				except Exception as e:
+					self.players_failed += 1
+					if log:
+						log.warning(f"backfill stopped for {steam_id}: {e!r}")
+
+		try:
+			await asyncio.gather(*[worker() for _ in range(min(self.player_workers, len(steam_ids)) or 1)])
+		finally:
+			self.finished_at = monotonic()
+			self.running = False
+			await asyncio.to_thread(pool.shutdown, cancel_futures = True)
+			if log:
+				log.info(f"backfill finished: {self.stats}")
+
+
+	async def _backfill_player(self, http_client: HTTPClient, pool: ProcessPoolExecutor, download_semaphore: asyncio.Semaphore, steam_id: int, log: Optional[Logger]):
+		progress = await get_backfill_progress(steam_id)
+		# logs.tf lists the newest logs first, so a finished player only needs the pages until one is already stored
+		catching_up = progress is not None and progress.done
+		offset = 0 if progress is None or catching_up else progress.log_offset
+
+		while True:
+			data = await http_client.get_json(LOGS_API_SEARCH.format(steam_ids = steam_id, limit = self.page_size, offset = offset))
+			log_ids = [entry["id"] for entry in data.get("logs", list())]
+			stored = await get_stored_log_ids(log_ids)
+			self.logs_skipped += len(stored)
+			new_ids = [log_id for log_id in log_ids if log_id not in stored]
+
+			results = await asyncio.gather(*[self._get_log_rows(http_client, pool, download_semaphore, log_id) for log_id in new_ids], return_exceptions = True)
+			rows: list[tuple] = list()
+			stored_count = failed = 0
+			for log_id, result in zip(new_ids, results):
+				if isinstance(result, BaseException):
+					failed += 1
+					if log:
+						log.debug(f"backfill could not get log {log_id}: {result!r}")
+				elif result is not None:
+					rows += result
+					if log_id not in self._counted:
+						self._counted.add(log_id)
+						stored_count += 1
+			if rows:
+				await add_player_match_stats(rows)
+			self.logs_stored += stored_count
+			self.logs_failed += failed
+			if failed:
+				raise RuntimeError(f"{failed} logs failed at offset {offset}, will resume from there")
+
+			offset += len(log_ids)
+			done = len(log_ids) < self.page_size
+			if catching_up:
+				# new logs push old ones to later offsets, the saved offset only matters while unfinished
+				if done or stored:
+					return
+				continue
+			await save_backfill_progress(steam_id, offset, done, int(time()))
+			if done:
+				return
+
+
+	async def _get_log_rows(self, http_client: HTTPClient, pool: ProcessPoolExecutor, download_semaphore: asyncio.Semaphore, log_id: int) -> Optional[list[tuple]]:
+		# players that played together share logs, each log is only fetched and parsed once at a time
+		future = self._log_tasks.get(log_id)
+		if future is None:
+			future = asyncio.ensure_future(self._fetch_and_parse(http_client, pool, download_semaphore, log_id))
+			self._log_tasks[log_id] = future
+			future.add_done_callback(lambda _: self._log_tasks.pop(log_id, None))
+		return await asyncio.shield(future)
+
+
+	async def _fetch_and_parse(self, http_client: HTTPClient, pool: ProcessPoolExecutor, download_semaphore: asyncio.Semaphore, log_id: int) -> Optional[list[tuple]]:
+		"""Returns `None` for logs that can never be stored."""
+		data = await LOG_CACHE.get_raw(log_id)
+		if data is None:
+			async with download_semaphore:
+				try:
+					data = await http_client.get_bytes(LOGS_API_GET_LOG.format(log_id = log_id))
+				except ClientResponseError as e:
+					if e.status != 404: # deleted log
+						raise
+					self.logs_bad += 1
+					return None
+			self.downloaded += 1
+			await LOG_CACHE.put_raw(log_id, data)
+		try:
+			return await asyncio.get_running_loop().run_in_executor(pool, parse_player_stats, log_id, data)
+		except ValueError:
+			self.logs_bad += 1
+			return None
+
+
+
+BACKFILL = Backfill()
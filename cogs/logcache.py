@@ -0,0 +1,141 @@
+import asyncio, gzip, json, os
+from collections import OrderedDict
+from typing import Optional
+from .static import LOG_CACHE_DIR, LOG_CACHE_MAX_BYTES
+
+
+class LogCache:
+	"""Compressed copies of logs.tf logs on disk, one `<log id>.json.gz` file per log.
+
+Logs never change once uploaded, so a cached log is never refetched. When the files go over `max_bytes`
+the least recently used ones are deleted. File access order is kept in the file modified times so it survives restarts.
+The directory can also be read directly as a dataset of every log the bot has seen."""
+	def __init__(self, directory: str, max_bytes: int):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._sizes: OrderedDict[int, int] = None # log id -> file size, least recently used first
+		self._total_bytes = 0
+		self._lock = asyncio.Lock()
+
+
+	@property
+	def stats(self) -> dict[str, int]:
+		return {"logs": len(self._sizes or ()), "bytes": self._total_bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+	def path(self, log_id: int) -> str:
+		return os.path.join(self.directory, f"{log_id}.json.gz")
+
+
+	def _load_index(self):
+		# runs in a thread
+		os.makedirs(self.directory, exist_ok = True)
+		files: list[tuple[float, int, int]] = list()
+		for entry in os.scandir(self.directory):
+			name = entry.name
+			if not name.endswith(".json.gz") or not name[:-len(".json.gz")].isdigit():
+				continue
+			stat = entry.stat()
+			files.append((stat.st_mtime, int(name[:-len(".json.gz")]), stat.st_size))
+		files.sort()
+		self._sizes = OrderedDict((log_id, size) for _, log_id, size in files)
+		self._total_bytes = sum(self._sizes.values())
+
+
+	async def _ensure_index(self):
+		if self._sizes is None:
+			await asyncio.to_thread(self._load_index)
+
+
+	async def log_ids(self) -> list[int]:
+		"""Every cached log id, least recently used first."""
+		async with self._lock:
+			await self._ensure_index()
+			return list(self._sizes)
+
+
+	def _read(self, log_id: int) -> bytes:
+		# runs in a thread
+		path = self.path(log_id)
+		with gzip.open(path, "rb") as file:
+			data = file.read()
+		os.utime(path) # mark as recently used
+		return data
+
+
+	def _write(self, log_id: int, data: bytes) -> int:
+		# runs in a thread, writes to a temp file first so a crash never leaves half a log behind
+		path = self.path(log_id)
+		temp_path = path + ".tmp"
+		with open(temp_path, "wb") as file:
+			file.write(gzip.compress(data, compresslevel = 6))
+		os.replace(temp_path, path)
+		return os.path.getsize(path)
+
+
+	def _delete(self, log_ids: list[int]):
+		# runs in a thread
+		for log_id in log_ids:
+			try:
+				os.remove(self.path(log_id))
+			except FileNotFoundError:
+				pass
+
+
+	async def get(self, log_id: int) -> Optional[dict]:
+		data = await self.get_raw(log_id)
+		if data is None:
+			return None
+		try:
+			return json.loads(data)
+		except ValueError:
+			return None # damaged, get_log_info downloads and overwrites it
+
+
+	async def get_raw(self, log_id: int) -> Optional[bytes]:
+		"""The log json as it was stored, for callers that decode it somewhere else (e.g. in another process)."""
+		async with self._lock:
+			await self._ensure_index()
+			if log_id not in self._sizes:
+				self.misses += 1
+				return None
+			self._sizes.move_to_end(log_id)
+		try:
+			data = await asyncio.to_thread(self._read, log_id)
+		except (OSError, EOFError):
+			# deleted or damaged file, forget it so it gets downloaded again
+			async with self._lock:
+				self._total_bytes -= self._sizes.pop(log_id, 0)
+			self.misses += 1
+			return None
+		self.hits += 1
+		return data
+
+
+	async def put(self, log_id: int, log: dict):
+		await self.put_raw(log_id, json.dumps(log, separators = (",", ":")).encode())
+
+
+	async def put_raw(self, log_id: int, data: bytes):
+		async with self._lock:
+			await self._ensure_index()
+			size = await asyncio.to_thread(self._write, log_id, data)
+			self._total_bytes += size - self._sizes.pop(log_id, 0)
+			self._sizes[log_id] = size
+
+			# evict the least recently used logs, never the one just written
+			evicted: list[int] = list()
+			while self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+				old_id, old_size = self._sizes.popitem(last = False)
+				self._total_bytes -= old_size
+				evicted.append(old_id)
+			if evicted:
+				self.evictions += len(evicted)
+				await asyncio.to_thread(self._delete, evicted)
+
+
+
+LOG_CACHE = LogCache(LOG_CACHE_DIR, LOG_CACHE_MAX_BYTES)
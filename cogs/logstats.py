@@ -0,0 +1,47 @@
+# turns a logs.tf log into one compact stats row per player
+# only uses the standard library so process pool workers start quickly
+
+import json
+from typing import Optional
+
+
+STEAM_ID64_BASE = 76561197960265728
+
+
+def player_steam_id64(player_id: str) -> Optional[int]:
+	"""Log players are keyed by "[U:1:123]", very old logs use "STEAM_0:1:123"."""
+	try:
+		if player_id.startswith("[U:1:"):
+			return STEAM_ID64_BASE + int(player_id[5:-1])
+		if player_id.startswith("STEAM_"):
+			_, y, z = player_id[6:].split(":")
+			return STEAM_ID64_BASE + int(z) * 2 + int(y)
+	except ValueError:
+		pass
+	return None
+
+
+def parse_player_stats(log_id: int, data: bytes) -> list[tuple]:
+	"""Returns a row for every player on red or blu, in the column order of `PLAYER_MATCH_TABLE_VALUES`."""
+	log: dict = json.loads(data)
+	date: int = log.get("info", dict()).get("date", 0)
+	length: int = log.get("length", 0)
+	scores = {team.lower(): info.get("score", 0) for team, info in log.get("teams", dict()).items()}
+	rows: list[tuple] = list()
+	for player_id, info in log.get("players", dict()).items():
+		team = (info.get("team") or "").lower()
+		if team not in ("red", "blue"):
+			continue
+		steam_id = player_steam_id64(player_id)
+		if steam_id is None:
+			continue
+		score_diff = scores.get(team, 0) - scores.get("blue" if team == "red" else "red", 0)
+		result = (score_diff > 0) - (score_diff < 0) # 1 win, 0 tie, -1 loss
+		class_stats: list[dict] = info.get("class_stats") or list()
+		main_class = max(class_stats, key = lambda stats: stats.get("total_time", 0)).get("type") if class_stats else None
+		rows.append((
+			log_id, steam_id, date, length, team, main_class, result,
+			info.get("kills", 0), info.get("assists", 0), info.get("deaths", 0),
+			info.get("dmg", 0), info.get("dt", 0), info.get("ubers", 0), info.get("drops", 0)
+		))
+	return rows
@@ -0,0 +1,210 @@
+import asyncio, traceback
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from logging import getLogger
+from nextcord import Member, Role, VoiceChannel, VoiceState
+from nextcord.utils import utcnow
+from typing import Iterable, Optional
+from staticvars import TF2CC
+from .static import get_level_roles
+from .TF2ccDB import get_or_new_pug_entries, get_or_new_strike_entries
+
+
+PREWARM_DELAY = 2 # seconds to wait for more joins before loading them all in one batch
+
+LOG = getLogger("debug") # the bot's log
+
+
+@dataclass
+class QueueEntry:
+	member: Member
+	channel_id: int
+	joined_at: datetime # when they got into the queue, or into a team channel
+	level_roles: Optional[list[Role]] = field(default = None, repr = False) # resolved by the prewarmer
+
+	@property
+	def pug_banned(self) -> bool:
+		return self.member.get_role(TF2CC.pug_strike3_rid) is not None
+
+	@property
+	def wait_time(self) -> timedelta:
+		return utcnow() - self.joined_at
+
+
+@dataclass(frozen = True)
+class QueueSnapshot:
+	entries: tuple[QueueEntry] # everyone that can play, next game first, then the longest waiting
+	pug_banned: tuple[Member]
+	next_game_cid: int
+
+	@property
+	def key(self) -> tuple[tuple[int, bool]]:
+		"""Changes whenever someone joins, leaves, or moves between the queue channels."""
+		return tuple((entry.member.id, entry.channel_id == self.next_game_cid) for entry in self.entries)
+
+
+class PugQueue:
+	"""Tracks who is in the waiting, next game and team voice channels of one pug type, and since when.
+
+It is kept up to date by `on_voice_state_update`, so commands can read it without scanning the channels."""
+	def __init__(self, waiting_cid: int, next_game_cid: int, team_cids: tuple[int]):
+		self.waiting_cid = waiting_cid
+		self.next_game_cid = next_game_cid
+		self.team_cids = team_cids
+		self.ready = False # set once seeded from the voice channels on ready
+		self._entries: dict[int, QueueEntry] = dict() # kept in the order people joined
+
+
+	def tracks(self, channel_id: Optional[int]) -> bool:
+		return channel_id in (self.waiting_cid, self.next_game_cid) or channel_id in self.team_cids
+
+
+	def in_queue(self, channel_id: Optional[int]) -> bool:
+		return channel_id in (self.waiting_cid, self.next_game_cid)
+
+
+	def seed(self, channels: Iterable[VoiceChannel]):
+		"""Rebuilds the queue from the tracked channels, e.g. after a reconnect.
+People already tracked in the same spot keep their join time, everyone else starts waiting now."""
+		now = utcnow()
+		entries: dict[int, QueueEntry] = dict()
+		for channel in channels:
+			if not self.tracks(channel.id):
+				continue
+			for member in channel.members:
+				entry = self._entries.get(member.id)
+				same_spot = entry is not None and (entry.channel_id == channel.id or (self.in_queue(entry.channel_id) and self.in_queue(channel.id)))
+				entries[member.id] = QueueEntry(member, channel.id, entry.joined_at if same_spot else now)
+		self._entries = dict(sorted(entries.items(), key = lambda item: item[1].joined_at))
+		self.ready = True
+
+
+	def update(self, member: Member, before: VoiceState, after: VoiceState) -> bool:
+		"""Applies a voice state change. Returns `True` if the member just got into the queue."""
+		before_cid = before.channel.id if before.channel else None
+		after_cid = after.channel.id if after.channel else None
+		if before_cid == after_cid:
+			return False # mute, deafen, etc
+
+		if not self.tracks(after_cid):
+			self._entries.pop(member.id, None)
+			return False
+
+		entry = self._entries.get(member.id)
+		if entry is not None and self.in_queue(entry.channel_id) and self.in_queue(after_cid):
+			# moving between waiting and next game keeps their place
+			entry.member = member
+			entry.channel_id = after_cid
+			return False
+
+		self._entries.pop(member.id, None)
+		self._entries[member.id] = QueueEntry(member, after_cid, utcnow())
+		return self.in_queue(after_cid)
+
+
+	def get_entry(self, discord_id: int) -> Optional[QueueEntry]:
+		return self._entries.get(discord_id)
+
+
+	def members_in(self, channel_id: int) -> list[Member]:
+		return [entry.member for entry in self._entries.values() if entry.channel_id == channel_id]
+
+
+	def snapshot(self) -> QueueSnapshot:
+		entries: list[QueueEntry] = list()
+		pug_banned: list[Member] = list()
+		for entry in self._entries.values():
+			if not self.in_queue(entry.channel_id):
+				continue
+			if entry.pug_banned:
+				pug_banned.append(entry.member)
+				continue
+			entries.append(entry)
+		# sort is stable, so both groups stay in join order
+		entries.sort(key = lambda entry: entry.channel_id != self.next_game_cid)
+		return QueueSnapshot(tuple(entries), tuple(pug_banned), self.next_game_cid)
+
+
+
+REGULAR_QUEUE = PugQueue(
+	TF2CC.reg_pug_waiting_cid,
+	TF2CC.reg_pug_next_game_cid,
+	(TF2CC.reg_pug_red1_cid, TF2CC.reg_pug_blu1_cid, TF2CC.reg_pug_red2_cid, TF2CC.reg_pug_blu2_cid)
+)
+NEWBIE_QUEUE = PugQueue(
+	TF2CC.new_pug_waiting_cid,
+	TF2CC.new_pug_next_game_cid,
+	(TF2CC.new_pug_red1_cid, TF2CC.new_pug_blu1_cid, TF2CC.new_pug_red2_cid, TF2CC.new_pug_blu2_cid)
+)
+PUG_QUEUES = (REGULAR_QUEUE, NEWBIE_QUEUE)
+
+
+class QueuePrewarmer:
+	"""Loads everything genteams needs for members that just joined a pug voice channel.
+
+Joins are collected for `delay` seconds so a wave of people joining becomes one batch of database work.
+Missing pug and strike rows are created, both entries end up in their caches and level roles are resolved."""
+	def __init__(self, delay: float = PREWARM_DELAY):
+		self.delay = delay
+		self._pending: dict[int, Member] = dict()
+		self._task: Optional[asyncio.Task] = None
+
+
+	def add(self, member: Member):
+		self._pending[member.id] = member
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._run())
+
+
+	def refresh_level_roles(self, member: Member):
+		for queue in PUG_QUEUES:
+			entry = queue.get_entry(member.id)
+			if entry is not None:
+				entry.level_roles = get_level_roles(member)
+
+
+	async def _run(self):
+		await asyncio.sleep(self.delay)
+		while self._pending:
+			batch = self._pending
+			self._pending = dict()
+			discord_ids = list(batch)
+			try:
+				await get_or_new_pug_entries(discord_ids)
+				await get_or_new_strike_entries(discord_ids)
+			except Exception as error:
+				# only a warm up, genteams loads anything missing itself, so log it and keep going with the next batch
+				LOG.error(f"could not prewarm {len(discord_ids)} queued members\n" + "".join(traceback.format_exception(type(error), error, error.__traceback__)))
+			for member in batch.values():
+				self.refresh_level_roles(member)
+
+
+PREWARMER = QueuePrewarmer()
+
+
+def get_pug_queue(newbie: bool) -> PugQueue:
+	return NEWBIE_QUEUE if newbie else REGULAR_QUEUE
+
+
+def get_channel_queue(channel_id: int) -> Optional[PugQueue]:
+	for queue in PUG_QUEUES:
+		if queue.ready and queue.tracks(channel_id):
+			return queue
+	return None
+
+
+def channel_members(channel: VoiceChannel) -> list[Member]:
+	"""Members of a tracked channel in the order they joined, or the channel's own member list before the queues are seeded."""
+	queue = get_channel_queue(channel.id)
+	return queue.members_in(channel.id) if queue else channel.members[:]
+
+
+def queue_snapshot(next_game: VoiceChannel, waiting_room: VoiceChannel) -> QueueSnapshot:
+	queue = get_channel_queue(next_game.id)
+	if queue is not None and queue.waiting_cid == waiting_room.id:
+		return queue.snapshot()
+
+	# not seeded yet, read the channels directly
+	fallback = PugQueue(waiting_room.id, next_game.id, tuple())
+	fallback.seed((next_game, waiting_room))
+	return fallback.snapshot()
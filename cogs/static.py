@@ -1,12 +1,12 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
-from nextcord import Color, Embed, Guild, Member, User
+from nextcord import Color, Embed, Member, Role, User
 from nextcord.utils import format_dt, get, utcnow
 from typing import Dict, List, Literal, Optional, Union
 from statistics import mean
 
-from classes import ADB
-from staticvars import TF2CC
+from classes import ADB, ADBIndex
+from staticvars import LOGS_API_GET_LOG, LOGS_API_GET_LOG_IDS, TF2CC
 
 #
 #
@@ -15,26 +15,36 @@ from staticvars import TF2CC
 #
 
 COMMENT_DB_NAME = "./db/comments.db"
-COMMENT_TABLE_NAME = "comments{obj_id}"
+COMMENT_TABLE_NAME = "comments"
+COMMENT_SUBJECT_ID = "subject_id" # the user the comment is about
 COMMENT_TABLE_VALUES = ("comment_id", "guild_id", "staff_id", "created_at", "comment")
-COMMENT_TABLE_VALUE_TYPES = ("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER", "TEXT")
-VALID_ROLES_TABLE_NAME = "valid_roles{obj_id}"
-VALID_ROLES_TABLE_VALUES = ("role_id",)
-VALID_ROLES_TABLE_VALUE_TYPES = ("INTEGER PRIMARY KEY",)
-
+COMMENT_TABLE_VALUE_TYPES = ("INTEGER NOT NULL", "INTEGER", "INTEGER", "INTEGER", "TEXT")
+COMMENT_DB = ADB(
+	COMMENT_DB_NAME,
+	COMMENT_TABLE_NAME,
+	(COMMENT_SUBJECT_ID,) + COMMENT_TABLE_VALUES,
+	("INTEGER NOT NULL",) + COMMENT_TABLE_VALUE_TYPES,
+	table_constraints = (f"PRIMARY KEY ({COMMENT_SUBJECT_ID}, {COMMENT_TABLE_VALUES[0]})",),
+	indexes = (
+		ADBIndex("comments_guild_idx", (COMMENT_TABLE_VALUES[1], COMMENT_SUBJECT_ID)),
+		ADBIndex("comments_staff_idx", (COMMENT_TABLE_VALUES[2],))
+	)
+)
 
-def get_table_name(obj_id: int = None, obj: Union[User, Guild] = None, *, is_comment: bool) -> str:
-	assert obj_id or obj, "get_table_name error - user_id or user must be specified"
-	return (COMMENT_TABLE_NAME if is_comment else VALID_ROLES_TABLE_NAME).format(obj_id = obj_id or obj.id)
+VALID_ROLES_TABLE_NAME = "valid_roles"
+VALID_ROLES_TABLE_VALUES = ("guild_id", "role_id")
+VALID_ROLES_DB = ADB(
+	COMMENT_DB_NAME,
+	VALID_ROLES_TABLE_NAME,
+	VALID_ROLES_TABLE_VALUES,
+	("INTEGER NOT NULL", "INTEGER NOT NULL"),
+	table_constraints = (f"PRIMARY KEY ({VALID_ROLES_TABLE_VALUES[0]}, {VALID_ROLES_TABLE_VALUES[1]})",)
+)
 
-
-def get_db(obj_id: int = None, obj: Union[User, Guild] = None, *, is_comment: bool) -> ADB:
-	return ADB(
-		COMMENT_DB_NAME,
-		get_table_name(obj_id, obj, is_comment = is_comment),
-		COMMENT_TABLE_VALUES if is_comment else VALID_ROLES_TABLE_VALUES,
-		COMMENT_TABLE_VALUE_TYPES if is_comment else VALID_ROLES_TABLE_VALUE_TYPES
-	)
+# older versions made one table per user / guild
+# these are copied into the tables above by CommentDB.migrate_legacy_tables
+LEGACY_COMMENT_TABLE_NAME = "comments{obj_id}"
+LEGACY_VALID_ROLES_TABLE_NAME = "valid_roles{obj_id}"
 
 
 @dataclass
@@ -110,8 +120,8 @@ class UserComments:
 #
 
 # ~~~ TF2CC STUFF ~~~
-LOGS_API_GET_LOG = "https://logs.tf/json/{log_id}"
-LOGS_API_GET_LOG_IDS = "https://logs.tf/api/v1/log?player={steam_ids}&limit=1"
+LOG_CACHE_DIR = "./db/logs"
+LOG_CACHE_MAX_BYTES = 512 * 1024 * 1024 # compressed logs are usually 20-60 KB
 
 TF2CC_DB_NAME = "./db/tf2cc.db"
 
@@ -121,7 +131,15 @@ STRIKE_DB = ADB(
 	TF2CC_DB_NAME,
 	STRIKE_TABLE_NAME,
 	STRIKE_TABLE_VALUES,
-	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER")
+	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER"),
+	indexes = (
+		ADBIndex("user_strikes_sweep_idx", (STRIKE_TABLE_VALUES[1], STRIKE_TABLE_VALUES[-1])),
+		ADBIndex(
+			"user_strikes_active_idx",
+			(STRIKE_TABLE_VALUES[0],),
+			where = f"{STRIKE_TABLE_VALUES[1]} > 0 OR {STRIKE_TABLE_VALUES[7]} > 0 OR {STRIKE_TABLE_VALUES[8]} > 0"
+		)
+	)
 )
 
 PUG_TABLE_NAME = "pug_info"
@@ -131,14 +149,82 @@ PUG_DB = ADB(
 	TF2CC_DB_NAME,
 	PUG_TABLE_NAME,
 	PUG_TABLE_VALUES,
-	PUG_TABLE_VALUE_TYPES
+	PUG_TABLE_VALUE_TYPES,
+	indexes = (
+		ADBIndex("pug_info_steam_id_idx", (PUG_TABLE_VALUES[6],), where = f"{PUG_TABLE_VALUES[6]} IS NOT NULL"),
+		# leaderboards only list players that have played, so the indexes only hold those players
+		ADBIndex(
+			"pug_info_regular_elo_idx",
+			(PUG_TABLE_VALUES[4],),
+			where = f"{PUG_TABLE_VALUES[1]} > 0 OR {PUG_TABLE_VALUES[2]} > 0"
+		),
+		ADBIndex(
+			"pug_info_newbie_elo_idx",
+			(PUG_TABLE_VALUES[11],),
+			where = f"{PUG_TABLE_VALUES[8]} > 0 OR {PUG_TABLE_VALUES[9]} > 0"
+		)
+	),
+	write_behind = True
 )
 
 RUNNER_DB = ADB(
 	TF2CC_DB_NAME,
 	"pug_runners",
 	("discord_id", "rpugs", "rpugs_last_ran", "npugs", "npugs_last_ran", "became_runner"),
-	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER")
+	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER"),
+	indexes = (ADBIndex("pug_runners_became_runner_idx", ("became_runner",)),),
+	write_behind = True
+)
+
+# matches waiting for their logs.tf log so elo can be applied
+MATCH_PENDING = "pending"
+MATCH_APPLIED = "applied"
+MATCH_NO_LOG = "no_log" # no log showed up in time
+MATCH_NO_PLAYERS = "no_players" # not enough players or no linked steam ids
+MATCH_FAILED = "failed" # kept raising errors until the window passed
+PENDING_MATCH_TABLE_VALUES = ("match_id", "created_at", "newbie", "red_ids", "blu_ids", "log_channel_id", "attempts", "next_attempt", "status", "log_id", "finished_at")
+PENDING_MATCH_DB = ADB(
+	TF2CC_DB_NAME,
+	"pending_matches",
+	PENDING_MATCH_TABLE_VALUES,
+	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "TEXT", "TEXT", "INTEGER", "INTEGER", "INTEGER", "TEXT", "INTEGER", "INTEGER"),
+	indexes = (ADBIndex("pending_matches_due_idx", (PENDING_MATCH_TABLE_VALUES[7],), where = f"{PENDING_MATCH_TABLE_VALUES[8]} = '{MATCH_PENDING}'"),)
+)
+
+# per player per match stats from logs.tf, kept in their own file so backfills don't hold up the bot's writes
+STATS_DB_NAME = "./db/stats.db"
+
+PLAYER_MATCH_TABLE_VALUES = ("log_id", "steam_id", "date", "length", "team", "class", "result", "kills", "assists", "deaths", "damage", "damage_taken", "ubers", "drops")
+PLAYER_MATCH_DB = ADB(
+	STATS_DB_NAME,
+	"player_matches",
+	PLAYER_MATCH_TABLE_VALUES,
+	("INTEGER", "INTEGER", "INTEGER", "INTEGER", "TEXT", "TEXT", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER"),
+	table_constraints = (f"PRIMARY KEY ({PLAYER_MATCH_TABLE_VALUES[0]}, {PLAYER_MATCH_TABLE_VALUES[1]})",),
+	indexes = (ADBIndex("player_matches_steam_id_date_idx", (PLAYER_MATCH_TABLE_VALUES[1], PLAYER_MATCH_TABLE_VALUES[2])),)
+)
+
+# running totals and averages per member and pug mode, updated once per applied match
+STATS_EWMA_ALPHA = 0.2 # weight of the newest match in the avg_ columns, older matches fade out
+PLAYER_STATS_TABLE_VALUES = (
+	"discord_id", "newbie", "matches", "seconds", "kills", "assists", "deaths", "damage", "damage_taken", "ubers", "drops",
+	"avg_dpm", "avg_dtm", "avg_kad", "avg_ubers", "avg_drops", "updated_at"
+)
+PLAYER_STATS_DB = ADB(
+	STATS_DB_NAME,
+	"player_stats",
+	PLAYER_STATS_TABLE_VALUES,
+	("INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "INTEGER", "REAL", "REAL", "REAL", "REAL", "REAL", "INTEGER"),
+	table_constraints = (f"PRIMARY KEY ({PLAYER_STATS_TABLE_VALUES[0]}, {PLAYER_STATS_TABLE_VALUES[1]})",)
+)
+
+# how far the backfill got through each player's logs.tf history, log_offset counts logs from the newest
+BACKFILL_TABLE_VALUES = ("steam_id", "log_offset", "done", "updated_at")
+BACKFILL_DB = ADB(
+	STATS_DB_NAME,
+	"backfill_progress",
+	BACKFILL_TABLE_VALUES,
+	("INTEGER PRIMARY KEY", "INTEGER", "INTEGER", "INTEGER")
 )
 
 
@@ -259,6 +345,71 @@ class PugEntry:
 			return ""
 
 
+class PendingMatchEntry:
+	def __init__(self, info: dict[str, Union[int, str]]):
+		self.match_id: int = info[PENDING_MATCH_TABLE_VALUES[0]]
+		self.created_at: int = info[PENDING_MATCH_TABLE_VALUES[1]]
+		self.newbie = bool(info[PENDING_MATCH_TABLE_VALUES[2]])
+		self.red_ids = [int(discord_id) for discord_id in info[PENDING_MATCH_TABLE_VALUES[3]].split(",") if discord_id] # stored like class_bans, comma separated
+		self.blu_ids = [int(discord_id) for discord_id in info[PENDING_MATCH_TABLE_VALUES[4]].split(",") if discord_id]
+		self.log_channel_id: Optional[int] = info[PENDING_MATCH_TABLE_VALUES[5]]
+		self.attempts: int = info[PENDING_MATCH_TABLE_VALUES[6]]
+		self.next_attempt: int = info[PENDING_MATCH_TABLE_VALUES[7]]
+		self.status: str = info[PENDING_MATCH_TABLE_VALUES[8]]
+		self.log_id: Optional[int] = info[PENDING_MATCH_TABLE_VALUES[9]]
+		self.finished_at: Optional[int] = info[PENDING_MATCH_TABLE_VALUES[10]]
+
+	@property
+	def created_datetime(self) -> datetime:
+		return datetime.fromtimestamp(self.created_at, tz = timezone.utc)
+
+
+class PlayerStatsEntry:
+	def __init__(self, info: dict[str, Union[int, float]]):
+		self.discord_id: int = info[PLAYER_STATS_TABLE_VALUES[0]]
+		self.newbie = bool(info[PLAYER_STATS_TABLE_VALUES[1]])
+		self.matches: int = info[PLAYER_STATS_TABLE_VALUES[2]]
+		self.seconds: int = info[PLAYER_STATS_TABLE_VALUES[3]]
+		self.kills: int = info[PLAYER_STATS_TABLE_VALUES[4]]
+		self.assists: int = info[PLAYER_STATS_TABLE_VALUES[5]]
+		self.deaths: int = info[PLAYER_STATS_TABLE_VALUES[6]]
+		self.damage: int = info[PLAYER_STATS_TABLE_VALUES[7]]
+		self.damage_taken: int = info[PLAYER_STATS_TABLE_VALUES[8]]
+		self.ubers: int = info[PLAYER_STATS_TABLE_VALUES[9]]
+		self.drops: int = info[PLAYER_STATS_TABLE_VALUES[10]]
+		self.avg_dpm: float = info[PLAYER_STATS_TABLE_VALUES[11]]
+		self.avg_dtm: float = info[PLAYER_STATS_TABLE_VALUES[12]]
+		self.avg_kad: float = info[PLAYER_STATS_TABLE_VALUES[13]]
+		self.avg_ubers: float = info[PLAYER_STATS_TABLE_VALUES[14]]
+		self.avg_drops: float = info[PLAYER_STATS_TABLE_VALUES[15]]
+		self.updated_at: int = info[PLAYER_STATS_TABLE_VALUES[16]]
+
+	# career numbers, worked out from the totals
+	@property
+	def dpm(self) -> float:
+		return self.damage / (self.seconds / 60.0) if self.seconds else 0.0
+
+	@property
+	def dtm(self) -> float:
+		return self.damage_taken / (self.seconds / 60.0) if self.seconds else 0.0
+
+	@property
+	def kad(self) -> float:
+		return (self.kills + self.assists) / max(self.deaths, 1)
+
+	@property
+	def updated_datetime(self) -> datetime:
+		return datetime.fromtimestamp(self.updated_at, tz = timezone.utc)
+
+
+class BackfillEntry:
+	def __init__(self, info: dict[str, int]):
+		self.steam_id: int = info[BACKFILL_TABLE_VALUES[0]]
+		self.log_offset: int = info[BACKFILL_TABLE_VALUES[1]]
+		self.done = bool(info[BACKFILL_TABLE_VALUES[2]])
+		self.updated_at: int = info[BACKFILL_TABLE_VALUES[3]]
+
+
 class RunnerEntry:
 	def __init__(self, info: dict[str, int]):
 		self.discord_id = info[RUNNER_DB.table_column_names[0]]
@@ -281,15 +432,21 @@ class RunnerEntry:
 		return datetime.fromtimestamp(self.became_runner, tz = timezone.utc)
 
 
+def get_level_roles(member: Member) -> list[Role]:
+	return [role for role in member.roles if role.name.startswith("Level ")]
+
+
 @dataclass()
 class Pugger:
 	member: Member = field(repr = True, compare = True, kw_only = False)
 	priority: bool = field(default = False, repr = True, compare = False, kw_only = True)
 	pug_info: PugEntry = field(default_factory = PugEntry, repr = False, compare = True, kw_only = True)
 	newbie: bool = field(default = False, repr = False, compare = False, kw_only = True)
+	level_roles: list[Role] = field(default = None, repr = False, compare = False, kw_only = True)
 
 	def __post_init__(self):
-		self.level_roles = [role for role in self.member.roles if role.name.startswith("Level ")]
+		if self.level_roles is None:
+			self.level_roles = get_level_roles(self.member)
 
 	def __str__(self):
 		name = f"[{self.str_level}] {self.member.mention}"
@@ -359,14 +516,29 @@ class Pugger:
 	def medlocked(self) -> bool:
 		return self.pug_info.medlocked
 
+	@property
+	def playable_classes(self) -> frozenset[str]:
+		if self.medlocked:
+			return frozenset(("7",))
+		return frozenset(TF2CC.class_numbers).difference(self.pug_info.class_bans)
+
 
 class Player:
+	# only the numbers we use are copied out of the log, so the log itself can be freed after parsing
+	__slots__ = ("member", "pug_info", "_steam_id", "newbie", "kills", "assists", "deaths", "damage", "damage_taken", "ubers", "drops")
+
 	def __init__(self, player_id32: int, player_info: Dict[str, Union[str, int, Dict, List[Dict]]], newbie: bool):
 		self.member: Member = None
 		self.pug_info: PugEntry = None
 		self._steam_id = 76561197960265728 + player_id32
-		self._player_info = player_info
 		self.newbie = newbie
+		self.kills: int = player_info.get("kills", 0)
+		self.assists: int = player_info.get("assists", 0)
+		self.deaths: int = player_info.get("deaths", 0)
+		self.damage: int = player_info.get("dmg", 0)
+		self.damage_taken: int = player_info.get("dt", 0)
+		self.ubers: int = player_info.get("ubers", 0)
+		self.drops: int = player_info.get("drops", 0)
 
 	def __str__(self):
 		return f"{self.steam_id} | {self.kills}/{self.assists}/{self.deaths} | {self.damage} / {self.damage_taken}"
@@ -375,34 +547,6 @@ class Player:
 	def steam_id(self):
 		return self._steam_id
 
-	@property
-	def kills(self) -> int:
-		return self._player_info.get("kills", 0)
-
-	@property
-	def assists(self) -> int:
-		return self._player_info.get("assists", 0)
-
-	@property
-	def deaths(self) -> int:
-		return self._player_info.get("deaths", 0)
-
-	@property
-	def damage(self) -> int:
-		return self._player_info.get("dmg", 0)
-
-	@property
-	def damage_taken(self) -> int:
-		return self._player_info.get("dt", 0)
-
-	@property
-	def ubers(self) -> int:
-		return self._player_info.get("ubers", 0)
-
-	@property
-	def drops(self) -> int:
-		return self._player_info.get("drops", 0)
-
 	@property
 	def elo(self):
 		if self.pug_info:
@@ -447,39 +591,22 @@ class Player:
 
 
 class Team:
+	__slots__ = ("_name", "caps", "charges", "damage", "first_caps", "kills", "score", "_players")
+
 	def __init__(self, team_name: str, team_info: Dict[str, int]):
 		self._name = team_name.lower()
-		self._team_info = team_info
+		self.caps: int = team_info.get("caps", 0)
+		self.charges: int = team_info.get("charges", 0)
+		self.damage: int = team_info.get("dmg", 0)
+		self.first_caps: int = team_info.get("firstcaps", 0)
+		self.kills: int = team_info.get("kills", 0)
+		self.score: int = team_info.get("score", 0)
 		self._players: List[Player] = []
 
 	@property
 	def name(self):
 		return self._name
 
-	@property
-	def caps(self):
-		return self._team_info.get("caps", 0)
-
-	@property
-	def charges(self):
-		return self._team_info.get("charges", 0)
-
-	@property
-	def damage(self):
-		return self._team_info.get("dmg", 0)
-
-	@property
-	def first_caps(self):
-		return self._team_info.get("firstcaps", 0)
-
-	@property
-	def kills(self):
-		return self._team_info.get("kills", 0)
-
-	@property
-	def score(self):
-		return self._team_info.get("score", 0)
-
 	@property
 	def avg_elo(self) -> float:
 		return mean([player.elo for player in self.players])
@@ -608,7 +735,8 @@ SUPPORT2_DB = ADB(
 	TF2CC_DB_NAME,
 	SUPPORT2_TABLE_NAME,
 	SUPPORT2_TABLE_VALUES,
-	SUPPORT2_TABLE_VALUE_TYPES
+	SUPPORT2_TABLE_VALUE_TYPES,
+	indexes = (ADBIndex("support2_channel_id_idx", (SUPPORT2_TABLE_VALUES[1],)),)
 )
 
 TICKET_EMBED = Embed(
@@ -0,0 +1,280 @@
+from heapq import heappop, heappush, heappushpop
+from itertools import combinations
+from random import random, sample
+from statistics import median
+from time import perf_counter
+from typing import Optional, Sequence
+
+# the team balancer works on plain lists so it can be used without any discord objects
+# players are referred to by their index in the lists passed in
+
+BALANCE_TIME_BUDGET = 0.05 # seconds
+MAX_EXACT_TEAM_SIZE = 9 # bigger teams are balanced with a local search instead of checking every split
+CONSTRAINT_PENALTY = 100000 # added per level/med lock rule broken, so any split that follows them wins
+ANY_CLASS = "0" # a class slot any player that can play something other than medic can fill
+MEDIC = "7"
+
+
+def default_class_slots(team_size: int) -> tuple[str]:
+	# one medic and anything else, so each team can take at most one med locked player
+	return (MEDIC,) + (ANY_CLASS,) * (team_size - 1)
+
+
+def can_fill(playable_classes: frozenset[str], slot: str) -> bool:
+	if slot == ANY_CLASS:
+		return bool(playable_classes - {MEDIC})
+	return slot in playable_classes
+
+
+def match_class_slots(playable_classes: Sequence[frozenset[str]], slots: Sequence[str]) -> list[Optional[int]]:
+	"""Assigns players to class slots so as many slots as possible are filled (Kuhn's augmenting paths).
+
+Returns the index of the player in each slot, or `None` if no player is left that can fill it."""
+	slot_players: list[Optional[int]] = [None] * len(slots)
+	player_slots: list[Optional[int]] = [None] * len(playable_classes)
+	fillable = [[slot for slot, slot_class in enumerate(slots) if can_fill(classes, slot_class)] for classes in playable_classes]
+
+	def augment(player: int, seen: set[int]) -> bool:
+		for slot in fillable[player]:
+			if slot in seen:
+				continue
+			seen.add(slot)
+			if slot_players[slot] is None or augment(slot_players[slot], seen):
+				slot_players[slot] = player
+				player_slots[player] = slot
+				return True
+		return False
+
+	# players that can fill the fewest slots go first so flexible players are left for the rest
+	for player in sorted(range(len(playable_classes)), key = lambda player: len(fillable[player])):
+		augment(player, set())
+	return slot_players
+
+
+def fills_class_slots(playable_classes: Sequence[frozenset[str]], slots: Sequence[str]) -> bool:
+	return None not in match_class_slots(playable_classes, slots)
+
+
+def fix_class_slots(
+	team1: list[int], team2: list[int], playable_classes: Sequence[frozenset[str]], slots: Sequence[str], elos: Sequence[int]
+) -> tuple[list[int], list[int]]:
+	"""Swaps players between the teams, closest elo first, until both teams can fill every class slot or no swap helps."""
+	def unfilled(team: list[int]) -> int:
+		return match_class_slots([playable_classes[i] for i in team], slots).count(None)
+
+	team1, team2 = list(team1), list(team2)
+	broken = unfilled(team1) + unfilled(team2)
+	while broken:
+		swaps = sorted((abs(elos[i] - elos[j]), pos1, pos2) for pos1, i in enumerate(team1) for pos2, j in enumerate(team2))
+		for _, pos1, pos2 in swaps:
+			team1[pos1], team2[pos2] = team2[pos2], team1[pos1]
+			swapped_broken = unfilled(team1) + unfilled(team2)
+			if swapped_broken < broken:
+				broken = swapped_broken
+				break
+			team1[pos1], team2[pos2] = team2[pos2], team1[pos1]
+		else:
+			break # nothing helps, keep what we have
+	return team1, team2
+
+
+class TeamBalancer:
+	"""Splits players into two equal teams, keeping the mean and median elo of both teams as close as possible.
+
+Players of the same level and med locked players are spread over the teams as evenly as possible.
+If `playable_classes` is given, both teams must also be able to fill every slot in `class_slots`."""
+	def __init__(
+		self, elos: Sequence[int], levels: Sequence[int], medlocked: Sequence[bool],
+		*, playable_classes: Sequence[frozenset[str]] = None, class_slots: Sequence[str] = None, time_budget: float = BALANCE_TIME_BUDGET
+	):
+		assert len(elos) == len(levels) == len(medlocked), "TeamBalancer error - elos, levels and medlocked must be the same length"
+		assert len(elos) % 2 == 0, "TeamBalancer error - there must be an even amount of players"
+		self.elos = list(elos)
+		self.levels = list(levels)
+		self.medlocked = list(medlocked)
+		self.team_size = len(elos) // 2
+		self.total_elo = sum(elos)
+		self.time_budget = time_budget
+		self.level_counts = {level: self.levels.count(level) for level in set(self.levels)}
+		self.medlocked_count = sum(self.medlocked)
+		self.playable_classes = list(playable_classes) if playable_classes is not None else None
+		self.class_slots = tuple(class_slots) if class_slots and len(class_slots) == self.team_size else default_class_slots(self.team_size)
+		self._fills_cache: dict[frozenset[int], bool] = dict()
+
+
+	def mean_diff(self, team1: Sequence[int]) -> float:
+		team1_elo = sum(self.elos[i] for i in team1)
+		return abs(2 * team1_elo - self.total_elo) / self.team_size
+
+
+	def constraint_penalty(self, team1: Sequence[int]) -> int:
+		# a level or the med locked players are split evenly if both teams have the same amount, or one more for odd amounts
+		broken = 0
+		for level, count in self.level_counts.items():
+			team1_count = sum(1 for i in team1 if self.levels[i] == level)
+			broken += max(0, abs(2 * team1_count - count) - 1)
+		team1_medlocked = sum(1 for i in team1 if self.medlocked[i])
+		broken += max(0, abs(2 * team1_medlocked - self.medlocked_count) - 1)
+		return broken * CONSTRAINT_PENALTY + self.class_slot_penalty(team1)
+
+
+	def fills_class_slots(self, team: Sequence[int]) -> bool:
+		if self.playable_classes is None:
+			return True
+		key = frozenset(team)
+		fills = self._fills_cache.get(key)
+		if fills is None:
+			fills = self._fills_cache[key] = fills_class_slots([self.playable_classes[i] for i in team], self.class_slots)
+		return fills
+
+
+	def class_slot_penalty(self, team1: Sequence[int]) -> int:
+		if self.playable_classes is None:
+			return 0
+		team1_set = set(team1)
+		team2 = [i for i in range(len(self.elos)) if i not in team1_set]
+		return ((not self.fills_class_slots(team1)) + (not self.fills_class_slots(team2))) * CONSTRAINT_PENALTY
+
+
+	def cost(self, team1: Sequence[int]) -> float:
+		"""The mean elo difference plus the median elo difference, plus a penalty for every level/med lock rule broken."""
+		team1_set = set(team1)
+		team2 = [i for i in range(len(self.elos)) if i not in team1_set]
+		median_diff = abs(median(self.elos[i] for i in team1) - median(self.elos[i] for i in team2))
+		return self.mean_diff(team1) + median_diff + self.constraint_penalty(team1)
+
+
+	def split(self) -> tuple[list[int], list[int]]:
+		"""Returns the indexes of the players on each team. Stops searching once the time budget is used up."""
+		return self.best_splits(1)[0]
+
+
+	def best_splits(self, count: int) -> list[tuple[list[int], list[int]]]:
+		"""Returns up to `count` different splits, best first. Stops searching once the time budget is used up.
+
+Splits that break more level/med lock rules than the best split are left out."""
+		deadline = perf_counter() + self.time_budget
+		starts = [self._local_search(self._snake_draft(), deadline)]
+		if self.team_size <= MAX_EXACT_TEAM_SIZE:
+			team1s = self._exhaustive_search(starts, count, deadline)
+		else:
+			# too many splits to check them all, so search again from random starting teams
+			while len(starts) < count * 2 and perf_counter() < deadline:
+				starts.append(self._local_search(sample(range(len(self.elos)), self.team_size), deadline))
+			team1s = self._rank(starts, count)
+		# never offer a split that breaks more level/med lock rules than the best one
+		least_broken = self.constraint_penalty(team1s[0])
+		team1s = [team1 for team1 in team1s if self.constraint_penalty(team1) == least_broken]
+		return [(sorted(team1), [i for i in range(len(self.elos)) if i not in set(team1)]) for team1 in team1s]
+
+
+	def _key(self, team1: Sequence[int], anchor: int = 0) -> frozenset[int]:
+		# the same split with the teams swapped has the same key, the team with `anchor` on it
+		team1_set = frozenset(team1)
+		return team1_set if anchor in team1_set else frozenset(range(len(self.elos))) - team1_set
+
+
+	def _rank(self, team1s: list[list[int]], count: int) -> list[list[int]]:
+		unique = {self._key(team1): team1 for team1 in team1s}
+		return sorted(unique.values(), key = self.cost)[:count]
+
+
+	def _snake_draft(self) -> list[int]:
+		# ABBA picks down the elo ladder, a good starting point for both searches
+		order = sorted(range(len(self.elos)), key = lambda i: self.elos[i], reverse = True)
+		return [i for pick, i in enumerate(order) if pick % 4 in (0, 3)]
+
+
+	def _local_search(self, team1: list[int], deadline: float) -> list[int]:
+		# swap one player from each team while it keeps getting better
+		team1 = list(team1)
+		best_cost = self.cost(team1)
+		improved = True
+		while improved and perf_counter() < deadline:
+			improved = False
+			team1_set = set(team1)
+			team2 = [i for i in range(len(self.elos)) if i not in team1_set]
+			for pos, i in enumerate(team1):
+				for j in team2:
+					candidate = team1[:pos] + [j] + team1[pos + 1:]
+					candidate_cost = self.cost(candidate)
+					if candidate_cost < best_cost:
+						team1, best_cost, improved = candidate, candidate_cost, True
+						break
+				if improved or perf_counter() >= deadline:
+					break
+		return team1
+
+
+	def _exhaustive_search(self, starts: list[list[int]], count: int, deadline: float) -> list[list[int]]:
+		# player 0 is always on team 1, so every split is only checked once
+		# players are walked from highest to lowest elo so the middle of each team can be read off directly,
+		# and each split is thrown out as soon as its mean difference or broken rules cost more than the worst kept split
+		player_count = len(self.elos)
+		order = sorted(range(player_count), key = lambda i: self.elos[i], reverse = True)
+		elos = [self.elos[i] for i in order]
+		bits = [1 << pos for pos in range(player_count)]
+		level_masks = [
+			(sum(bits[pos] for pos in range(player_count) if self.levels[order[pos]] == level), count)
+			for level, count in self.level_counts.items()
+		]
+		medlocked_mask = sum(bits[pos] for pos in range(player_count) if self.medlocked[order[pos]])
+		level_masks.append((medlocked_mask, self.medlocked_count))
+
+		team_size = self.team_size
+		total_elo = self.total_elo
+		mid = team_size // 2
+		even = not team_size % 2
+		check_slots = self.playable_classes is not None
+		# max heap of the best splits found, as (-cost, random tie breaker, team in sorted positions)
+		# the random tie breaker picks evenly between equally good splits so rerolling can give different teams
+		kept: list[tuple[float, float, tuple[int]]] = list()
+		position = {player: pos for pos, player in enumerate(order)}
+		start_keys = set()
+		for start in starts:
+			key = self._key(start, order[0])
+			if key in start_keys:
+				continue
+			start_keys.add(key)
+			heappush(kept, (-self.cost(start), random(), tuple(sorted(position[player] for player in key))))
+		while len(kept) > count:
+			heappop(kept) # drop the worst
+		worst_cost = -kept[0][0] if len(kept) == count else float("inf")
+
+		for checked, rest in enumerate(combinations(range(1, player_count), team_size - 1)):
+			if not checked % 512 and perf_counter() >= deadline:
+				break
+			cost = abs(2 * (elos[0] + sum(map(elos.__getitem__, rest))) - total_elo) / team_size
+			if cost > worst_cost:
+				continue
+
+			mask = 1 + sum(map(bits.__getitem__, rest))
+			for level_mask, level_count in level_masks:
+				cost += max(0, abs(2 * (mask & level_mask).bit_count() - level_count) - 1) * CONSTRAINT_PENALTY
+			if cost > worst_cost:
+				continue
+
+			team1 = (0,) + rest
+			team2 = [pos for pos in range(player_count) if not mask & bits[pos]]
+			if even:
+				cost += abs(elos[team1[mid - 1]] + elos[team1[mid]] - elos[team2[mid - 1]] - elos[team2[mid]]) / 2
+			else:
+				cost += abs(elos[team1[mid]] - elos[team2[mid]])
+			if cost > worst_cost:
+				continue
+			if check_slots:
+				cost += ((not self.fills_class_slots([order[pos] for pos in team1])) + (not self.fills_class_slots([order[pos] for pos in team2]))) * CONSTRAINT_PENALTY
+				if cost > worst_cost:
+					continue
+
+			if frozenset(order[pos] for pos in team1) in start_keys:
+				continue # already kept from the local search
+			if len(kept) < count:
+				heappush(kept, (-cost, random(), team1))
+			else:
+				heappushpop(kept, (-cost, random(), team1))
+			if len(kept) == count:
+				worst_cost = -kept[0][0]
+
+		kept.sort(key = lambda item: (-item[0], item[1]))
+		return [[order[pos] for pos in team1] for _, _, team1 in kept]
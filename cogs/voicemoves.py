@@ -0,0 +1,83 @@
+import asyncio, aiohttp
+from dataclasses import dataclass, field
+from nextcord import Member, VoiceChannel, DiscordServerError, HTTPException
+from time import perf_counter
+from typing import Iterable, Optional, Union
+
+
+MOVE_CONCURRENCY = 6 # moves in flight at once, across every command
+MOVE_RETRIES = 3
+MOVE_RETRY_DELAY = 0.5 # seconds, doubled after every retry
+
+# shared so two commands moving people at once still stay under the limit
+MOVE_SEMAPHORE = asyncio.Semaphore(MOVE_CONCURRENCY)
+
+
+@dataclass
+class MovePhase:
+	name: str
+	members: list[Member]
+	channel: VoiceChannel
+	reason: Optional[str] = None
+	moved: int = 0
+	failed: list[Member] = field(default_factory = list)
+	seconds: float = 0.0
+
+	def __str__(self):
+		failed = f", {len(self.failed)} failed" if self.failed else ""
+		return f"{self.name}: moved {self.moved}/{len(self.members)} to {self.channel.mention} in {self.seconds:.1f}s{failed}"
+
+
+def is_transient(error: Union[HTTPException, asyncio.TimeoutError, aiohttp.ClientError]) -> bool:
+	"""Errors worth retrying. Anything else, like a member that left voice, will fail again the same way."""
+	if isinstance(error, DiscordServerError):
+		return True
+	if isinstance(error, HTTPException):
+		return error.status == 429
+	return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+
+
+class MoveScheduler:
+	"""Runs voice moves for several phases at once.
+
+Moves are bounded by `MOVE_SEMAPHORE`, and nextcord queues every member edit of a guild behind the same rate limit bucket,
+so this never sends more than Discord allows. Transient errors are retried with backoff and each phase is timed."""
+	def __init__(self, *, retries: int = MOVE_RETRIES, retry_delay: float = MOVE_RETRY_DELAY):
+		self.retries = retries
+		self.retry_delay = retry_delay
+		self.phases: list[MovePhase] = list()
+
+
+	def add(self, name: str, members: Iterable[Member], channel: VoiceChannel, reason: str = None) -> MovePhase:
+		phase = MovePhase(name, list(members), channel, reason)
+		self.phases.append(phase)
+		return phase
+
+
+	async def run(self) -> list[MovePhase]:
+		await asyncio.gather(*[self._run_phase(phase) for phase in self.phases])
+		return self.phases
+
+
+	async def _run_phase(self, phase: MovePhase):
+		start = perf_counter()
+		results = await asyncio.gather(*[self._move(member, phase.channel, phase.reason) for member in phase.members])
+		for member, moved in zip(phase.members, results):
+			if moved:
+				phase.moved += 1
+			else:
+				phase.failed.append(member)
+		phase.seconds = perf_counter() - start
+
+
+	async def _move(self, member: Member, channel: VoiceChannel, reason: Optional[str]) -> bool:
+		for attempt in range(self.retries + 1):
+			try:
+				async with MOVE_SEMAPHORE:
+					await member.move_to(channel, reason = reason)
+				return True
+			except (HTTPException, asyncio.TimeoutError, aiohttp.ClientError) as error: # anything else is a bug and should raise
+				if not is_transient(error) or attempt == self.retries:
+					return False
+			await asyncio.sleep(self.retry_delay * 2 ** attempt)
+		return False
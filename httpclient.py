@@ -0,0 +1,283 @@
+import asyncio
+from aiohttp import ClientConnectionError, ClientError, ClientResponse, ClientSession, ClientTimeout, TCPConnector
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from random import random
+from time import monotonic, time
+from typing import Any, Awaitable, Callable, Optional
+from yarl import URL
+
+
+# requests per second and burst size for each host, anything else gets DEFAULT_RATE_LIMIT
+HOST_RATE_LIMITS: dict[str, tuple[float, int]] = {
+	"logs.tf": (4, 8),
+	"na.serveme.tf": (2, 4)
+}
+DEFAULT_RATE_LIMIT = (5, 10)
+
+
+class CircuitOpenError(ClientError):
+	"""Raised without making a request while a host keeps failing."""
+
+
+class TokenBucket:
+	"""Lets `rate` requests through per second, with bursts of up to `burst` requests."""
+	def __init__(self, rate: float, burst: int):
+		self.rate = rate
+		self.burst = burst
+		self._tokens = float(burst)
+		self._updated = monotonic()
+		self._paused_until = 0.0
+		self._lock = asyncio.Lock()
+
+
+	def pause(self, seconds: float):
+		"""Stops every request for a while, e.g. when the host sent a Retry-After."""
+		self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+
+	async def acquire(self):
+		async with self._lock: # first come first served
+			while True:
+				now = monotonic()
+				if now < self._paused_until:
+					await asyncio.sleep(self._paused_until - now)
+					continue
+				self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+				self._updated = now
+				if self._tokens >= 1:
+					self._tokens -= 1
+					return
+				await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+	"""Opens after `failure_threshold` failures in a row. While open every request fails right away,
+after `reset_timeout` seconds one request is let through to test the host and its result closes or reopens the circuit.
+If that test request never reports back, another one is let through after `reset_timeout` more seconds."""
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half_open"
+
+	def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, on_change: Callable[[str], None] = None):
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.on_change = on_change
+		self.state = self.CLOSED
+		self._failures = 0
+		self._opened_at = 0.0
+		self._probe_deadline = 0.0
+
+
+	def _set_state(self, state: str):
+		if state != self.state:
+			self.state = state
+			if self.on_change:
+				self.on_change(state)
+
+
+	def check(self):
+		if self.state == self.CLOSED:
+			return
+		now = monotonic()
+		if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+			self._set_state(self.HALF_OPEN)
+			self._probe_deadline = now + self.reset_timeout
+			return # this request is the test
+		if self.state == self.HALF_OPEN and now >= self._probe_deadline:
+			self._probe_deadline = now + self.reset_timeout
+			return # the last test was lost, this request is the new one
+		raise CircuitOpenError(f"circuit is {self.state}, not sending the request")
+
+
+	def record_success(self):
+		self._failures = 0
+		self._set_state(self.CLOSED)
+
+
+	def record_failure(self):
+		self._failures += 1
+		if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+			self._opened_at = monotonic()
+			self._set_state(self.OPEN)
+
+
+class HostState:
+	def __init__(self, host: str, bucket: TokenBucket, breaker: CircuitBreaker):
+		self.host = host
+		self.bucket = bucket
+		self.breaker = breaker
+		self.counters: Counter[str] = Counter()
+
+
+def retry_after_seconds(response: ClientResponse) -> Optional[float]:
+	"""Reads the Retry-After header, which is either a number of seconds or a date."""
+	value = response.headers.get("Retry-After")
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+	except (TypeError, ValueError):
+		return None
+
+
+async def read_json(response: ClientResponse) -> Any:
+	return None if response.status == 204 else await response.json()
+
+
+class HTTPClient:
+	"""One shared aiohttp session for every outbound request (logs.tf, serveme, etc).
+
+Connections are pooled per host and kept alive, and DNS lookups are cached, so repeated calls to the same site skip the
+DNS, TCP and TLS setup. The session is made on first use because it has to be created inside the running event loop.
+
+Every host gets a token bucket and a circuit breaker. 429s are retried after their Retry-After for any request since the host
+did not handle it, server errors and dropped connections are only retried for idempotent requests. Retries back off exponentially with jitter.
+`stats` has the counters for each host."""
+	def __init__(
+		self,
+		*,
+		limit: int = 100,
+		limit_per_host: int = 10,
+		dns_cache_ttl: int = 300,
+		keepalive_timeout: float = 30,
+		timeout: ClientTimeout = ClientTimeout(total = 30, connect = 10, sock_read = 20),
+		retries: int = 3,
+		retry_base_delay: float = 0.5,
+		retry_max_delay: float = 30,
+		failure_threshold: int = 5,
+		reset_timeout: float = 30,
+		log: Logger = None
+	):
+		self.limit = limit
+		self.limit_per_host = limit_per_host
+		self.dns_cache_ttl = dns_cache_ttl
+		self.keepalive_timeout = keepalive_timeout
+		self.timeout = timeout
+		self.retries = retries
+		self.retry_base_delay = retry_base_delay
+		self.retry_max_delay = retry_max_delay
+		self.failure_threshold = failure_threshold
+		self.reset_timeout = reset_timeout
+		self.log = log
+		self._session: Optional[ClientSession] = None
+		self._hosts: dict[str, HostState] = dict()
+
+
+	@property
+	def session(self) -> ClientSession:
+		if self._session is None or self._session.closed:
+			connector = TCPConnector(
+				limit = self.limit,
+				limit_per_host = self.limit_per_host,
+				ttl_dns_cache = self.dns_cache_ttl,
+				keepalive_timeout = self.keepalive_timeout
+			)
+			self._session = ClientSession(connector = connector, timeout = self.timeout)
+		return self._session
+
+
+	@property
+	def stats(self) -> dict[str, dict[str, int | str]]:
+		return {host: {**state.counters, "circuit": state.breaker.state} for host, state in self._hosts.items()}
+
+
+	def _host_state(self, host: str) -> HostState:
+		state = self._hosts.get(host)
+		if state is None:
+			def on_change(circuit: str):
+				state.counters[f"circuit_{circuit}"] += 1
+				if self.log:
+					self.log.warning(f"http circuit for {host} is now {circuit}")
+			rate, burst = HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+			state = HostState(host, TokenBucket(rate, burst), CircuitBreaker(self.failure_threshold, self.reset_timeout, on_change))
+			self._hosts[host] = state
+		return state
+
+
+	def _backoff(self, attempt: int) -> float:
+		# full jitter, so clients that failed together don't retry together
+		return random() * min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+
+
+	async def _request(self, method: str, url: str, read: Callable[[ClientResponse], Awaitable[Any]], *, idempotent: bool, **kwargs) -> tuple[int, Any]:
+		state = self._host_state(URL(url).host)
+		for attempt in range(self.retries + 1):
+			last_try = attempt == self.retries
+			try:
+				state.breaker.check()
+			except CircuitOpenError:
+				state.counters["rejected"] += 1
+				raise
+			await state.bucket.acquire()
+			state.counters["requests"] += 1
+			# every request reports to the breaker, otherwise a lost test request would leave it half open for good
+			succeeded = cancelled = False
+			try:
+				async with self.session.request(method, url, **kwargs) as response:
+					if response.status == 429:
+						state.counters["rate_limited"] += 1
+						delay = retry_after_seconds(response)
+						delay = self._backoff(attempt) if delay is None else delay
+						state.bucket.pause(delay)
+						if not last_try:
+							state.counters["retries"] += 1
+							continue # the bucket waits out the pause
+					elif response.status >= 500:
+						state.counters["server_errors"] += 1
+						if idempotent and not last_try:
+							state.counters["retries"] += 1
+							await asyncio.sleep(self._backoff(attempt))
+							continue
+					else:
+						succeeded = True
+					response.raise_for_status()
+					return response.status, await read(response)
+			except (ClientConnectionError, asyncio.TimeoutError):
+				state.counters["connection_errors"] += 1
+				if not idempotent or last_try:
+					raise
+				state.counters["retries"] += 1
+				await asyncio.sleep(self._backoff(attempt))
+			except asyncio.CancelledError:
+				cancelled = True
+				raise
+			finally:
+				if succeeded:
+					state.breaker.record_success()
+				elif not cancelled or state.breaker.state == CircuitBreaker.HALF_OPEN:
+					# a cancelled request says nothing about the host, unless it was the test request
+					state.breaker.record_failure()
+
+
+	async def get_json(self, url: str, **kwargs) -> Any:
+		_, data = await self._request("GET", url, read_json, idempotent = True, **kwargs)
+		return data
+
+
+	async def get_bytes(self, url: str, **kwargs) -> bytes:
+		"""The raw body, for callers that store it or decode it somewhere else."""
+		_, data = await self._request("GET", url, lambda response: response.read(), idempotent = True, **kwargs)
+		return data
+
+
+	async def post_json(self, url: str, json: Any, *, idempotent: bool = False, **kwargs) -> Any:
+		"""`idempotent` should only be set for posts that don't change anything, e.g. searches."""
+		_, data = await self._request("POST", url, read_json, idempotent = idempotent, json = json, **kwargs)
+		return data
+
+
+	async def delete_json(self, url: str, **kwargs) -> tuple[int, Any]:
+		"""Returns the status too, since 200 and 204 can mean different things. The body is `None` for 204."""
+		return await self._request("DELETE", url, read_json, idempotent = True, **kwargs)
+
+
+	async def close(self):
+		if self._session is not None and not self._session.closed:
+			await self._session.close()
+		self._session = None
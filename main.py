@@ -12,6 +12,7 @@ load_dotenv()
 
 version = "2.5.2"
 persistent_views_count = 2
+db_reader_count = 2 # amount of reader connections kept open for each database file
 
 
 # intents are required for the bot to function
@@ -49,51 +50,66 @@ for cog_name in listdir(cog_location):
 	cogs.append(f"{cog_location}.{cog_name[:-3]}")
 
 
-bot = TF2CCBot(
-	version = version,
-	debug_level = INFO,
-	valid_guild_ids = valid_guild_ids,
-	cogs = tuple(cogs),
-	#activity = Game(f"{COMMAND_PREFIXhelp for more info}")
-	command_prefix = None, # currently no command prefix - this would be for prefix commands
-	help_command = None, # remove the default help command
-	intents = intents,
-	case_insensitive = True, # can be upper or lower case command prefix
-	max_messages = None # do not store any messages in the cache
-)
-bot.persistent_views_count = persistent_views_count
-
-
-@bot.slash_command(name = "stop", guild_ids = [test_guild_id])
-async def stop_bot(intr: Interaction):
-	# shut down the bot
-	bot.log.debug("stop slash cmd - Stopping TF2CC Bot")
-	await intr.send("Stopping TF2CC Bot", ephemeral = True)
-	await bot.close()
-
-
-@bot.slash_command(name = "reload_cog", guild_ids = [test_guild_id])
-async def reload_cog(intr: Interaction, cog_name: str):
-	# reload a cog
-	# if changes were made in the cog file, then they will reflect on the bot after reloading the cog
-	if cog_name not in bot.loaded_cogs:
-		await intr.send(f"Invalid cog name: `{cog_name}`.", ephemeral = True)
-		return
-	
-	await intr.response.defer(ephemeral = True)
-	bot.reload_extension(cog_name)
-	await bot.sync_application_commands()
-	bot.log.debug(f"reloaded cog {cog_name!r}")
-	await intr.send(f"Reloaded `{cog_name}`.")
-
-@reload_cog.on_autocomplete("cog_name")
-async def reload_cog_autocomplete(intr: Interaction, cog_name: str):
-	cog_names = bot.loaded_cogs[:]
-	if cog_name:
-		cog_names = [cog for cog in cog_names if cog_name.lower() in cog.lower()]
-	cog_names = cog_names[:25] # can only have 25 options
-	await intr.response.send_autocomplete(cog_names)
+# the bot is only made when this file is run, not when it is imported
+# e.g. the backfill's worker processes import this file again and should not start a second bot
+def make_bot() -> TF2CCBot:
+	bot = TF2CCBot(
+		version = version,
+		debug_level = INFO,
+		valid_guild_ids = valid_guild_ids,
+		cogs = tuple(cogs),
+		db_reader_count = db_reader_count,
+		#activity = Game(f"{COMMAND_PREFIXhelp for more info}")
+		command_prefix = None, # currently no command prefix - this would be for prefix commands
+		help_command = None, # remove the default help command
+		intents = intents,
+		case_insensitive = True, # can be upper or lower case command prefix
+		max_messages = None # do not store any messages in the cache
+	)
+	bot.persistent_views_count = persistent_views_count
+
+
+	@bot.slash_command(name = "stop", guild_ids = [test_guild_id])
+	async def stop_bot(intr: Interaction):
+		# shut down the bot
+		bot.log.debug("stop slash cmd - Stopping TF2CC Bot")
+		await intr.send("Stopping TF2CC Bot", ephemeral = True)
+		await bot.close()
+
+
+	@bot.slash_command(name = "http_stats", guild_ids = [test_guild_id])
+	async def http_stats(intr: Interaction):
+		# request, retry and circuit counters for every host the bot has called
+		stats = bot.http_client.stats
+		lines = [f"`{host}` - " + ", ".join([f"{name}: {value}" for name, value in sorted(counters.items())]) for host, counters in stats.items()]
+		await intr.send("\n".join(lines) or "No http requests made yet.", ephemeral = True)
+
+
+	@bot.slash_command(name = "reload_cog", guild_ids = [test_guild_id])
+	async def reload_cog(intr: Interaction, cog_name: str):
+		# reload a cog
+		# if changes were made in the cog file, then they will reflect on the bot after reloading the cog
+		if cog_name not in bot.loaded_cogs:
+			await intr.send(f"Invalid cog name: `{cog_name}`.", ephemeral = True)
+			return
+
+		await intr.response.defer(ephemeral = True)
+		bot.reload_extension(cog_name)
+		await bot.sync_application_commands()
+		bot.log.debug(f"reloaded cog {cog_name!r}")
+		await intr.send(f"Reloaded `{cog_name}`.")
+
+	@reload_cog.on_autocomplete("cog_name")
+	async def reload_cog_autocomplete(intr: Interaction, cog_name: str):
+		cog_names = bot.loaded_cogs[:]
+		if cog_name:
+			cog_names = [cog for cog in cog_names if cog_name.lower() in cog.lower()]
+		cog_names = cog_names[:25] # can only have 25 options
+		await intr.response.send_autocomplete(cog_names)
+
+	return bot
 
 
 if __name__ == "__main__":
+	bot = make_bot()
 	bot.run(getenv("BOT_TOKEN"))
@@ -1,5 +1,7 @@
 # any hard coded variables / settings go here
 
+from os import getenv
+
 # TF2 RGL competitive maps
 # these will need to be updated every season
 COMP_MAPS = [
@@ -24,8 +26,14 @@ COMP_MAPS = [
 ]
 
 # LOGS API
-LOGS_API_GET_LOG = "https://logs.tf/json/{log_id}"
-LOGS_API_GET_LOG_IDS = "https://logs.tf/api/v1/log?player={steam_ids}&limit=1"
+# the base urls can be changed with environment variables, e.g. to use tools/fakeapis.py while testing
+LOGS_API_BASE_URL = getenv("LOGS_API_BASE_URL", "https://logs.tf")
+LOGS_API_GET_LOG = LOGS_API_BASE_URL + "/json/{log_id}"
+LOGS_API_GET_LOG_IDS = LOGS_API_BASE_URL + "/api/v1/log?player={steam_ids}&limit=5"
+LOGS_API_SEARCH = LOGS_API_BASE_URL + "/api/v1/log?player={steam_ids}&limit={limit}&offset={offset}"
+
+# SERVEME API
+SERVEME_API_BASE_URL = getenv("SERVEME_API_BASE_URL", "https://na.serveme.tf")
 
 # TF2CC Guild Info
 class TF2CC:
@@ -99,3 +107,13 @@ class TF2CC:
 		"8": "<:sniper:736698205315661864>",
 		"9": "<:spy:736695847429079051>"
 	}
+	# 1 scout, 2 soldier, 3 pyro, 4 demoman, 5 heavy, 6 engineer, 7 medic, 8 sniper, 9 spy
+	class_numbers = ("1", "2", "3", "4", "5", "6", "7", "8", "9")
+	# classes each team needs for a team size, "0" is any class but medic
+	# team sizes not listed only need one medic, so each team gets at most one med locked player
+	class_slots = {
+		2: ("2", "7"), # ultiduo
+		4: ("1", "2", "4", "7"), # 4v4
+		6: ("1", "1", "2", "2", "4", "7"), # 6s
+		9: ("1", "2", "3", "4", "5", "6", "7", "8", "9") # highlander
+	}
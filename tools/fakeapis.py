@@ -0,0 +1,245 @@
+# local stand-in for the logs.tf and serveme apis, for testing and load testing without the internet
+#
+# python -m tools.fakeapis [--port 8089] [--record] [--latency 0.2] [--rate-limit-every 10] [--failure-rate 0.05]
+# then start the bot with
+#   LOGS_API_BASE_URL=http://127.0.0.1:8089 SERVEME_API_BASE_URL=http://127.0.0.1:8089
+#
+# replay (default): everything is served from the fixtures folder and logs added with FakeAPIs.add_log
+# record: requests the fixtures don't cover are sent to the real sites and saved as fixtures.
+#   only logs.tf searches, logs and serveme find_servers are recorded. reservations are never made on the real serveme.
+
+import argparse, asyncio, json, os
+from aiohttp import ClientSession, web
+from collections import Counter
+from dataclasses import dataclass
+from itertools import count
+from random import Random
+from time import time
+from typing import Optional
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+REAL_LOGS_API = "https://logs.tf"
+REAL_SERVEME_API = "https://na.serveme.tf"
+STEAM_ID64_BASE = 76561197960265728
+
+
+@dataclass
+class Faults:
+	latency: float = 0.0 # seconds added to every response
+	latency_jitter: float = 0.0 # up to this many more seconds, random
+	rate_limit_every: int = 0 # every nth request gets a 429
+	retry_after: float = 1.0 # Retry-After header sent with a 429
+	failure_rate: float = 0.0 # part of requests that get a 500
+	seed: int = 0
+
+
+class FakeAPIs:
+	"""aiohttp app that answers like logs.tf and serveme.
+
+Use it in-process with `async with FakeAPIs() as fake:` and point the bot at `fake.base_url`,
+or run this file to serve it on a port. `requests` counts requests per route for checking how many calls were made."""
+	def __init__(self, *, fixtures_dir: str = FIXTURES_DIR, faults: Faults = None, record: bool = False, shift_dates: bool = False, host: str = "127.0.0.1", port: int = 0):
+		self.fixtures_dir = fixtures_dir
+		self.faults = faults or Faults()
+		self.record = record
+		self.host = host
+		self.port = port
+		self.requests: Counter[str] = Counter()
+		self.logs: dict[int, dict] = dict()
+		self.reservations: dict[int, dict] = dict()
+		self._random = Random(self.faults.seed)
+		self._request_count = count(1)
+		self._reservation_ids = count(1000)
+		self._runner: Optional[web.AppRunner] = None
+		self._upstream: Optional[ClientSession] = None
+		self._load_logs()
+		if shift_dates and self.logs:
+			# make the newest fixture log look like it was just uploaded
+			offset = int(time()) - max(self._log_date(log) for log in self.logs.values())
+			for log in self.logs.values():
+				log.setdefault("info", dict())["date"] = self._log_date(log) + offset
+
+	@property
+	def base_url(self) -> str:
+		return f"http://{self.host}:{self.port}"
+
+	def _fixture_path(self, *parts: str) -> str:
+		return os.path.join(self.fixtures_dir, *parts)
+
+	def _load_logs(self):
+		logs_dir = self._fixture_path("logs")
+		if not os.path.isdir(logs_dir):
+			return
+		for name in os.listdir(logs_dir):
+			if name.endswith(".json") and name[:-5].isdigit():
+				with open(os.path.join(logs_dir, name)) as file:
+					self.logs[int(name[:-5])] = json.load(file)
+
+	def _save_fixture(self, data: dict, *parts: str):
+		path = self._fixture_path(*parts)
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		with open(path, "w") as file:
+			json.dump(data, file)
+
+	@staticmethod
+	def _log_date(log: dict) -> int:
+		return log.get("info", dict()).get("date", 0)
+
+	@staticmethod
+	def _log_steam_ids(log: dict) -> set[int]:
+		return {STEAM_ID64_BASE + int(player_id[5:-1]) for player_id in log.get("players", dict())}
+
+	def add_log(self, log_id: int, log: dict, date: int = None):
+		"""Adds a log to search and serve, uploaded at `date` (default now)."""
+		log.setdefault("info", dict())["date"] = int(time()) if date is None else date
+		self.logs[log_id] = log
+
+	# ~~~ faults ~~~
+
+	@web.middleware
+	async def _inject_faults(self, request: web.Request, handler):
+		self.requests[request.match_info.route.resource.canonical if request.match_info.route.resource else request.path] += 1
+		faults = self.faults
+		delay = faults.latency + (self._random.random() * faults.latency_jitter if faults.latency_jitter else 0)
+		if delay:
+			await asyncio.sleep(delay)
+		number = next(self._request_count)
+		if faults.rate_limit_every and number % faults.rate_limit_every == 0:
+			return web.json_response({"error": "rate limited"}, status = 429, headers = {"Retry-After": str(faults.retry_after)})
+		if faults.failure_rate and self._random.random() < faults.failure_rate:
+			return web.json_response({"error": "injected failure"}, status = 500)
+		return await handler(request)
+
+	# ~~~ logs.tf ~~~
+
+	async def _upstream_json(self, method: str, url: str, **kwargs) -> dict:
+		if self._upstream is None:
+			self._upstream = ClientSession()
+		async with self._upstream.request(method, url, **kwargs) as response:
+			response.raise_for_status()
+			return await response.json()
+
+	async def search_logs(self, request: web.Request) -> web.Response:
+		steam_ids = {int(steam_id) for steam_id in request.query.get("player", "").split(",") if steam_id}
+		limit = int(request.query.get("limit", 1000))
+		offset = int(request.query.get("offset", 0))
+		if self.record:
+			found = await self._upstream_json("GET", REAL_LOGS_API + "/api/v1/log", params = request.query)
+			for log in found.get("logs", list()):
+				if log["id"] not in self.logs:
+					payload = await self._upstream_json("GET", f"{REAL_LOGS_API}/json/{log['id']}")
+					self._save_fixture(payload, "logs", f"{log['id']}.json")
+					self.logs[log["id"]] = payload
+
+		matches = [(log_id, log) for log_id, log in self.logs.items() if steam_ids <= self._log_steam_ids(log)]
+		matches.sort(key = lambda item: self._log_date(item[1]), reverse = True)
+		logs = [
+			{
+				"id": log_id,
+				"title": log.get("info", dict()).get("title", ""),
+				"map": log.get("info", dict()).get("map", ""),
+				"date": self._log_date(log),
+				"views": 0,
+				"players": len(log.get("players", dict()))
+			}
+			for log_id, log in matches[offset:offset + limit]
+		]
+		return web.json_response({"success": True, "results": len(logs), "total": len(matches), "parameters": dict(request.query), "logs": logs})
+
+	async def get_log(self, request: web.Request) -> web.Response:
+		log_id = int(request.match_info["log_id"])
+		if log_id not in self.logs and self.record:
+			payload = await self._upstream_json("GET", f"{REAL_LOGS_API}/json/{log_id}")
+			self._save_fixture(payload, "logs", f"{log_id}.json")
+			self.logs[log_id] = payload
+		if log_id not in self.logs:
+			return web.json_response({"success": False, "error": "Log not found."}, status = 404)
+		return web.json_response(self.logs[log_id])
+
+	# ~~~ serveme ~~~
+
+	async def find_servers(self, request: web.Request) -> web.Response:
+		path = self._fixture_path("serveme", "find_servers.json")
+		if self.record:
+			payload = await self._upstream_json("POST", REAL_SERVEME_API + "/api/reservations/find_servers", json = await request.json(), headers = {"Authorization": request.headers.get("Authorization", "")})
+			self._save_fixture(payload, "serveme", "find_servers.json")
+			return web.json_response(payload)
+		with open(path) as file:
+			payload: dict = json.load(file)
+		payload["reservation"] = {**payload.get("reservation", dict()), **(await request.json()).get("reservation", dict())}
+		return web.json_response(payload)
+
+	async def create_reservation(self, request: web.Request) -> web.Response:
+		details: dict = (await request.json()).get("reservation", dict())
+		with open(self._fixture_path("serveme", "find_servers.json")) as file:
+			servers: list[dict] = json.load(file)["servers"]
+		server = next((server for server in servers if server["id"] == details.get("server_id")), None)
+		if server is None:
+			return web.json_response({"reservation": {"errors": {"server": {"error": "can't be blank"}}}}, status = 400)
+		reservation = {**details, "id": next(self._reservation_ids), "server": server}
+		self.reservations[reservation["id"]] = reservation
+		return web.json_response({"reservation": reservation})
+
+	async def end_reservation(self, request: web.Request) -> web.Response:
+		reservation = self.reservations.pop(int(request.match_info["reservation_id"]), None)
+		if reservation is None:
+			return web.Response(status = 204) # already ended
+		return web.json_response({"reservation": reservation})
+
+	# ~~~ running ~~~
+
+	def make_app(self) -> web.Application:
+		app = web.Application(middlewares = [self._inject_faults])
+		app.router.add_get("/api/v1/log", self.search_logs)
+		app.router.add_get("/json/{log_id:\\d+}", self.get_log)
+		app.router.add_post("/api/reservations/find_servers", self.find_servers)
+		app.router.add_post("/api/reservations/", self.create_reservation)
+		app.router.add_delete("/api/reservations/{reservation_id:\\d+}", self.end_reservation)
+		return app
+
+	async def start(self):
+		self._runner = web.AppRunner(self.make_app())
+		await self._runner.setup()
+		site = web.TCPSite(self._runner, self.host, self.port)
+		await site.start()
+		self.port = site._server.sockets[0].getsockname()[1] # the real port if 0 was asked for
+
+	async def close(self):
+		if self._runner is not None:
+			await self._runner.cleanup()
+		if self._upstream is not None:
+			await self._upstream.close()
+
+	async def __aenter__(self) -> "FakeAPIs":
+		await self.start()
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+
+async def serve(fake: FakeAPIs):
+	async with fake:
+		print(f"fake logs.tf and serveme on {fake.base_url} ({len(fake.logs)} logs, {'record' if fake.record else 'replay'})")
+		print(f"LOGS_API_BASE_URL={fake.base_url} SERVEME_API_BASE_URL={fake.base_url}")
+		await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Fake logs.tf and serveme APIs")
+	parser.add_argument("--port", type = int, default = 8089)
+	parser.add_argument("--record", action = "store_true", help = "fetch and save what the fixtures don't have")
+	parser.add_argument("--shift-dates", action = "store_true", help = "make the newest fixture log look just uploaded")
+	parser.add_argument("--latency", type = float, default = 0.0)
+	parser.add_argument("--latency-jitter", type = float, default = 0.0)
+	parser.add_argument("--rate-limit-every", type = int, default = 0)
+	parser.add_argument("--retry-after", type = float, default = 1.0)
+	parser.add_argument("--failure-rate", type = float, default = 0.0)
+	parser.add_argument("--seed", type = int, default = 0)
+	args = parser.parse_args()
+	faults = Faults(args.latency, args.latency_jitter, args.rate_limit_every, args.retry_after, args.failure_rate, args.seed)
+	try:
+		asyncio.run(serve(FakeAPIs(faults = faults, record = args.record, shift_dates = args.shift_dates, port = args.port)))
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,92 @@
+# benchmarks parsing logs.tf logs into LogInfo
+# uses the logs in the on-disk log cache if there are any, otherwise a generated 9v9 log
+#
+# python -m tools.logbench [count]
+
+import gzip, json, os, sys, tracemalloc
+from random import randint, seed
+from time import perf_counter
+from cogs.static import LOG_CACHE_DIR
+from cogs.TF2cchelper import LogInfo
+
+
+CLASSES = ("scout", "soldier", "pyro", "demoman", "heavyweapons", "engineer", "medic", "sniper", "spy")
+
+
+def make_log(player_count: int = 18) -> dict:
+	# roughly the shape and size of a real log
+	players = dict()
+	for i in range(player_count):
+		players[f"[U:1:{100000 + i}]"] = {
+			"team": "Red" if i % 2 else "Blue",
+			"class_stats": [{
+				"type": CLASSES[i % 9], "kills": randint(0, 30), "assists": randint(0, 20), "deaths": randint(0, 30), "dmg": randint(0, 9000), "total_time": randint(600, 1800),
+				"weapon": {f"weapon_{w}": {"kills": randint(0, 10), "dmg": randint(0, 3000), "avg_dmg": randint(10, 90), "shots": randint(0, 500), "hits": randint(0, 300)} for w in range(4)}
+			} for _ in range(2)],
+			"kills": randint(0, 30), "deaths": randint(0, 30), "assists": randint(0, 20), "suicides": 0, "kapd": "1.2", "kpd": "0.9",
+			"dmg": randint(0, 9000), "dmg_real": randint(0, 2000), "dt": randint(0, 9000), "dt_real": randint(0, 2000), "hr": randint(0, 3000),
+			"lks": randint(0, 8), "as": randint(0, 5), "dapd": randint(0, 400), "dapm": randint(0, 400), "ubers": randint(0, 10), "drops": randint(0, 2),
+			"ubertypes": {"medigun": randint(0, 10)}, "medkits": randint(0, 40), "medkits_hp": randint(0, 2000), "backstabs": 0, "headshots": 0, "headshots_hit": 0,
+			"sentries": 0, "heal": randint(0, 20000), "cpc": randint(0, 10), "ic": 0
+		}
+	return {
+		"version": 3,
+		"teams": {
+			team: {"score": randint(0, 5), "kills": randint(0, 200), "deaths": 0, "dmg": randint(0, 60000), "charges": randint(0, 20), "drops": 0, "firstcaps": randint(0, 5), "caps": randint(0, 20)}
+			for team in ("Red", "Blue")
+		},
+		"length": randint(900, 1800),
+		"players": players,
+		"names": {player_id: f"player {i}" for i, player_id in enumerate(players)},
+		"rounds": [{"start_time": 0, "winner": "Red", "length": 300, "events": [{"type": "pointcap", "time": t, "team": "Red", "point": 1} for t in range(40)]} for _ in range(5)],
+		"healspread": {player_id: {other: randint(0, 5000) for other in players} for player_id in players},
+		"classkills": {player_id: {c: randint(0, 5) for c in CLASSES} for player_id in players},
+		"chat": [{"steamid": player_id, "name": "x", "msg": "gg"} for player_id in players],
+		"info": {"map": "cp_process_final", "total_length": 1800, "uploader": {"id": "0", "name": "x"}},
+	}
+
+
+def load_logs(count: int) -> list[bytes]:
+	raw: list[bytes] = list()
+	if os.path.isdir(LOG_CACHE_DIR):
+		for name in sorted(os.listdir(LOG_CACHE_DIR))[:count]:
+			if name.endswith(".json.gz"):
+				with gzip.open(os.path.join(LOG_CACHE_DIR, name), "rb") as file:
+					raw.append(file.read())
+	if not raw:
+		seed(0)
+		raw = [json.dumps(make_log()).encode() for _ in range(count)]
+	return raw
+
+
+def retained_bytes(make) -> int:
+	# bytes still allocated after `make` returns, i.e. what keeping its result costs
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	kept = make()
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del kept
+	return after - before
+
+
+def main(count: int):
+	raw = load_logs(count)
+	payloads = [json.loads(data) for data in raw]
+
+	start = perf_counter()
+	for _ in range(10):
+		for payload in payloads:
+			LogInfo(payload)
+	parse_us = (perf_counter() - start) / (10 * len(payloads)) * 1e6
+
+	payload_bytes = retained_bytes(lambda: [json.loads(data) for data in raw]) / len(raw)
+	info_bytes = retained_bytes(lambda: [LogInfo(json.loads(data)) for data in raw]) / len(raw)
+
+	print(f"{len(raw)} logs, {sum(map(len, raw)) / len(raw) / 1024:.1f} KB of json each")
+	print(f"LogInfo parse: {parse_us:.1f} us per log")
+	print(f"kept per log: full payload {payload_bytes / 1024:.1f} KB | LogInfo {info_bytes / 1024:.1f} KB | {payload_bytes / max(info_bytes, 1):.0f}x smaller")
+
+
+if __name__ == "__main__":
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)